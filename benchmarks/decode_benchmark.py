@@ -0,0 +1,112 @@
+"""
+Measures how long decoding listed MediaItems takes per item, and how much memory the
+decoded MediaItems hold on to, as they're listed (`lazy`) and once their
+`mediaMetadata` has been fully decoded (`decoded`).
+
+Usage:
+    $ poetry run python benchmarks/decode_benchmark.py --media-items 1000000
+"""
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+from google_photos_archiver.rest_client import (
+    MEDIA_ITEMS_MAX_PAGE_SIZE,
+    PaginationResponseKey,
+    create_album_or_media_item,
+)
+
+
+def _page(start: int, page_size: int) -> str:
+    return json.dumps(
+        {
+            "mediaItems": [
+                dict(
+                    id=f"AF1QipN{i:040d}",
+                    productUrl=f"https://photos.google.com/lr/photo/AF1QipN{i:040d}",
+                    baseUrl=f"https://lh3.googleusercontent.com/lr/AF1QipN{i:0120d}",
+                    mimeType="image/jpeg",
+                    filename=f"IMG_{i:08d}.jpg",
+                    mediaMetadata=dict(
+                        creationTime="2021-01-01T00:00:00Z",
+                        width="4032",
+                        height="3024",
+                        photo=dict(
+                            cameraMake="Google",
+                            cameraModel="Pixel 5",
+                            focalLength=4.38,
+                            apertureFNumber=1.73,
+                            isoEquivalent=62,
+                            exposureTime="0.008333333s",
+                        ),
+                    ),
+                )
+                for i in range(start, start + page_size)
+            ]
+        }
+    )
+
+
+def _decode(pages: List[List[Dict[str, Any]]], fully: bool) -> List[Any]:
+    media_items = []
+    for page in pages:
+        for media_item_dict in page:
+            media_item = create_album_or_media_item(
+                media_item_dict, PaginationResponseKey.MediaItems
+            )
+            if fully:
+                media_item.mediaMetadata  # pylint: disable=pointless-statement
+            media_items.append(media_item)
+    return media_items
+
+
+def _parse(pages: List[str]) -> List[List[Dict[str, Any]]]:
+    return [json.loads(page)["mediaItems"] for page in pages]
+
+
+def _run(label: str, pages: List[str], media_items: int, fully: bool):
+    # Parsing the JSON of the responses costs the same however MediaItems are decoded
+    parsed_pages = _parse(pages)
+    gc.collect()
+    start = time.perf_counter()
+    _decode(parsed_pages, fully)
+    elapsed = time.perf_counter() - start
+    del parsed_pages
+
+    # Measured separately, as tracing allocations slows decoding down considerably.
+    # Parsed pages are let go of, leaving only what the MediaItems hold on to
+    gc.collect()
+    tracemalloc.start()
+    decoded = _decode(_parse(pages), fully)
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del decoded
+
+    print(
+        f"{label:>7}: {elapsed / media_items * 1e6:0.2f}us per MediaItem"
+        f" ({elapsed:0.2f}s), {retained / media_items:0.0f} bytes per MediaItem"
+        f" ({retained / 1024 ** 2:0.0f}MiB)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--media-items", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    pages = [
+        _page(start, min(MEDIA_ITEMS_MAX_PAGE_SIZE, args.media_items - start))
+        for start in range(0, args.media_items, MEDIA_ITEMS_MAX_PAGE_SIZE)
+    ]
+
+    _run("lazy", pages, args.media_items, fully=False)
+    _run("decoded", pages, args.media_items, fully=True)
+
+
+if __name__ == "__main__":
+    main()
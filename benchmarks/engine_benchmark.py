@@ -0,0 +1,135 @@
+"""
+Compares the `thread` and `async` download engines against a local fake media server.
+
+Usage:
+    $ poetry run python benchmarks/engine_benchmark.py --media-items 2000 --latency 0.05
+"""
+
+import argparse
+import logging
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import List
+
+from requests.adapters import HTTPAdapter
+
+from google_photos_archiver.archivers import DiskArchiver
+from google_photos_archiver.async_media_item_archiver import (
+    AsyncDiskArchiver,
+    AsyncMediaItemArchiver,
+)
+from google_photos_archiver.http_session import PooledSession
+from google_photos_archiver.media_item import MediaItem, create_media_item
+from google_photos_archiver.media_item_archiver import (
+    MediaItemArchiver,
+    get_new_media_item_archivals,
+)
+from google_photos_archiver.media_item_recorder import MediaItemRecorder
+
+
+def _fake_media_server(payload: bytes, latency: float) -> ThreadingHTTPServer:
+    class FakeMediaHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeMediaHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _media_items(base_url: str, count: int) -> List[MediaItem]:
+    return [
+        create_media_item(
+            dict(
+                id=f"id{i}",
+                productUrl=base_url,
+                baseUrl=f"{base_url}/{i}",
+                mimeType="image/jpeg",
+                filename=f"{i}.jpg",
+                mediaMetadata=dict(
+                    creationTime="2021-01-01T00:00:00Z",
+                    width="1",
+                    height="1",
+                    photo=dict(),
+                ),
+            )
+        )
+        for i in range(count)
+    ]
+
+
+def _run(label: str, media_item_archiver, media_items: List[MediaItem]):
+    start = time.perf_counter()
+    try:
+        archived = get_new_media_item_archivals(media_item_archiver.start(media_items))
+    finally:
+        # Commits what's been recorded and closes the db before its directory goes away
+        media_item_archiver.archiver.close()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:>7}: archived {archived} MediaItem(s) in {elapsed:0.2f}s"
+        f" ({archived / elapsed:0.1f} items/s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--media-items", type=int, default=1000)
+    parser.add_argument("--payload-bytes", type=int, default=256 * 1024)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--max-threadpool-workers", type=int, default=100)
+    parser.add_argument("--max-concurrent-downloads", type=int, default=500)
+    args = parser.parse_args()
+
+    logging.getLogger("google_photos_archiver").setLevel(logging.WARNING)
+
+    server = _fake_media_server(bytes(args.payload_bytes), args.latency)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    with tempfile.TemporaryDirectory() as thread_dir:
+        session = PooledSession(media_pool_maxsize=args.max_threadpool_workers)
+        session.mount("http://", HTTPAdapter(pool_maxsize=args.max_threadpool_workers))
+        _run(
+            "thread",
+            MediaItemArchiver(
+                DiskArchiver(
+                    Path(thread_dir),
+                    MediaItemRecorder(Path(thread_dir, "media_items.db")),
+                    session=session,
+                ),
+                max_threadpool_workers=args.max_threadpool_workers,
+            ),
+            _media_items(base_url, args.media_items),
+        )
+
+    with tempfile.TemporaryDirectory() as async_dir:
+        _run(
+            "async",
+            AsyncMediaItemArchiver(
+                AsyncDiskArchiver(
+                    Path(async_dir),
+                    MediaItemRecorder(Path(async_dir, "media_items.db")),
+                ),
+                max_concurrent_downloads=args.max_concurrent_downloads,
+            ),
+            _media_items(base_url, args.media_items),
+        )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Measures how long `MediaItemRecorder` takes to load every recorded MediaItem id at
+startup, how much memory they take up, and how long skip checks (`lookup`) take per
+MediaItem compared to querying the sqlite db for each of them.
+
+Usage:
+    $ poetry run python benchmarks/recorder_benchmark.py --media-items 1000000
+"""
+
+import argparse
+import gc
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import List
+
+from google_photos_archiver.media_item import MediaItem, create_media_item
+from google_photos_archiver.media_item_recorder import MediaItemRecorder
+
+
+def _media_item_id(i: int) -> str:
+    return f"AF1QipN{i:040d}"
+
+
+def _media_items(start: int, count: int) -> List[MediaItem]:
+    return [
+        create_media_item(
+            dict(
+                id=_media_item_id(i),
+                productUrl="https://photos.google.com",
+                baseUrl="https://lh3.googleusercontent.com",
+                mimeType="image/jpeg",
+                filename=f"IMG_{i:08d}.jpg",
+                mediaMetadata=dict(
+                    creationTime="2021-01-01T00:00:00Z",
+                    width="4032",
+                    height="3024",
+                    photo=dict(),
+                ),
+            )
+        )
+        for i in range(start, start + count)
+    ]
+
+
+def _record(sqlite_db_path: Path, media_items: int):
+    MediaItemRecorder(sqlite_db_path).close()
+    with sqlite3.connect(sqlite_db_path) as connection:
+        connection.executemany(
+            "INSERT INTO media_items(media_item_id) values (?)",
+            ((_media_item_id(i),) for i in range(media_items)),
+        )
+
+
+def _time_per_lookup(lookup, media_items: List[MediaItem]) -> float:
+    start = time.perf_counter()
+    for media_item in media_items:
+        lookup(media_item)
+    return (time.perf_counter() - start) / len(media_items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--media-items", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=100_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sqlite_db_path = Path(tmp_dir, "media_items.db")
+        _record(sqlite_db_path, args.media_items)
+
+        gc.collect()
+        start = time.perf_counter()
+        MediaItemRecorder(sqlite_db_path).close()
+        load_time = time.perf_counter() - start
+
+        # Measured separately, as tracing allocations slows loading down considerably
+        gc.collect()
+        tracemalloc.start()
+        recorder = MediaItemRecorder(sqlite_db_path)
+        gc.collect()
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(
+            f"startup: loaded {args.media_items} id(s) in {load_time:0.2f}s,"
+            f" {retained / args.media_items:0.0f} bytes per id"
+            f" ({retained / 1024 ** 2:0.0f}MiB)"
+        )
+
+        lookups = min(args.lookups, args.media_items)
+        known = _media_items(0, lookups)
+        unknown = _media_items(args.media_items, lookups)
+
+        connection = sqlite3.connect(sqlite_db_path)
+
+        def sqlite_lookup(media_item: MediaItem) -> bool:
+            return (
+                connection.execute(
+                    "SELECT 1 FROM media_items WHERE media_item_id = ?",
+                    (media_item.id,),
+                ).fetchone()
+                is not None
+            )
+
+        for label, lookup in [("memory", recorder.lookup), ("sqlite", sqlite_lookup)]:
+            print(
+                f"{label:>7}: {_time_per_lookup(lookup, known) * 1e6:0.2f}us per known"
+                f" id, {_time_per_lookup(lookup, unknown) * 1e6:0.2f}us per unknown id"
+            )
+
+        connection.close()
+        recorder.close()
+
+
+if __name__ == "__main__":
+    main()
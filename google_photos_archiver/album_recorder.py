@@ -0,0 +1,114 @@
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from google_photos_archiver.album import Album
+from google_photos_archiver.media_item import MediaItem
+
+# How long a connection waits on a lock held by another one before giving up
+_BUSY_TIMEOUT_SECONDS = 30.0
+
+
+@dataclass
+class RecordedAlbum:
+    id: str
+    title: Optional[str]
+    # Relative to the download path
+    media_item_paths: List[Path]
+
+
+class AlbumRecorder:
+    """
+    Persists Albums and the MediaItems that they include to a sqlite db, so that the
+    symlinks of every Album can be rebuilt without listing them again
+    """
+
+    def __init__(self, sqlite_db_path: Path):
+        self.sqlite_db_path = sqlite_db_path
+
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+        with self.connection as _connection:
+            _connection.execute("""CREATE TABLE IF NOT EXISTS albums (
+                    album_id varchar unique primary key,
+                    title varchar
+                )""")
+            _connection.execute("""CREATE TABLE IF NOT EXISTS album_media_items (
+                    album_id varchar not null,
+                    media_item_id varchar not null,
+                    media_item_path varchar not null,
+                    PRIMARY KEY (album_id, media_item_id)
+                )""")
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Only ever used by the thread that opened it, but closed by `close`
+            connection = sqlite3.connect(
+                self.sqlite_db_path,
+                timeout=_BUSY_TIMEOUT_SECONDS,
+                check_same_thread=False,
+            )
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def add(self, album: Album, media_items: List[MediaItem]):
+        """
+        Replaces whatever was recorded for `album` before, as `media_items` are meant to
+        be all of its MediaItems
+        """
+        with self.connection as _connection:
+            _connection.execute(
+                "INSERT OR REPLACE INTO albums(album_id, title) VALUES (?, ?)",
+                (album.id, album.title),
+            )
+            _connection.execute(
+                "DELETE FROM album_media_items WHERE album_id = ?", (album.id,)
+            )
+            _connection.executemany(
+                "INSERT OR REPLACE INTO album_media_items"
+                "(album_id, media_item_id, media_item_path) VALUES (?, ?, ?)",
+                [
+                    (
+                        album.id,
+                        media_item.id,
+                        str(media_item.get_relative_download_path()),
+                    )
+                    for media_item in media_items
+                ],
+            )
+
+    def get_albums(self) -> List[RecordedAlbum]:
+        with self.connection as _connection:
+            albums: Dict[str, RecordedAlbum] = {
+                album_id: RecordedAlbum(id=album_id, title=title, media_item_paths=[])
+                for album_id, title in _connection.execute(
+                    "SELECT album_id, title FROM albums"
+                )
+            }
+            for album_id, media_item_path in _connection.execute(
+                "SELECT album_id, media_item_path FROM album_media_items"
+                " ORDER BY album_id, media_item_path"
+            ):
+                albums[album_id].media_item_paths.append(Path(media_item_path))
+
+        return list(albums.values())
+
+    def close(self):
+        """
+        Closes every connection. The recorder can still be used afterwards, reopening
+        connections as needed
+        """
+        with self._connections_lock:
+            connections = self._connections
+            self._connections = []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
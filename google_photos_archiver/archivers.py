@@ -1,59 +1,592 @@
+import concurrent.futures
+import hashlib
 import logging
+import os
+import threading
+from concurrent.futures.thread import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
-from typing import Optional
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional, Tuple
 
-from google_photos_archiver.media_item import MediaItem
+import requests
+
+from google_photos_archiver.fsync_policy import FsyncPolicy
+from google_photos_archiver.media_item import (
+    DEFAULT_CHUNK_SIZE,
+    PARTIAL_CONTENT,
+    RANGE_NOT_SATISFIABLE,
+    MediaItem,
+)
 from google_photos_archiver.media_item_recorder import MediaItemRecorder
+from google_photos_archiver.rate_limiter import RateLimiter
+from google_photos_archiver.retry import RetryPolicy
 
 logger = logging.getLogger(__name__)
 
+PART_SUFFIX = ".part"
+# Segmented downloads are written to a different sidecar, as a `.part` file's size
+# is where its download gets resumed from, which doesn't hold for a preallocated file
+SEGMENTED_PART_SUFFIX = ".segmented.part"
+
+DEFAULT_DOWNLOAD_SEGMENTS = 4
+
+# Where content addressed archives keep one copy of each distinct file, by its checksum
+BLOBS_DIRECTORY = ".blobs"
+LINK_SUFFIX = ".link"
+
+
+def get_part_path(media_item_path: Path) -> Path:
+    """
+    In-progress downloads are written to a `<name>.part` sidecar and only renamed into
+    place once complete, so a file at `media_item_path` is never a truncated download
+    """
+    return media_item_path.with_name(media_item_path.name + PART_SUFFIX)
+
+
+def get_segmented_part_path(media_item_path: Path) -> Path:
+    return media_item_path.with_name(media_item_path.name + SEGMENTED_PART_SUFFIX)
+
+
+def get_segment_ranges(size: int, segments: int) -> List[Tuple[int, int]]:
+    """
+    Splits `size` bytes into up to `segments` (start, end) byte ranges. As with `Range`
+    headers, `end` is inclusive
+    """
+    segment_size = -(-size // segments)
+    return [
+        (start, min(start + segment_size, size) - 1)
+        for start in range(0, size, segment_size)
+    ]
+
+
+def get_blob_path(base_download_path: Path, sha256: str) -> Path:
+    return Path(base_download_path, BLOBS_DIRECTORY, sha256[:2], sha256)
+
+
+def update_sha256(
+    sha256: Any, f: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> int:
+    """
+    Feeds whatever is left of `f` into the `hashlib.sha256()` object `sha256`. Returns
+    the number of bytes read
+    """
+    bytes_read = 0
+    for chunk in iter(lambda: f.read(chunk_size), b""):
+        sha256.update(chunk)
+        bytes_read += len(chunk)
+    return bytes_read
+
+
+def get_resume_offset(part_path: Path) -> int:
+    """
+    The size of a `.part` file is the offset that its download can be resumed from
+    """
+    try:
+        return part_path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def get_write_offset(
+    requested_offset: int, status_code: int, content_range: Optional[str]
+) -> Optional[int]:
+    """
+    Determines where a response body belongs in a `.part` file that a `Range` request
+    was made for. Returns `None` if the `.part` file already holds the entire MediaItem
+    """
+    if requested_offset == 0 or status_code == PARTIAL_CONTENT:
+        return requested_offset
+
+    if status_code == RANGE_NOT_SATISFIABLE:
+        # Ref: https://developer.mozilla.org/en-US/docs/Web/HTTP/Status/416
+        # e.g. `Content-Range: bytes */12345`
+        if content_range is not None and content_range.endswith(f"/{requested_offset}"):
+            return None
+        raise PartialDownloadError(
+            f"Unable to resume from offset: {requested_offset} (got: {content_range})"
+        )
+
+    # The server ignored the `Range` header and is sending everything from the start
+    return 0
+
+
+@dataclass
+class WrittenFile:
+    # Excludes whatever a previous run left behind in the `.part` file
+    bytes_written: int
+    size: int
+    sha256: str
+
+
+class PartialDownloadError(RuntimeError):
+    pass
+
+
+def get_symlink_target(album_path: Path, media_item_path: Path) -> Path:
+    """
+    Album symlinks point to their MediaItems relative to the Album's directory, so that
+    they keep working wherever the download path is moved or mounted to
+    """
+    return Path(os.path.relpath(media_item_path, album_path))
+
+
+def link_into_album(
+    album_path: Path, media_item_paths: Iterable[Path], repair: bool = False
+) -> int:
+    """
+    Symlinks MediaItems into an Album's directory (See: `get_symlink_target`), creating
+    it and looking up its existing entries only once. With `repair`, symlinks that point elsewhere or to
+    MediaItems that are no longer in the Album are replaced or removed. Anything that
+    isn't a symlink is always left alone. Returns the amount of symlinks that were created
+    """
+    album_path.mkdir(parents=True, exist_ok=True)
+    existing_filenames = set(os.listdir(album_path))
+    symlinks_created = 0
+    symlink_targets_by_filename = {
+        media_item_path.name: get_symlink_target(album_path, media_item_path)
+        for media_item_path in media_item_paths
+    }
+
+    if repair:
+        for filename in existing_filenames.copy():
+            symlink = Path(album_path, filename)
+            if symlink.is_symlink() and os.readlink(symlink) != str(
+                symlink_targets_by_filename.get(filename)
+            ):
+                symlink.unlink()
+                existing_filenames.remove(filename)
+
+    for filename, symlink_target in symlink_targets_by_filename.items():
+        if filename in existing_filenames:
+            continue
+        Path(album_path, filename).symlink_to(symlink_target)
+        symlinks_created += 1
+
+    return symlinks_created
+
+
+class SegmentedDownloadError(PartialDownloadError):
+    pass
+
 
 class Archivable:
     def __init__(self, recorder: MediaItemRecorder):
         self.recorder = recorder
 
-    def archive(self, media_item: MediaItem, album_path: Optional[Path] = None) -> bool:
+    def archive(
+        self,
+        media_item: MediaItem,
+        album_path: Optional[Path] = None,
+        on_recorded: Optional[Callable[[], None]] = None,
+    ) -> bool:
+        """
+        Returns whether the MediaItem was archived rather than skipped. For archived
+        MediaItems, `on_recorded` is called once they have been durably recorded, which
+        may be on another thread, later on
+        """
         raise NotImplementedError(
             f"{self.__class__.__name__} subclasses must implement an archive method"
         )
 
 
 class DiskArchiver(Archivable):
-    def __init__(self, base_download_path: Path, recorder: MediaItemRecorder):
+    # pylint: disable=too-many-arguments,too-many-instance-attributes
+
+    def __init__(
+        self,
+        base_download_path: Path,
+        recorder: MediaItemRecorder,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        session: Optional[requests.Session] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        segment_threshold: Optional[int] = None,
+        download_segments: int = DEFAULT_DOWNLOAD_SEGMENTS,
+        content_addressed: bool = False,
+        fsync_policy: Optional[FsyncPolicy] = None,
+    ):
+        """
+        :param segment_threshold: MediaItems of at least this many bytes are downloaded as
+            `download_segments` concurrent byte ranges. All downloads share a pool of
+            `download_segments - 1` extra connections for this
+        :param content_addressed: Store the content of byte-identical MediaItems only
+            once, as a blob under `BLOBS_DIRECTORY` named by its checksum, that each of
+            their paths is a hardlink to
+        :param fsync_policy: When archived files are fsynced. MediaItems are only
+            recorded once their files have been, so that none is ever skipped on
+            account of a file that a crash truncated
+        """
         super().__init__(recorder)
         base_download_path.mkdir(parents=True, exist_ok=True)
         self.base_download_path = base_download_path
+        self.chunk_size = chunk_size
+        self.session = session
+        self.rate_limiter = RateLimiter() if rate_limiter is None else rate_limiter
+        self.retry_policy = RetryPolicy() if retry_policy is None else retry_policy
+        self.segment_threshold = segment_threshold
+        self.download_segments = download_segments
+        self.content_addressed = content_addressed
+        self.fsync_policy = FsyncPolicy() if fsync_policy is None else fsync_policy
 
-    def archive(self, media_item: MediaItem, album_path: Optional[Path] = None) -> bool:
-        media_item_path = media_item.get_download_path(self.base_download_path)
+        self.bytes_written = 0
+        self._bytes_written_lock = threading.Lock()
+        self._segment_executor: Optional[ThreadPoolExecutor] = (
+            ThreadPoolExecutor(
+                max_workers=download_segments - 1, thread_name_prefix="segment"
+            )
+            if segment_threshold is not None and download_segments > 1
+            else None
+        )
 
-        if album_path is not None:
-            album_path.mkdir(parents=True, exist_ok=True)
-            media_item_in_album = Path(album_path, media_item.filename)
-            logger.info("Symlinking %s to %s", media_item_in_album, media_item_path)
+    def _write_media_item(
+        self,
+        media_item: MediaItem,
+        media_item_path: Path,
+        allow_segments: bool = True,
+    ) -> WrittenFile:
+        """
+        Streams the MediaItem's content to a `.part` file chunk by chunk so that only
+        `chunk_size` bytes are held in memory at any time, resuming from whatever a
+        previous run left behind. The `.part` file is atomically renamed to
+        `media_item_path` once complete. Its checksum is computed from the chunks as
+        they're written, rather than by reading the file back afterwards
+        """
+        part_path = get_part_path(media_item_path)
+        offset = get_resume_offset(part_path)
+        bytes_written = 0
+        sha256 = hashlib.sha256()
+
+        if offset > 0:
+            logger.info("Resuming download of: %s from byte: %d", part_path, offset)
+
+        try:
+            with media_item.get_raw_data_response(
+                session=self.session, offset=offset, retry_policy=self.retry_policy
+            ) as response:
+                segment_ranges = (
+                    self._get_segment_ranges(response)
+                    if allow_segments and offset == 0
+                    else None
+                )
+                if segment_ranges is not None:
+                    part_path = get_segmented_part_path(media_item_path)
+                    bytes_written = self._write_segments(
+                        media_item, response, part_path, segment_ranges
+                    )
+                    # Segments are written out of order, so they can only be hashed
+                    # once they're all in
+                    size = self._hash_and_sync_part(part_path, sha256)
+                else:
+                    write_offset = get_write_offset(
+                        offset,
+                        response.status_code,
+                        response.headers.get("Content-Range"),
+                    )
+                    if write_offset is None:
+                        size = self._hash_and_sync_part(part_path, sha256)
+                    else:
+                        with part_path.open("a+b" if write_offset > 0 else "wb") as f:
+                            if write_offset > 0:
+                                f.seek(0)
+                                update_sha256(sha256, f, self.chunk_size)
+                            bytes_written = self._write_chunks(
+                                response, f, sha256=sha256
+                            )
+                            self.fsync_policy.sync_file(f)
+                        size = write_offset + bytes_written
+        except SegmentedDownloadError as err:
+            logger.warning(
+                "Falling back to a single stream for: %s (%s)", media_item_path, err
+            )
+            return self._write_media_item(
+                media_item, media_item_path, allow_segments=False
+            )
+        except PartialDownloadError:
+            logger.warning("Discarding unusable partial download: %s", part_path)
+            part_path.unlink()
+            return self._write_media_item(media_item, media_item_path)
+
+        part_path.replace(media_item_path)
+
+        self._record_bytes_written(bytes_written)
+        return WrittenFile(
+            bytes_written=bytes_written, size=size, sha256=sha256.hexdigest()
+        )
+
+    def _hash_and_sync_part(self, part_path: Path, sha256: Any) -> int:
+        """
+        For `.part` files whose content wasn't written through a handle that's still open,
+        e.g. one that a previous run completed. Returns its size
+        """
+        with part_path.open("rb") as f:
+            size = update_sha256(sha256, f, self.chunk_size)
+            self.fsync_policy.sync_file(f)
+        return size
+
+    def _write_chunks(
+        self,
+        response: requests.Response,
+        f: BinaryIO,
+        max_bytes: Optional[int] = None,
+        sha256: Any = None,
+    ) -> int:
+        bytes_written = 0
+        for chunk in response.iter_content(chunk_size=self.chunk_size):
+            if max_bytes is not None and bytes_written + len(chunk) > max_bytes:
+                chunk = memoryview(chunk)[: max_bytes - bytes_written]
+            bytes_written += f.write(chunk)
+            if sha256 is not None:
+                sha256.update(chunk)
+            self.rate_limiter.acquire_media_bytes(len(chunk))
+
+            if max_bytes is not None and bytes_written >= max_bytes:
+                break
+        return bytes_written
+
+    def _get_segment_ranges(
+        self, response: requests.Response
+    ) -> Optional[List[Tuple[int, int]]]:
+        if self._segment_executor is None or response.status_code != 200:
+            return None
+        if response.headers.get("Accept-Ranges") == "none":
+            return None
+
+        try:
+            size = int(response.headers["Content-Length"])
+        except (KeyError, ValueError):
+            return None
+
+        if size < self.segment_threshold:
+            return None
+        return get_segment_ranges(size, self.download_segments)
+
+    def _write_segments(
+        self,
+        media_item: MediaItem,
+        response: requests.Response,
+        part_path: Path,
+        segment_ranges: List[Tuple[int, int]],
+    ) -> int:
+        """
+        Preallocates `part_path` and has each segment write straight to its own offset,
+        so that no assembly is needed once all segments are done. The first segment is
+        read off of the already open `response`
+        """
+        logger.info(
+            "Downloading %s in %d segments", media_item.filename, len(segment_ranges)
+        )
+
+        with part_path.open("wb") as f:
+            f.truncate(segment_ranges[-1][1] + 1)
+
+        futures = [
+            self._segment_executor.submit(
+                self._download_segment, media_item, part_path, start, end
+            )
+            for start, end in segment_ranges[1:]
+        ]
+        try:
             try:
-                media_item_in_album.symlink_to(media_item_path)
+                bytes_written = self._write_segment(
+                    response, part_path, *segment_ranges[0]
+                )
+            finally:
+                concurrent.futures.wait(futures)
+            return bytes_written + sum(future.result() for future in futures)
+        except BaseException:
+            # Which ranges were complete is unknown, so there's nothing to resume from
+            part_path.unlink()
+            raise
+
+    def _download_segment(
+        self, media_item: MediaItem, part_path: Path, start: int, end: int
+    ) -> int:
+        with media_item.get_raw_data_response(
+            session=self.session,
+            offset=start,
+            retry_policy=self.retry_policy,
+            end=end,
+        ) as response:
+            content_range = response.headers.get("Content-Range", "")
+            if response.status_code != PARTIAL_CONTENT or not content_range.startswith(
+                f"bytes {start}-"
+            ):
+                raise SegmentedDownloadError(
+                    f"Unable to download bytes {start}-{end}"
+                    f" (got: {response.status_code}, {content_range})"
+                )
+            return self._write_segment(response, part_path, start, end)
+
+    def _write_segment(
+        self, response: requests.Response, part_path: Path, start: int, end: int
+    ) -> int:
+        # Every segment has its own file handle, so seeking doesn't affect the others
+        with part_path.open("r+b") as f:
+            f.seek(start)
+            bytes_written = self._write_chunks(response, f, max_bytes=end - start + 1)
+
+        if bytes_written != end - start + 1:
+            raise RuntimeError(
+                f"Segment {start}-{end} of {part_path} ended after {bytes_written} bytes"
+            )
+        return bytes_written
+
+    def _record_bytes_written(self, bytes_written: int):
+        with self._bytes_written_lock:
+            self.bytes_written += bytes_written
+
+    @staticmethod
+    def _link_into_album(
+        media_item: MediaItem, media_item_path: Path, album_path: Path
+    ):
+        album_path.mkdir(parents=True, exist_ok=True)
+        media_item_in_album = Path(album_path, media_item.filename)
+        logger.info("Symlinking %s to %s", media_item_in_album, media_item_path)
+        try:
+            media_item_in_album.symlink_to(
+                get_symlink_target(album_path, media_item_path)
+            )
+        except FileExistsError:
+            pass
+
+    def link_into_albums(self, album_media_items: Dict[Path, List[MediaItem]]) -> int:
+        """
+        Symlinks every MediaItem into each of the Albums that it belongs to. Returns the
+        amount of symlinks that were created
+        """
+        symlinks_created = sum(
+            link_into_album(
+                album_path,
+                [
+                    media_item.get_download_path(self.base_download_path)
+                    for media_item in media_items
+                ],
+            )
+            for album_path, media_items in album_media_items.items()
+        )
+
+        logger.info(
+            "Symlinked %d MediaItem(s) into %d Album(s)",
+            symlinks_created,
+            len(album_media_items),
+        )
+        return symlinks_created
+
+    def _link_to_blob(self, media_item_path: Path, sha256: str) -> bool:
+        """
+        Makes `media_item_path` a hardlink to the blob of its content, creating the blob
+        from it if there's none yet. Returns whether it was a duplicate of an existing
+        blob. Where hardlinks aren't supported, `media_item_path` is left as is
+        """
+        blob_path = get_blob_path(self.base_download_path, sha256)
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+
+        try:
+            try:
+                # Atomically claims the blob for this content, unless another copy did
+                os.link(media_item_path, blob_path)
+                return False
             except FileExistsError:
-                pass
+                if os.path.samefile(media_item_path, blob_path):
+                    return False
+
+            # Swapped in by a rename, so that `media_item_path` never goes missing
+            link_path = media_item_path.with_name(media_item_path.name + LINK_SUFFIX)
+            if link_path.exists():
+                link_path.unlink()
+            os.link(blob_path, link_path)
+            link_path.replace(media_item_path)
+        except OSError as err:
+            logger.warning(
+                "Unable to hardlink %s to %s, keeping a copy (%s)",
+                media_item_path,
+                blob_path,
+                err,
+            )
+            return False
+
+        logger.info("Deduplicated %s into %s", media_item_path, blob_path)
+        return True
+
+    def _record(
+        self,
+        media_item: MediaItem,
+        media_item_path: Path,
+        written_file: WrittenFile,
+        on_recorded: Optional[Callable[[], None]] = None,
+    ):
+        size, sha256 = written_file.size, written_file.sha256
+
+        # The file's content was fsynced before it got renamed into place
+        directories = [media_item_path.parent]
+        if self.content_addressed:
+            self._link_to_blob(media_item_path, sha256)
+            blob_path = get_blob_path(self.base_download_path, sha256)
+            if blob_path.exists():
+                directories.append(blob_path.parent)
+
+        self.fsync_policy.sync(
+            directories,
+            partial(
+                self.recorder.add,
+                media_item,
+                size=size,
+                sha256=sha256,
+                on_recorded=on_recorded,
+            ),
+        )
 
-        if media_item_path.exists() and self.recorder.lookup(media_item):
+    def close(self):
+        """
+        Fsyncs any files that are pending as per the `fsync_policy` and commits every
+        recorded MediaItem
+        """
+        self.fsync_policy.flush()
+        self.recorder.close()
+
+    def _is_archived(self, media_item: MediaItem) -> bool:
+        # MediaItems are only recorded once their files are in place, so the in-memory
+        # lookup settles it without touching the disk
+        if self.recorder.lookup(media_item):
             logger.info(
-                "MediaItem at path: %s already exists. Skipping download.",
-                str(media_item_path.absolute()),
+                "MediaItem with id: %s is already archived. Skipping download.",
+                media_item.id,
+            )
+            return True
+        return False
+
+    def archive(
+        self,
+        media_item: MediaItem,
+        album_path: Optional[Path] = None,
+        on_recorded: Optional[Callable[[], None]] = None,
+    ) -> bool:
+        if album_path is not None:
+            self._link_into_album(
+                media_item,
+                Path(self.base_download_path, media_item.get_relative_download_path()),
+                album_path,
             )
+
+        if self._is_archived(media_item):
             return False
 
+        media_item_path = media_item.get_download_path(self.base_download_path)
+
         logger.info(
             "Downloading MediaItem with id: %s to path: %s",
             media_item.id,
             str(media_item_path.absolute()),
         )
 
-        media_item_raw_data: bytes = media_item.get_raw_data()
-
-        with media_item_path.open("wb") as f:
-            f.write(media_item_raw_data)
+        written_file = self._write_media_item(media_item, media_item_path)
+        logger.info(
+            "Wrote %d byte(s) for MediaItem with id: %s",
+            written_file.bytes_written,
+            media_item.id,
+        )
 
-        self.recorder.add(media_item)
+        self._record(media_item, media_item_path, written_file, on_recorded)
 
         return True
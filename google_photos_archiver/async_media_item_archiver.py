@@ -0,0 +1,404 @@
+import asyncio
+import hashlib
+import logging
+from concurrent.futures.thread import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Iterable, List, Optional
+
+from google_photos_archiver.archivers import (
+    DiskArchiver,
+    PartialDownloadError,
+    WrittenFile,
+    get_part_path,
+    get_resume_offset,
+    get_write_offset,
+    update_sha256,
+)
+from google_photos_archiver.base_url_refresher import BaseUrlRefresher
+from google_photos_archiver.fsync_policy import FsyncPolicy
+from google_photos_archiver.listing_checkpoint import ListingCheckpoint
+from google_photos_archiver.media_item import (
+    DEFAULT_CHUNK_SIZE,
+    DOWNLOAD_CONNECT_TIMEOUT_SECONDS,
+    DOWNLOAD_READ_TIMEOUT_SECONDS,
+    RANGE_NOT_SATISFIABLE,
+    MediaItem,
+)
+from google_photos_archiver.media_item_recorder import MediaItemRecorder
+from google_photos_archiver.rate_limiter import RateLimiter
+from google_photos_archiver.retry import RetryPolicy, parse_retry_after
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENT_DOWNLOADS = 500
+DEFAULT_FILE_IO_WORKERS = 4
+
+
+def _ensure_aiohttp_is_installed():
+    if aiohttp is None:
+        raise RuntimeError(
+            "The async engine requires `aiohttp`. "
+            "Install it with: pip install google-photos-archiver[async]"
+        )
+
+
+def _write_and_hash(f: BinaryIO, sha256: Any, chunk: bytes) -> int:
+    # `hashlib` releases the GIL for large enough chunks, so this can run off the loop
+    sha256.update(chunk)
+    return f.write(chunk)
+
+
+class AsyncDiskArchiver(DiskArchiver):
+    """
+    A DiskArchiver whose downloads run on an asyncio event loop. Blocking work (file
+    writes, symlinking, existence checks) is offloaded to a small ThreadPoolExecutor so
+    that a single event loop thread can multiplex thousands of downloads
+    """
+
+    # pylint: disable=too-many-arguments
+
+    def __init__(
+        self,
+        base_download_path: Path,
+        recorder: MediaItemRecorder,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        file_io_workers: int = DEFAULT_FILE_IO_WORKERS,
+        rate_limiter: Optional[RateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        content_addressed: bool = False,
+        fsync_policy: Optional[FsyncPolicy] = None,
+    ):
+        _ensure_aiohttp_is_installed()
+        super().__init__(
+            base_download_path,
+            recorder,
+            chunk_size=chunk_size,
+            rate_limiter=rate_limiter,
+            retry_policy=retry_policy,
+            content_addressed=content_addressed,
+            fsync_policy=fsync_policy,
+        )
+        self._file_io_executor = ThreadPoolExecutor(
+            max_workers=file_io_workers, thread_name_prefix="file-io"
+        )
+
+    async def _run_blocking(self, func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._file_io_executor, partial(func, *args)
+        )
+
+    async def _download_to_part(
+        self,
+        media_item: MediaItem,
+        part_path: Path,
+        http_session: "aiohttp.ClientSession",
+    ) -> WrittenFile:
+        offset = await self._run_blocking(get_resume_offset, part_path)
+        sha256 = hashlib.sha256()
+        headers = {"Range": f"bytes={offset}-"} if offset > 0 else None
+
+        async with http_session.get(
+            media_item.downloadUrl, headers=headers
+        ) as response:
+            if not (offset > 0 and response.status == RANGE_NOT_SATISFIABLE):
+                response.raise_for_status()
+
+            write_offset = get_write_offset(
+                offset, response.status, response.headers.get("Content-Range")
+            )
+            if write_offset is None:
+                size = await self._run_blocking(
+                    self._hash_and_sync_part, part_path, sha256
+                )
+                return WrittenFile(
+                    bytes_written=0, size=size, sha256=sha256.hexdigest()
+                )
+
+            bytes_written = await self._write_response(
+                response, part_path, sha256, append=write_offset > 0
+            )
+            return WrittenFile(
+                bytes_written=bytes_written,
+                size=write_offset + bytes_written,
+                sha256=sha256.hexdigest(),
+            )
+
+    async def _write_media_item_async(
+        self,
+        media_item: MediaItem,
+        media_item_path: Path,
+        http_session: "aiohttp.ClientSession",
+    ) -> WrittenFile:
+        part_path = get_part_path(media_item_path)
+        attempt_number = 1
+
+        while True:
+            try:
+                written_file = await self._download_to_part(
+                    media_item, part_path, http_session
+                )
+            except PartialDownloadError:
+                logger.warning("Discarding unusable partial download: %s", part_path)
+                await self._run_blocking(part_path.unlink)
+                continue
+            except (
+                aiohttp.ClientConnectionError,
+                aiohttp.ClientResponseError,
+                # What a read that timed out mid-stream raises
+                asyncio.TimeoutError,
+            ) as err:
+                status_code = getattr(err, "status", None)
+                if (
+                    status_code is not None
+                    and not self.retry_policy.is_retryable_status(status_code)
+                ):
+                    raise
+
+                headers = getattr(err, "headers", None) or {}
+                delay = self.retry_policy.get_retry_delay(
+                    "download",
+                    attempt_number,
+                    status_code=status_code,
+                    retry_after=parse_retry_after(headers.get("Retry-After")),
+                )
+                if delay is None:
+                    raise RuntimeError(
+                        "Max attempts reached while trying to `get_raw_data`"
+                        f" for: {media_item.filename}"
+                    ) from err
+
+                # Sleeping here only suspends this download's coroutine
+                logger.warning(
+                    "Failed to fetch data for: %s (%s). Waiting %.1f second(s) and"
+                    " trying again (attempt: %d of %d)",
+                    media_item.filename,
+                    err.__class__.__name__,
+                    delay,
+                    attempt_number,
+                    self.retry_policy.max_attempts,
+                )
+                await asyncio.sleep(delay)
+                attempt_number += 1
+                continue
+
+            await self._run_blocking(part_path.replace, media_item_path)
+            return written_file
+
+    async def _write_response(
+        self,
+        response: "aiohttp.ClientResponse",
+        part_path: Path,
+        sha256: Any,
+        append: bool,
+    ) -> int:
+        bytes_written = 0
+
+        f = await self._run_blocking(part_path.open, "a+b" if append else "wb")
+        try:
+            if append:
+                await self._run_blocking(f.seek, 0)
+                await self._run_blocking(update_sha256, sha256, f, self.chunk_size)
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                bytes_written += await self._run_blocking(
+                    _write_and_hash, f, sha256, chunk
+                )
+                wait_time = self.rate_limiter.reserve_media_bytes(len(chunk))
+                if wait_time > 0:
+                    await asyncio.sleep(wait_time)
+            await self._run_blocking(self.fsync_policy.sync_file, f)
+        finally:
+            await self._run_blocking(f.close)
+
+        self._record_bytes_written(bytes_written)
+        return bytes_written
+
+    async def archive_async(
+        self,
+        media_item: MediaItem,
+        http_session: "aiohttp.ClientSession",
+        album_path: Optional[Path] = None,
+        on_recorded: Optional[Callable[[], None]] = None,
+    ) -> bool:
+        if album_path is not None:
+            await self._run_blocking(
+                self._link_into_album,
+                media_item,
+                Path(self.base_download_path, media_item.get_relative_download_path()),
+                album_path,
+            )
+
+        if self._is_archived(media_item):
+            return False
+
+        media_item_path = await self._run_blocking(
+            media_item.get_download_path, self.base_download_path
+        )
+
+        logger.info(
+            "Downloading MediaItem with id: %s to path: %s",
+            media_item.id,
+            str(media_item_path.absolute()),
+        )
+
+        written_file = await self._write_media_item_async(
+            media_item, media_item_path, http_session
+        )
+        logger.info(
+            "Wrote %d byte(s) for MediaItem with id: %s",
+            written_file.bytes_written,
+            media_item.id,
+        )
+
+        await self._run_blocking(
+            self._record, media_item, media_item_path, written_file, on_recorded
+        )
+
+        return True
+
+
+class AsyncMediaItemArchiver:
+    """
+    Alternative to MediaItemArchiver that multiplexes downloads over an asyncio event loop
+    instead of dedicating an OS thread to each in-flight download
+    """
+
+    def __init__(
+        self,
+        archiver: AsyncDiskArchiver,
+        max_concurrent_downloads: int = DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+        base_url_refresher: Optional[BaseUrlRefresher] = None,
+        max_concurrent_video_downloads: Optional[int] = None,
+        listing_checkpoint: Optional[ListingCheckpoint] = None,
+    ):
+        """
+        :param max_concurrent_video_downloads: When provided, videos are limited to this
+            many concurrent downloads of their own rather than competing with photos for
+            `max_concurrent_downloads`
+        :param listing_checkpoint: When provided, MediaItems are taken off of its queue of
+            pending MediaItems once they have been skipped, or archived and recorded
+        """
+        _ensure_aiohttp_is_installed()
+        self.archiver = archiver
+        self.max_concurrent_downloads = max_concurrent_downloads
+        self.base_url_refresher = base_url_refresher
+        self.max_concurrent_video_downloads = max_concurrent_video_downloads
+        self.listing_checkpoint = listing_checkpoint
+
+    def start(
+        self, media_items: Iterable[MediaItem], album_path: Optional[Path] = None
+    ) -> List[asyncio.Future]:
+        """
+        Returns completed futures so that results can be consumed just like those of
+        `MediaItemArchiver.start` (e.g. by `get_new_media_item_archivals`)
+        """
+        return asyncio.run(self._start(media_items, album_path))
+
+    async def _start(
+        self, media_items: Iterable[MediaItem], album_path: Optional[Path] = None
+    ) -> List[asyncio.Future]:
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_concurrent_downloads)
+        video_semaphore = (
+            semaphore
+            if self.max_concurrent_video_downloads is None
+            else asyncio.Semaphore(self.max_concurrent_video_downloads)
+        )
+        media_items_iterator = iter(
+            media_items
+            if self.base_url_refresher is None
+            else self.base_url_refresher.track(media_items)
+        )
+        exhausted = object()
+        tasks: List[asyncio.Future] = []
+
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrent_downloads
+            + (self.max_concurrent_video_downloads or 0)
+        )
+        # Matches the timeouts of the requests engine. aiohttp otherwise gives up on
+        # whatever is still downloading after 5 minutes in total
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=DOWNLOAD_CONNECT_TIMEOUT_SECONDS,
+            sock_read=DOWNLOAD_READ_TIMEOUT_SECONDS,
+        )
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout
+        ) as http_session:
+            while True:
+                # Listing MediaItems is blocking network I/O, so pull from the iterator
+                # off of the event loop to keep in-flight downloads moving
+                media_item = await loop.run_in_executor(
+                    None, next, media_items_iterator, exhausted
+                )
+                if media_item is exhausted:
+                    break
+
+                tasks.append(
+                    asyncio.ensure_future(
+                        self._archive(
+                            media_item,
+                            http_session,
+                            video_semaphore if media_item.is_video else semaphore,
+                            album_path,
+                        )
+                    )
+                )
+
+            if tasks:
+                await asyncio.wait(tasks)
+
+        return tasks
+
+    async def _archive(
+        self,
+        media_item: MediaItem,
+        http_session: "aiohttp.ClientSession",
+        semaphore: asyncio.Semaphore,
+        album_path: Optional[Path] = None,
+    ) -> bool:
+        if not media_item.is_ready:
+            if self.base_url_refresher is not None:
+                self.base_url_refresher.discard(media_item)
+            # Gets listed again once it's ready, rather than resumed
+            if self.listing_checkpoint is not None:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.listing_checkpoint.remove_pending, media_item
+                )
+            return False
+
+        on_recorded = (
+            None
+            if self.listing_checkpoint is None
+            else partial(self.listing_checkpoint.remove_pending, media_item)
+        )
+        async with semaphore:
+            if self.base_url_refresher is not None:
+                # Recorded MediaItems get skipped, so their `baseUrl` is never used
+                if self.archiver.recorder.lookup(media_item):
+                    self.base_url_refresher.discard(media_item)
+                else:
+                    # Refreshing is a blocking API call
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, self.base_url_refresher.refresh_if_stale, media_item
+                    )
+
+            archived = await self.archiver.archive_async(
+                media_item,
+                http_session,
+                album_path,
+                on_recorded=on_recorded,
+            )
+
+        # Archived MediaItems are only taken off of the queue once they're recorded
+        if not archived and self.listing_checkpoint is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.listing_checkpoint.remove_pending, media_item
+            )
+        return archived
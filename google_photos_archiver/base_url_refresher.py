@@ -0,0 +1,159 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from google_photos_archiver.media_item import BASE_URL_TTL_SECONDS, MediaItem
+from google_photos_archiver.rest_client import (
+    BATCH_GET_MAX_MEDIA_ITEMS,
+    GooglePhotosApiRestClient,
+)
+
+logger = logging.getLogger(__name__)
+
+# Leave enough time for a download to finish before its `baseUrl` expires
+DEFAULT_MAX_BASE_URL_AGE = BASE_URL_TTL_SECONDS - 10 * 60
+
+
+class BaseUrlRefreshError(RuntimeError):
+    pass
+
+
+class _BatchRefresh:
+    """
+    A `mediaItems:batchGet` that's underway, which concurrent callers whose MediaItems
+    are part of it wait on
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        # Set if the batch failed, before `done` is
+        self.error: Optional[BaseException] = None
+
+    def wait(self, media_item: MediaItem):
+        """
+        Raises if the batch failed, just like it did for the caller that refreshed it
+        """
+        self.done.wait()
+        if self.error is not None:
+            raise BaseUrlRefreshError(
+                f"Failed to refresh the baseUrl of: {media_item.id}"
+            ) from self.error
+
+
+class BaseUrlRefresher:
+    """
+    Refreshes the `baseUrl` of MediaItems that were listed too long ago to still be
+    downloadable. MediaItems are tracked as they are listed, and refreshing a stale one
+    also refreshes the oldest MediaItems still waiting to be downloaded, so that a single
+    `mediaItems:batchGet` covers up to `BATCH_GET_MAX_MEDIA_ITEMS` of them
+    """
+
+    def __init__(
+        self,
+        google_photos_api_rest_client: GooglePhotosApiRestClient,
+        max_base_url_age: float = DEFAULT_MAX_BASE_URL_AGE,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.google_photos_api_rest_client = google_photos_api_rest_client
+        self.max_base_url_age = max_base_url_age
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        # MediaItems that have been listed but haven't started downloading yet, oldest
+        # `baseUrl` first
+        self._pending: "OrderedDict[str, MediaItem]" = OrderedDict()
+        # MediaItems whose batch is being refreshed, mapped to that batch
+        self._refreshing: Dict[str, _BatchRefresh] = {}
+
+    def track(self, media_items: Iterable[MediaItem]) -> Iterator[MediaItem]:
+        for media_item in media_items:
+            with self._lock:
+                self._pending[media_item.id] = media_item
+            yield media_item
+
+    def discard(self, media_item: MediaItem):
+        """
+        Stops tracking a MediaItem that won't be downloaded after all (e.g. because it's
+        been archived already), so that it isn't refreshed along with others
+        """
+        with self._lock:
+            self._pending.pop(media_item.id, None)
+
+    def is_stale(self, media_item: MediaItem) -> bool:
+        return media_item.get_base_url_age(self._clock()) >= self.max_base_url_age
+
+    def refresh_if_stale(self, media_item: MediaItem) -> bool:
+        """
+        Meant to be called right before `media_item` gets downloaded. Returns whether its
+        `baseUrl` had to be refreshed. Raises if refreshing it failed, whether it was
+        refreshed by this caller or as part of another one's batch
+        """
+        with self._lock:
+            self._pending.pop(media_item.id, None)
+
+            refreshing = self._refreshing.get(media_item.id)
+            if refreshing is not None:
+                batch = None
+            elif not self.is_stale(media_item):
+                return False
+            else:
+                batch = [media_item] + list(
+                    itertools.islice(
+                        (
+                            pending_media_item
+                            for pending_media_item in self._pending.values()
+                            if pending_media_item.id not in self._refreshing
+                        ),
+                        BATCH_GET_MAX_MEDIA_ITEMS - 1,
+                    )
+                )
+                refreshing = _BatchRefresh()
+                for batch_media_item in batch:
+                    self._refreshing[batch_media_item.id] = refreshing
+                for pending_media_item in batch[1:]:
+                    self._pending.move_to_end(pending_media_item.id)
+
+        # Concurrent callers whose MediaItems are part of a batch that's underway wait
+        # for it, rather than refreshing them again
+        if batch is None:
+            refreshing.wait(media_item)
+            return True
+
+        try:
+            self._refresh(batch)
+        except BaseException as err:
+            refreshing.error = err
+            raise
+        finally:
+            with self._lock:
+                for batch_media_item in batch:
+                    self._refreshing.pop(batch_media_item.id, None)
+            refreshing.done.set()
+        return True
+
+    def _refresh(self, media_items: List[MediaItem]):
+        logger.info("Refreshing the baseUrl of %d MediaItem(s)", len(media_items))
+
+        # Not holding the lock, so that other MediaItems can start downloading meanwhile
+        client = self.google_photos_api_rest_client
+        refreshed_media_items = {
+            refreshed_media_item.id: refreshed_media_item
+            for refreshed_media_item in client.get_media_items_by_ids(
+                [media_item.id for media_item in media_items]
+            )
+        }
+
+        with self._lock:
+            for media_item in media_items:
+                refreshed_media_item = refreshed_media_items.get(media_item.id)
+                if refreshed_media_item is None:
+                    logger.warning(
+                        "Unable to refresh the baseUrl of: %s", media_item.id
+                    )
+                    continue
+
+                media_item.baseUrl = refreshed_media_item.baseUrl
+                media_item.listedAt = refreshed_media_item.listedAt
@@ -1,20 +1,52 @@
 from pathlib import Path
+from typing import Optional
 
 import click
 
+from google_photos_archiver.album_recorder import AlbumRecorder
+from google_photos_archiver.archivers import BLOBS_DIRECTORY, DEFAULT_DOWNLOAD_SEGMENTS
+from google_photos_archiver.async_media_item_archiver import (
+    DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+)
+from google_photos_archiver.base_url_refresher import BaseUrlRefresher
 from google_photos_archiver.cli_utils import (
+    DEFAULT_ALBUM_LISTING_WORKERS,
+    DEFAULT_REBUILD_ALBUMS_WORKERS,
+    AlbumListing,
+    Engine,
     Timer,
+    get_bandwidth_schedule,
     get_date_objects_from_filters,
     get_media_item_archiver,
     get_media_items,
+    rebuild_album_symlinks,
     validate_dates,
+    validate_engine_options,
+)
+from google_photos_archiver.concurrency import DEFAULT_MIN_CONCURRENCY
+from google_photos_archiver.fsync_policy import (
+    DEFAULT_FSYNC_BATCH_SECONDS,
+    DEFAULT_FSYNC_BATCH_SIZE,
+    FsyncMode,
+    FsyncPolicy,
 )
-from google_photos_archiver.media_item_archiver import (
-    MediaItemArchiver,
-    get_new_media_item_archivals,
+from google_photos_archiver.http_session import DEFAULT_API_POOL_MAXSIZE, PooledSession
+from google_photos_archiver.incremental_sync import IncrementalSync
+from google_photos_archiver.listing_checkpoint import ListingCheckpoint
+from google_photos_archiver.media_item import DEFAULT_CHUNK_SIZE
+from google_photos_archiver.media_item_archiver import get_new_media_item_archivals
+from google_photos_archiver.media_item_recorder import (
+    DEFAULT_FLUSH_INTERVAL_SECONDS,
+    DEFAULT_FLUSH_SIZE,
 )
 from google_photos_archiver.oauth_handler import GoogleOauthHandler
-from google_photos_archiver.rest_client import GooglePhotosApiRestClient
+from google_photos_archiver.rate_limiter import ApiRequestBudgetExhausted, RateLimiter
+from google_photos_archiver.rest_client import (
+    DEFAULT_DATE_SEARCH_WORKERS,
+    DEFAULT_PREFETCH_PAGES,
+    GooglePhotosApiRestClient,
+)
+from google_photos_archiver.retry import DEFAULT_MAX_ATTEMPTS, RetryPolicy
 
 
 @click.group()
@@ -37,11 +69,27 @@ from google_photos_archiver.rest_client import GooglePhotosApiRestClient
 )
 def cli(ctx: click.Context, client_secret_json_path: str, refresh_token_path: str):
     ctx.ensure_object(dict)
+    ctx.obj["client_secret_json_path"] = client_secret_json_path
+    ctx.obj["refresh_token_path"] = refresh_token_path
+
 
+def get_google_photos_api_rest_client(ctx: click.Context) -> GooglePhotosApiRestClient:
+    """
+    Authenticates on first use, so that commands that don't call the API (e.g.
+    `rebuild-albums`) work offline
+    """
     if ctx.obj.get("google_photos_api_rest_client") is None:
+        # Token refreshes share the REST client's pooled connections
+        session = PooledSession()
         ctx.obj["google_photos_api_rest_client"] = GooglePhotosApiRestClient(
-            GoogleOauthHandler(Path(client_secret_json_path), Path(refresh_token_path))
+            GoogleOauthHandler(
+                Path(ctx.obj["client_secret_json_path"]),
+                Path(ctx.obj["refresh_token_path"]),
+                session=session,
+            ),
+            session=session,
         )
+    return ctx.obj["google_photos_api_rest_client"]
 
 
 @cli.command()
@@ -56,6 +104,22 @@ def cli(ctx: click.Context, client_secret_json_path: str, refresh_token_path: st
 @click.option(
     "--sqlite-db-path", type=str, default="./media_items.db", show_default=True
 )
+@click.option(
+    "--recorder-flush-interval",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_FLUSH_INTERVAL_SECONDS,
+    help="How often (in seconds) archived MediaItems are committed to the sqlite db,"
+    " in one batch",
+    show_default=True,
+)
+@click.option(
+    "--recorder-flush-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_FLUSH_SIZE,
+    help="The amount of archived MediaItems that get committed to the sqlite db right"
+    " away, rather than waiting for --recorder-flush-interval",
+    show_default=True,
+)
 @click.option(
     "--max-threadpool-workers",
     type=int,
@@ -63,11 +127,171 @@ def cli(ctx: click.Context, client_secret_json_path: str, refresh_token_path: st
     help="The maximum amount of workers to utilize for the ThreadPoolExecutor",
     show_default=True,
 )
+@click.option(
+    "--max-api-requests-per-minute",
+    type=float,
+    default=None,
+    help="Rate limit for Google Photos API requests (listing, searching, ...)."
+    " Unlimited by default",
+)
+@click.option(
+    "--max-api-requests-per-day",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Budget of Google Photos API requests per day (the API's quota is 10,000)."
+    " Once it's used up the archival stops, to be resumed by a later run."
+    " Unlimited by default",
+)
+@click.option(
+    "--max-download-bytes-per-second",
+    type=float,
+    default=None,
+    help="Rate limit for the combined download speed of all workers. Unlimited by default",
+)
+@click.option(
+    "--download-bandwidth-schedule",
+    type=str,
+    default=None,
+    help="Comma delimited HH:MM-HH:MM=<rate> windows (local time) with their own limit"
+    " for the combined download speed, e.g. `01:00-06:00=unlimited,09:00-17:00=1MB`."
+    " --max-download-bytes-per-second applies outside of these windows",
+)
+@click.option(
+    "--max-attempts",
+    type=int,
+    default=DEFAULT_MAX_ATTEMPTS,
+    help="The maximum amount of attempts for any request that fails with a connection"
+    " error, a 429 or a 5xx. Retries back off exponentially and honor Retry-After",
+    show_default=True,
+)
+@click.option(
+    "--requeue-failed-downloads",
+    is_flag=True,
+    help="Requeue downloads that fail with a retryable error, rather than having"
+    " workers sleep between attempts",
+)
+@click.option(
+    "--adaptive-concurrency",
+    is_flag=True,
+    help="Grow and shrink the amount of in-flight downloads at runtime based on observed"
+    " throughput, errors and throttling. --max-threadpool-workers becomes the upper bound",
+)
+@click.option(
+    "--min-concurrent-downloads",
+    type=int,
+    default=DEFAULT_MIN_CONCURRENCY,
+    help="The lower bound of in-flight downloads when using --adaptive-concurrency",
+    show_default=True,
+)
+@click.option(
+    "--engine",
+    type=click.Choice([Engine.THREAD, Engine.ASYNC]),
+    default=Engine.THREAD,
+    help="`thread` downloads with a ThreadPoolExecutor, `async` multiplexes downloads"
+    " over an asyncio event loop (requires the `async` extra) on a connection pool of"
+    " its own. `async` doesn't support --segmented-download-threshold,"
+    " --adaptive-concurrency or --requeue-failed-downloads",
+    show_default=True,
+)
+@click.option(
+    "--max-concurrent-downloads",
+    type=int,
+    default=DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+    help="The maximum amount of in-flight downloads when using `--engine async`",
+    show_default=True,
+)
+@click.option(
+    "--parallel-listing-workers",
+    type=click.IntRange(min=1),
+    default=None,
+    help="List the library as one DateRange per year, this many DateRanges at a time,"
+    " rather than page by page from start to finish. With --albums-only, the amount of"
+    f" Albums listed at a time (default: {DEFAULT_ALBUM_LISTING_WORKERS}). With date"
+    " filters, the amount of searches of up to 5 Dates and 5 DateRanges each that run at"
+    f" a time (default: {DEFAULT_DATE_SEARCH_WORKERS})",
+)
+@click.option(
+    "--prefetch-pages",
+    type=click.IntRange(min=0),
+    default=DEFAULT_PREFETCH_PAGES,
+    help="How many pages of MediaItems to list ahead of the downloads in the background",
+    show_default=True,
+)
+@click.option(
+    "--max-concurrent-video-downloads",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Download videos with this many workers of their own, so that large videos"
+    " don't hold up photos. By default videos and photos share the same workers",
+)
+@click.option(
+    "--max-api-connections",
+    type=int,
+    default=DEFAULT_API_POOL_MAXSIZE,
+    help="The maximum amount of keep-alive connections to pool for the Google Photos API."
+    " MediaItem downloads get a pool sized to --max-threadpool-workers",
+    show_default=True,
+)
+@click.option(
+    "--download-chunk-size",
+    type=int,
+    default=DEFAULT_CHUNK_SIZE,
+    help="The size in bytes of the chunks that MediaItems are streamed to disk in",
+    show_default=True,
+)
+@click.option(
+    "--segmented-download-threshold",
+    type=int,
+    default=None,
+    help="MediaItems of at least this many bytes (e.g. large videos) are downloaded as"
+    " several concurrent byte ranges. Disabled by default",
+)
+@click.option(
+    "--content-addressed",
+    is_flag=True,
+    help="Store byte-identical MediaItems only once, under"
+    f" <download-path>/{BLOBS_DIRECTORY}/ by their SHA-256 checksum, and hardlink them"
+    " into their usual paths. Already archived MediaItems are left as they are",
+)
+@click.option(
+    "--fsync",
+    type=click.Choice([FsyncMode.NONE, FsyncMode.FILE, FsyncMode.BATCH]),
+    default=FsyncMode.NONE,
+    help="When archived MediaItems are fsynced to disk: `none` leaves it to the OS,"
+    " `file` fsyncs each one before renaming it into place and its directory right"
+    " after, `batch` fsyncs each one before renaming it into place as well, but only"
+    " fsyncs their directories in batches (See: --fsync-batch-size,"
+    " --fsync-batch-interval). MediaItems are only recorded as archived once fsynced",
+    show_default=True,
+)
+@click.option(
+    "--fsync-batch-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_FSYNC_BATCH_SIZE,
+    help="The amount of archived MediaItems whose directories `--fsync batch` fsyncs"
+    " at once",
+    show_default=True,
+)
+@click.option(
+    "--fsync-batch-interval",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_FSYNC_BATCH_SECONDS,
+    help="How many seconds `--fsync batch` waits at most (as long as downloads keep"
+    " completing) before fsyncing the directories of a partial batch",
+    show_default=True,
+)
+@click.option(
+    "--download-segments",
+    type=click.IntRange(min=2),
+    default=DEFAULT_DOWNLOAD_SEGMENTS,
+    help="The amount of concurrent byte ranges that large MediaItems are split into",
+    show_default=True,
+)
 @click.option(
     "--date-filter",
     type=str,
     callback=validate_dates,
-    help="Up to 5 comma delimited Dates conforming to the YYYY/MM/DD pattern."
+    help="Comma delimited Dates conforming to the YYYY/MM/DD pattern."
     " Any of YYYY/MM/DD can be wildcarded (*) like so: "
     "*/MM/DD,YYYY/*/DD,YYYY/MM/*",
 )
@@ -75,9 +299,16 @@ def cli(ctx: click.Context, client_secret_json_path: str, refresh_token_path: st
     "--date-range-filter",
     type=str,
     callback=validate_dates,
-    help="Up to 5 comma delimited DateRanges conforming"
+    help="Comma delimited DateRanges conforming"
     " to the YYYY/MM/DD-YYYY/MM/DD (<start_date>-<end_date>) pattern.",
 )
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Only list MediaItems that were created since the newest one archived by a"
+    " previous run, and skip Albums whose MediaItem count didn't change. MediaItems"
+    " uploaded with an older creation time are only picked up by a full run",
+)
 @click.option(
     "--albums-only",
     is_flag=True,
@@ -88,16 +319,45 @@ def cli(ctx: click.Context, client_secret_json_path: str, refresh_token_path: st
 def archive_media_items(
     ctx: click.Context,
     albums_only: bool,
+    incremental: bool,
     date_range_filter: str,
     date_filter: str,
+    download_chunk_size: int,
+    segmented_download_threshold: Optional[int],
+    download_segments: int,
+    content_addressed: bool,
+    fsync: str,
+    fsync_batch_size: int,
+    fsync_batch_interval: float,
+    max_api_connections: int,
+    max_concurrent_downloads: int,
+    max_concurrent_video_downloads: Optional[int],
+    prefetch_pages: int,
+    parallel_listing_workers: Optional[int],
+    engine: str,
+    min_concurrent_downloads: int,
+    adaptive_concurrency: bool,
+    max_download_bytes_per_second: Optional[float],
+    download_bandwidth_schedule: Optional[str],
+    max_api_requests_per_minute: Optional[float],
+    max_api_requests_per_day: Optional[int],
+    requeue_failed_downloads: bool,
+    max_attempts: int,
     max_threadpool_workers: int,
+    recorder_flush_size: int,
+    recorder_flush_interval: float,
     download_path: str,
     sqlite_db_path: str,
 ):
+    validate_engine_options(
+        engine,
+        segment_threshold=segmented_download_threshold,
+        adaptive_concurrency=adaptive_concurrency,
+        requeue_failed_downloads=requeue_failed_downloads,
+    )
+
     with Timer() as timer:
-        google_photos_api_rest_client: GooglePhotosApiRestClient = ctx.obj.get(
-            "google_photos_api_rest_client"
-        )
+        google_photos_api_rest_client = get_google_photos_api_rest_client(ctx)
 
         dates, date_ranges = get_date_objects_from_filters(
             date_filter, date_range_filter
@@ -114,43 +374,135 @@ def archive_media_items(
             fg="green",
         )
 
-        media_item_archiver: MediaItemArchiver = get_media_item_archiver(
+        # Share one set of keep-alive connection pools between listing and downloading
+        google_photos_api_rest_client.session.resize(
+            api_pool_maxsize=max_api_connections,
+            media_pool_maxsize=max_threadpool_workers
+            + (max_concurrent_video_downloads or 0)
+            + (0 if segmented_download_threshold is None else download_segments - 1),
+        )
+
+        google_photos_api_rest_client.prefetch_pages = prefetch_pages
+
+        # Listing and downloading share one set of rate limits to stay within API quotas
+        rate_limiter = RateLimiter(
+            api_requests_per_minute=max_api_requests_per_minute,
+            api_requests_per_day=max_api_requests_per_day,
+            media_bytes_per_second=max_download_bytes_per_second,
+            media_bytes_schedule=get_bandwidth_schedule(
+                download_bandwidth_schedule, max_download_bytes_per_second
+            ),
+        )
+        google_photos_api_rest_client.rate_limiter = rate_limiter
+
+        # Every request shares one retry policy so that retries are counted in one place
+        retry_policy = RetryPolicy(max_attempts=max_attempts)
+        google_photos_api_rest_client.retry_policy = retry_policy
+        google_photos_api_rest_client.oauth_handler.retry_policy = retry_policy
+
+        # Interrupted listings pick up from their last page on the next run
+        listing_checkpoint = ListingCheckpoint(sqlite_db_path=Path(sqlite_db_path))
+        google_photos_api_rest_client.listing_checkpoint = listing_checkpoint
+
+        media_item_archiver = get_media_item_archiver(
             download_path,
             max_threadpool_workers,
             sqlite_db_path,
+            download_chunk_size,
+            session=google_photos_api_rest_client.session,
+            engine=engine,
+            max_concurrent_downloads=max_concurrent_downloads,
+            adaptive_concurrency=adaptive_concurrency,
+            min_concurrent_downloads=min_concurrent_downloads,
+            rate_limiter=rate_limiter,
+            retry_policy=retry_policy,
+            requeue_failed_downloads=requeue_failed_downloads,
+            segment_threshold=segmented_download_threshold,
+            download_segments=download_segments,
+            max_concurrent_video_downloads=max_concurrent_video_downloads,
+            # Everything gets listed up front, so a long enough queue of downloads
+            # outlives the `baseUrl`s of the MediaItems at its end
+            base_url_refresher=BaseUrlRefresher(google_photos_api_rest_client),
+            listing_checkpoint=listing_checkpoint,
+            recorder_flush_interval=recorder_flush_interval,
+            recorder_flush_size=recorder_flush_size,
+            content_addressed=content_addressed,
+            fsync_policy=FsyncPolicy(
+                mode=fsync,
+                batch_size=fsync_batch_size,
+                batch_interval=fsync_batch_interval,
+            ),
         )
 
-        completed_media_item_archivals = []
-
-        if albums_only:
-            albums = google_photos_api_rest_client.get_albums_paginated()
-
-            for album in albums:
-                if album.title is None:
-                    album_title = f"Album ID: {album.id}"
-                else:
-                    album_title = album.title
+        incremental_sync = (
+            IncrementalSync(sqlite_db_path=Path(sqlite_db_path))
+            if incremental
+            else None
+        )
+        # Lets `rebuild-albums` recreate the symlinks without listing again
+        album_recorder = (
+            AlbumRecorder(sqlite_db_path=Path(sqlite_db_path)) if albums_only else None
+        )
 
-                album_path = Path(download_path, "albums", album_title)
+        try:
+            if albums_only:
+                # Albums are listed concurrently into one pipeline, which downloads
+                # MediaItems that are in several Albums only once
+                album_listing = AlbumListing(
+                    google_photos_api_rest_client,
+                    google_photos_api_rest_client.get_albums_paginated(),
+                    download_path,
+                    listing_workers=(
+                        parallel_listing_workers or DEFAULT_ALBUM_LISTING_WORKERS
+                    ),
+                    incremental_sync=incremental_sync,
+                    album_recorder=album_recorder,
+                )
+                completed_media_item_archivals = media_item_archiver.start(
+                    album_listing
+                )
 
+            else:
                 media_items = get_media_items(
-                    google_photos_api_rest_client, album=album
-                )
-                completed_media_item_archivals.extend(
-                    media_item_archiver.start(media_items, album_path)
+                    google_photos_api_rest_client,
+                    dates,
+                    date_ranges,
+                    listing_workers=parallel_listing_workers,
+                    incremental_sync=incremental_sync,
                 )
+                completed_media_item_archivals = media_item_archiver.start(media_items)
 
-        else:
-            media_items = get_media_items(
-                google_photos_api_rest_client,
-                dates,
-                date_ranges,
+            new_media_item_archivals = get_new_media_item_archivals(
+                completed_media_item_archivals
             )
-            completed_media_item_archivals = media_item_archiver.start(media_items)
+        except ApiRequestBudgetExhausted as err:
+            raise click.ClickException(str(err)) from err
+        finally:
+            # Fsyncs and commits the last batch of archived MediaItems, even if the
+            # archival failed midway, so that the next run skips them
+            media_item_archiver.archiver.close()
+            listing_checkpoint.close()
+            # Closes the connections that the listing threads opened
+            if incremental_sync is not None:
+                incremental_sync.close()
+            if album_recorder is not None:
+                album_recorder.close()
 
-        new_media_item_archivals = get_new_media_item_archivals(
-            completed_media_item_archivals
-        )
+        if albums_only:
+            media_item_archiver.archiver.link_into_albums(
+                album_listing.album_media_items
+            )
+
+        # Only move the high-water marks once everything listed has been archived and
+        # recorded, which a failed archival (or `close`) never gets past
+        if incremental_sync is not None:
+            try:
+                incremental_sync.save()
+            finally:
+                incremental_sync.close()
+
+    if retry_policy.stats:
+        click.secho(f"Retries: {retry_policy.stats}", fg="yellow")
 
     click.secho(
         f"Archived {new_media_item_archivals} new MediaItem(s) in {timer.time:0.4f} seconds",
@@ -158,6 +510,48 @@ def archive_media_items(
     )
 
 
+@cli.command()
+@click.option(
+    "--download-path",
+    type=str,
+    default="./downloaded_media",
+    show_default=True,
+    help="Directory that MediaItems were archived to",
+)
+@click.option(
+    "--sqlite-db-path", type=str, default="./media_items.db", show_default=True
+)
+@click.option(
+    "--max-threadpool-workers",
+    type=click.IntRange(min=1),
+    default=DEFAULT_REBUILD_ALBUMS_WORKERS,
+    help="The amount of Albums to rebuild at a time",
+    show_default=True,
+)
+def rebuild_albums(
+    download_path: str, sqlite_db_path: str, max_threadpool_workers: int
+):
+    """
+    Recreates the symlinks of every Album archived with --albums-only from the sqlite db,
+    without calling the Google Photos API. Symlinks that are missing get created, and
+    ones that point elsewhere or to MediaItems that left their Album get replaced or
+    removed
+    """
+    album_recorder = AlbumRecorder(sqlite_db_path=Path(sqlite_db_path))
+    with Timer() as timer:
+        try:
+            symlinks_created = rebuild_album_symlinks(
+                download_path, album_recorder, max_workers=max_threadpool_workers
+            )
+        finally:
+            album_recorder.close()
+
+    click.secho(
+        f"Created {symlinks_created} Album symlink(s) in {timer.time:0.4f} seconds",
+        fg="green",
+    )
+
+
 if __name__ == "__main__":
     # pylint: disable=no-value-for-parameter
     cli()
@@ -1,17 +1,78 @@
+import datetime
+import logging
 import re
 import time
+from collections import defaultdict
+from concurrent.futures.thread import ThreadPoolExecutor
 from pathlib import Path
-from typing import Generator, List, Optional, Tuple
+from typing import (
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import click
+import requests
 
 from google_photos_archiver.album import Album
-from google_photos_archiver.archivers import DiskArchiver
-from google_photos_archiver.filters import Date, DateFilter, DateRange
-from google_photos_archiver.media_item import MediaItem
+from google_photos_archiver.album_recorder import AlbumRecorder
+from google_photos_archiver.archivers import (
+    DEFAULT_DOWNLOAD_SEGMENTS,
+    DiskArchiver,
+    link_into_album,
+)
+from google_photos_archiver.async_media_item_archiver import (
+    DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+    AsyncDiskArchiver,
+    AsyncMediaItemArchiver,
+)
+from google_photos_archiver.base_url_refresher import BaseUrlRefresher
+from google_photos_archiver.concurrency import (
+    DEFAULT_MIN_CONCURRENCY,
+    AdaptiveConcurrencyLimiter,
+    merge_concurrently,
+)
+from google_photos_archiver.filters import (
+    Date,
+    DateFilter,
+    DateRange,
+    IncludeArchivedMediaFilter,
+    get_yearly_date_ranges,
+)
+from google_photos_archiver.fsync_policy import FsyncPolicy
+from google_photos_archiver.incremental_sync import (
+    LIBRARY_SCOPE,
+    IncrementalSync,
+    get_album_scope,
+)
+from google_photos_archiver.listing_checkpoint import ListingCheckpoint
+from google_photos_archiver.media_item import DEFAULT_CHUNK_SIZE, MediaItem
 from google_photos_archiver.media_item_archiver import MediaItemArchiver
-from google_photos_archiver.media_item_recorder import MediaItemRecorder
-from google_photos_archiver.rest_client import GooglePhotosApiRestClient
+from google_photos_archiver.media_item_recorder import (
+    DEFAULT_FLUSH_INTERVAL_SECONDS,
+    DEFAULT_FLUSH_SIZE,
+    MediaItemRecorder,
+)
+from google_photos_archiver.rate_limiter import BandwidthSchedule, RateLimiter
+from google_photos_archiver.rest_client import (
+    DEFAULT_DATE_SEARCH_WORKERS,
+    MEDIA_ITEMS_MAX_PAGE_SIZE,
+    GooglePhotosApiRestClient,
+)
+from google_photos_archiver.retry import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+# Sharded listings get a DateRange per year from here on, with everything older in one
+SHARDED_LISTING_START_YEAR = 2000
+DEFAULT_ALBUM_LISTING_WORKERS = 4
+DEFAULT_REBUILD_ALBUMS_WORKERS = 8
 
 
 class Timer:
@@ -67,15 +128,26 @@ def validate_dates(_, param, value):
             + ". See archive-media-items --help for more details"
         )
 
-    entries = len(value.split(","))
-    if entries > 5:
-        raise click.BadParameter(
-            f"Must provide 5 or less of {param.opts[0]}. Got {entries}"
-        )
-
     return value
 
 
+def get_bandwidth_schedule(
+    download_bandwidth_schedule: Optional[str],
+    max_download_bytes_per_second: Optional[float],
+) -> Optional[BandwidthSchedule]:
+    if download_bandwidth_schedule is None:
+        return None
+
+    try:
+        return BandwidthSchedule.from_string(
+            download_bandwidth_schedule, default_rate=max_download_bytes_per_second
+        )
+    except ValueError as err:
+        raise click.BadParameter(
+            str(err), param_hint="--download-bandwidth-schedule"
+        ) from err
+
+
 def get_date_objects_from_filters(
     date_filter: Optional[str], date_range_filter: Optional[str]
 ) -> Tuple[List[Date], List[DateRange]]:
@@ -117,34 +189,285 @@ def get_date_objects_from_filters(
     return dates, date_ranges
 
 
+# pylint: disable=too-many-arguments
 def get_media_items(
     google_photos_api_rest_client: GooglePhotosApiRestClient,
     dates: Optional[List[Date]] = None,
     date_ranges: Optional[List[DateRange]] = None,
     album: Optional[Album] = None,
+    listing_workers: Optional[int] = None,
+    incremental_sync: Optional[IncrementalSync] = None,
 ) -> Generator[MediaItem, None, None]:
     if dates or date_ranges:
-        media_items = google_photos_api_rest_client.search_media_items_paginated(
-            filters=[DateFilter(dates=dates, date_ranges=date_ranges)],
+        # Explicitly filtered listings are never incremental
+        return google_photos_api_rest_client.search_media_items_by_dates(
+            dates=dates,
+            date_ranges=date_ranges,
+            max_workers=listing_workers or DEFAULT_DATE_SEARCH_WORKERS,
+        )
+
+    if album is not None:
+        if incremental_sync is None:
+            return google_photos_api_rest_client.search_media_items_paginated(
+                album_id=album.id,
+            )
+        if incremental_sync.is_album_unchanged(album):
+            logger.info("Skipping unchanged Album with id: %s", album.id)
+            return iter([])
+        return incremental_sync.watch(
+            get_album_scope(album),
+            google_photos_api_rest_client.search_media_items_paginated(
+                album_id=album.id,
+            ),
+            media_items_count=album.mediaItemsCount,
         )
-    elif album is not None:
+
+    date_range = (
+        None
+        if incremental_sync is None
+        else incremental_sync.get_date_range(LIBRARY_SCOPE)
+    )
+    if date_range is not None:
+        logger.info("Listing MediaItems created since: %s", date_range.startDate)
         media_items = google_photos_api_rest_client.search_media_items_paginated(
-            album_id=album.id,
+            filters=[
+                DateFilter(date_ranges=[date_range]),
+                IncludeArchivedMediaFilter(),
+            ],
+        )
+    elif listing_workers is not None:
+        media_items = google_photos_api_rest_client.search_media_items_sharded(
+            get_yearly_date_ranges(
+                SHARDED_LISTING_START_YEAR, datetime.date.today().year
+            ),
+            max_workers=listing_workers,
         )
     else:
         media_items = google_photos_api_rest_client.get_media_items_paginated()
+
+    if incremental_sync is not None:
+        media_items = incremental_sync.watch(LIBRARY_SCOPE, media_items)
     return media_items
 
 
+def get_album_path(
+    download_path: str, album_id: str, album_title: Optional[str] = None
+) -> Path:
+    if album_title is None:
+        album_title = f"Album ID: {album_id}"
+    return Path(download_path, "albums", album_title)
+
+
+class AlbumListing:
+    """
+    Lists the MediaItems of many Albums concurrently as one stream of unique MediaItems,
+    so that a single pipeline downloads each of them once no matter how many Albums
+    they're in. Every Album that a MediaItem was listed in is kept track of in
+    `album_media_items`, for their symlinks to be created in bulk afterwards, and each
+    fully listed Album is added to the `album_recorder` if one is provided
+    """
+
+    # pylint: disable=too-many-arguments
+
+    def __init__(
+        self,
+        google_photos_api_rest_client: GooglePhotosApiRestClient,
+        albums: Iterable[Album],
+        download_path: str,
+        listing_workers: int = DEFAULT_ALBUM_LISTING_WORKERS,
+        incremental_sync: Optional[IncrementalSync] = None,
+        album_recorder: Optional[AlbumRecorder] = None,
+    ):
+        self.google_photos_api_rest_client = google_photos_api_rest_client
+        self.albums = albums
+        self.download_path = download_path
+        self.listing_workers = listing_workers
+        self.incremental_sync = incremental_sync
+        self.album_recorder = album_recorder
+        self.album_media_items: Dict[Path, List[MediaItem]] = defaultdict(list)
+
+    def _list_album(self, album: Album) -> Iterator[Tuple[Path, MediaItem]]:
+        album_path = get_album_path(self.download_path, album.id, album.title)
+        # Albums skipped by an incremental listing keep what was recorded for them
+        record = self.album_recorder is not None and not (
+            self.incremental_sync is not None
+            and self.incremental_sync.is_album_unchanged(album)
+        )
+        media_items = []
+
+        for media_item in get_media_items(
+            self.google_photos_api_rest_client,
+            album=album,
+            incremental_sync=self.incremental_sync,
+        ):
+            media_items.append(media_item)
+            yield album_path, media_item
+
+        if record:
+            self.album_recorder.add(album, media_items)
+
+    def __iter__(self) -> Iterator[MediaItem]:
+        listed_media_item_ids: Set[str] = set()
+
+        for album_path, media_item in merge_concurrently(
+            (self._list_album(album) for album in self.albums),
+            max_workers=self.listing_workers,
+            max_buffered=MEDIA_ITEMS_MAX_PAGE_SIZE * self.listing_workers,
+            name="album",
+        ):
+            self.album_media_items[album_path].append(media_item)
+
+            if media_item.id not in listed_media_item_ids:
+                listed_media_item_ids.add(media_item.id)
+                yield media_item
+
+
+def rebuild_album_symlinks(
+    download_path: str, album_recorder: AlbumRecorder, max_workers: int
+) -> int:
+    """
+    Rebuilds the symlinks of every recorded Album, an Album per worker, without any API
+    calls. Returns the amount of symlinks that were created
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(
+            executor.map(
+                lambda album: link_into_album(
+                    get_album_path(download_path, album.id, album.title),
+                    [
+                        Path(download_path, media_item_path)
+                        for media_item_path in album.media_item_paths
+                    ],
+                    repair=True,
+                ),
+                album_recorder.get_albums(),
+            )
+        )
+
+
+class Engine:
+    THREAD = "thread"
+    ASYNC = "async"
+
+
+def validate_engine_options(
+    engine: str,
+    segment_threshold: Optional[int] = None,
+    adaptive_concurrency: bool = False,
+    requeue_failed_downloads: bool = False,
+):
+    """
+    The async engine has a download loop of its own, which none of these apply to
+    """
+    if engine != Engine.ASYNC:
+        return
+
+    incompatible_options = [
+        option
+        for option, is_set in [
+            ("--segmented-download-threshold", segment_threshold is not None),
+            ("--adaptive-concurrency", adaptive_concurrency),
+            ("--requeue-failed-downloads", requeue_failed_downloads),
+        ]
+        if is_set
+    ]
+    if incompatible_options:
+        raise click.UsageError(
+            f"{', '.join(incompatible_options)} can't be used with --engine async"
+        )
+
+
+def _get_concurrency_limiter(
+    disk_archiver: DiskArchiver, min_limit: int, max_limit: int
+) -> AdaptiveConcurrencyLimiter:
+    concurrency_limiter = AdaptiveConcurrencyLimiter(
+        min_limit=min_limit,
+        max_limit=max_limit,
+        bytes_written=lambda: disk_archiver.bytes_written,
+    )
+    # Only 429s from downloads back the limiter off, not the ones from the API
+    disk_archiver.retry_policy = disk_archiver.retry_policy.with_on_throttled(
+        concurrency_limiter.record_throttled
+    )
+    return concurrency_limiter
+
+
+# pylint: disable=too-many-arguments,too-many-locals
 def get_media_item_archiver(
     download_path: str,
     max_threadpool_workers: int,
     sqlite_db_path: str,
-) -> MediaItemArchiver:
-    return MediaItemArchiver(
-        archiver=DiskArchiver(
-            base_download_path=Path(download_path),
-            recorder=MediaItemRecorder(sqlite_db_path=Path(sqlite_db_path)),
+    download_chunk_size: int = DEFAULT_CHUNK_SIZE,
+    session: Optional[requests.Session] = None,
+    engine: str = Engine.THREAD,
+    max_concurrent_downloads: int = DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+    adaptive_concurrency: bool = False,
+    min_concurrent_downloads: int = DEFAULT_MIN_CONCURRENCY,
+    rate_limiter: Optional[RateLimiter] = None,
+    retry_policy: Optional[RetryPolicy] = None,
+    requeue_failed_downloads: bool = False,
+    base_url_refresher: Optional[BaseUrlRefresher] = None,
+    segment_threshold: Optional[int] = None,
+    download_segments: int = DEFAULT_DOWNLOAD_SEGMENTS,
+    max_concurrent_video_downloads: Optional[int] = None,
+    listing_checkpoint: Optional[ListingCheckpoint] = None,
+    recorder_flush_interval: float = DEFAULT_FLUSH_INTERVAL_SECONDS,
+    recorder_flush_size: int = DEFAULT_FLUSH_SIZE,
+    content_addressed: bool = False,
+    fsync_policy: Optional[FsyncPolicy] = None,
+) -> Union[MediaItemArchiver, AsyncMediaItemArchiver]:
+    recorder = MediaItemRecorder(
+        sqlite_db_path=Path(sqlite_db_path),
+        flush_interval=recorder_flush_interval,
+        flush_size=recorder_flush_size,
+    )
+    retry_policy = RetryPolicy() if retry_policy is None else retry_policy
+
+    if engine == Engine.ASYNC:
+        return AsyncMediaItemArchiver(
+            archiver=AsyncDiskArchiver(
+                base_download_path=Path(download_path),
+                recorder=recorder,
+                chunk_size=download_chunk_size,
+                rate_limiter=rate_limiter,
+                retry_policy=retry_policy,
+                content_addressed=content_addressed,
+                fsync_policy=fsync_policy,
+            ),
+            max_concurrent_downloads=max_concurrent_downloads,
+            base_url_refresher=base_url_refresher,
+            max_concurrent_video_downloads=max_concurrent_video_downloads,
+            listing_checkpoint=listing_checkpoint,
+        )
+
+    disk_archiver = DiskArchiver(
+        base_download_path=Path(download_path),
+        recorder=recorder,
+        chunk_size=download_chunk_size,
+        session=session,
+        rate_limiter=rate_limiter,
+        segment_threshold=segment_threshold,
+        download_segments=download_segments,
+        content_addressed=content_addressed,
+        fsync_policy=fsync_policy,
+        # Requeued downloads are retried by the MediaItemArchiver instead
+        retry_policy=(
+            retry_policy.without_retries() if requeue_failed_downloads else retry_policy
         ),
+    )
+
+    return MediaItemArchiver(
+        archiver=disk_archiver,
         max_threadpool_workers=max_threadpool_workers,
+        concurrency_limiter=(
+            _get_concurrency_limiter(
+                disk_archiver, min_concurrent_downloads, max_threadpool_workers
+            )
+            if adaptive_concurrency
+            else None
+        ),
+        retry_policy=retry_policy if requeue_failed_downloads else None,
+        base_url_refresher=base_url_refresher,
+        max_video_workers=max_concurrent_video_downloads,
+        listing_checkpoint=listing_checkpoint,
     )
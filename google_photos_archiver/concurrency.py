@@ -0,0 +1,268 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_CONCURRENCY = 4
+DEFAULT_WINDOW_SECONDS = 5.0
+
+T = TypeVar("T")
+
+# How often a blocked producer checks whether its consumer went away
+_PREFETCH_POLL_SECONDS = 0.1
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Bounds the number of in-flight downloads and adjusts that bound at runtime in an
+    AIMD (additive increase, multiplicative decrease) fashion:
+
+    - The limit grows by one for every `limit` successful downloads, as long as the
+      throughput observed over the last window didn't drop
+    - The limit is cut by `decrease_factor` when a download gets throttled (429), or when
+      the error rate over the last window exceeds `max_error_rate`
+    - A `Retry-After` pauses all new downloads until it has elapsed
+
+    Ref: https://en.wikipedia.org/wiki/Additive_increase/multiplicative_decrease
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+
+    def __init__(
+        self,
+        min_limit: int = DEFAULT_MIN_CONCURRENCY,
+        max_limit: int = 100,
+        initial_limit: Optional[int] = None,
+        window_seconds: float = DEFAULT_WINDOW_SECONDS,
+        decrease_factor: float = 0.5,
+        max_error_rate: float = 0.1,
+        throughput_tolerance: float = 0.1,
+        bytes_written: Optional[Callable[[], int]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError(
+                f"Expected 1 <= min_limit <= max_limit. Got: {min_limit}, {max_limit}"
+            )
+
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = (
+            min_limit
+            if initial_limit is None
+            else max(min_limit, min(max_limit, initial_limit))
+        )
+        self.window_seconds = window_seconds
+        self.decrease_factor = decrease_factor
+        self.max_error_rate = max_error_rate
+        self.throughput_tolerance = throughput_tolerance
+
+        self._bytes_written = bytes_written
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._successes_since_increase = 0
+        self._increase_allowed = True
+        self._last_decrease = float("-inf")
+        self._previous_throughput: Optional[float] = None
+        self._reset_window()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _reset_window(self):
+        self._window_started = self._clock()
+        self._window_successes = 0
+        self._window_errors = 0
+        self._window_bytes_start = self._get_bytes_written()
+
+    def _get_bytes_written(self) -> int:
+        return 0 if self._bytes_written is None else self._bytes_written()
+
+    def acquire(self):
+        with self._condition:
+            while True:
+                pause = self._paused_until - self._clock()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif self._in_flight >= self.limit:
+                    self._condition.wait()
+                else:
+                    break
+            self._in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def record_success(self):
+        with self._condition:
+            self._window_successes += 1
+            self._successes_since_increase += 1
+
+            if self._increase_allowed and self._successes_since_increase >= self.limit:
+                self._set_limit(self.limit + 1)
+
+            self._maybe_evaluate_window()
+
+    def record_error(self):
+        with self._condition:
+            self._window_errors += 1
+            self._maybe_evaluate_window()
+
+    def record_throttled(self, retry_after: Optional[float] = None):
+        with self._condition:
+            self._window_errors += 1
+            self._decrease()
+
+            if retry_after is not None and retry_after > 0:
+                logger.warning("Throttled. Pausing downloads for %.1fs", retry_after)
+                self._paused_until = max(
+                    self._paused_until, self._clock() + retry_after
+                )
+
+    def _set_limit(self, limit: int):
+        limit = max(self.min_limit, min(self.max_limit, limit))
+        if limit != self.limit:
+            logger.info("Adjusting concurrent downloads: %d -> %d", self.limit, limit)
+            self.limit = limit
+            self._condition.notify_all()
+        self._successes_since_increase = 0
+
+    def _decrease(self):
+        # Many in-flight downloads tend to fail at once, so only back off once per window
+        now = self._clock()
+        if now - self._last_decrease < self.window_seconds:
+            return
+        self._last_decrease = now
+        self._set_limit(int(self.limit * self.decrease_factor))
+
+    def _maybe_evaluate_window(self):
+        now = self._clock()
+        elapsed = now - self._window_started
+        if elapsed < self.window_seconds:
+            return
+
+        completed = self._window_successes + self._window_errors
+        error_rate = self._window_errors / completed if completed else 0.0
+
+        if self._bytes_written is None:
+            throughput = self._window_successes / elapsed
+        else:
+            throughput = (
+                self._get_bytes_written() - self._window_bytes_start
+            ) / elapsed
+
+        if error_rate > self.max_error_rate:
+            self._decrease()
+        elif (
+            self._previous_throughput is not None
+            and throughput < self._previous_throughput * (1 - self.throughput_tolerance)
+        ):
+            # More concurrency stopped buying more throughput; step back and hold
+            self._increase_allowed = False
+            self._set_limit(self.limit - 1)
+        else:
+            self._increase_allowed = True
+
+        self._previous_throughput = throughput
+        self._reset_window()
+
+
+class _ProducerError:
+    def __init__(self, err: BaseException):
+        self.err = err
+
+
+_PRODUCER_DONE = object()
+
+
+def merge_concurrently(
+    iterables: Iterable[Iterable[T]],
+    max_workers: int,
+    max_buffered: int,
+    name: str = "merge",
+) -> Iterator[T]:
+    """
+    Iterates over `iterables` on up to `max_workers` background threads at once and
+    yields their items as they come in, buffering up to `max_buffered` of them ahead of
+    the consumer. Errors are re-raised to the consumer, and the background threads stop
+    once the consumer stops iterating
+    """
+    pending: "queue.SimpleQueue" = queue.SimpleQueue()
+    for iterable in iterables:
+        pending.put(iterable)
+    remaining = pending.qsize()
+
+    buffered: "queue.Queue" = queue.Queue(maxsize=max_buffered)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                buffered.put(item, timeout=_PREFETCH_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(iterable: Iterable[T]):
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as err:  # pylint: disable=broad-except
+            put(_ProducerError(err))
+            return
+        put(_PRODUCER_DONE)
+
+    def work():
+        while not stopped.is_set():
+            try:
+                produce(pending.get_nowait())
+            except queue.Empty:
+                return
+
+    # Daemon threads, as an abandoned iteration must not keep the process alive
+    for i in range(min(max_workers, remaining)):
+        threading.Thread(target=work, name=f"{name}-{i}", daemon=True).start()
+
+    try:
+        while remaining:
+            item = buffered.get()
+            if item is _PRODUCER_DONE:
+                remaining -= 1
+            elif isinstance(item, _ProducerError):
+                raise item.err
+            else:
+                yield item
+    finally:
+        stopped.set()
+
+
+def prefetch(
+    iterable: Iterable[T], max_prefetched: int, name: str = "prefetch"
+) -> Iterator[T]:
+    """
+    Iterates over `iterable` on a background thread that stays up to `max_prefetched`
+    items ahead of the consumer, e.g. to fetch the next pages of a listing while the
+    current one is being processed
+    """
+    return merge_concurrently(
+        [iterable], max_workers=1, max_buffered=max_prefetched, name=name
+    )
@@ -1,6 +1,9 @@
 from dataclasses import asdict, dataclass
 from typing import Dict, List
 
+# The most Dates, and separately DateRanges, that a single DateFilter may include
+MAX_DATE_FILTER_ENTRIES = 5
+
 
 class Filter:
     def get_filter(self) -> Dict:
@@ -37,11 +40,17 @@ class DateFilter(Filter):
         if date_ranges is None:
             date_ranges = []
 
-        if len(dates) > 5:
-            raise RuntimeError("A maximum of 5 Dates can be included per request.")
+        if len(dates) > MAX_DATE_FILTER_ENTRIES:
+            raise RuntimeError(
+                f"A maximum of {MAX_DATE_FILTER_ENTRIES} Dates can be included per"
+                " request."
+            )
 
-        if len(date_ranges) > 5:
-            raise RuntimeError("A maximum of 5 DateRanges can be included per request.")
+        if len(date_ranges) > MAX_DATE_FILTER_ENTRIES:
+            raise RuntimeError(
+                f"A maximum of {MAX_DATE_FILTER_ENTRIES} DateRanges can be included per"
+                " request."
+            )
 
         self.dates = dates
         self.date_ranges = date_ranges
@@ -56,3 +65,54 @@ class DateFilter(Filter):
                 "ranges": [asdict(date_range) for date_range in self.date_ranges],
             }
         }
+
+
+def chunk_date_filter(
+    dates: List[Date] = None, date_ranges: List[DateRange] = None
+) -> List[DateFilter]:
+    """
+    Splits any number of `dates` and `date_ranges` into as few DateFilters as the API
+    accepts. A MediaItem matches a DateFilter if it matches any of its Dates or DateRanges,
+    so searching each of the returned DateFilters covers the same MediaItems
+    """
+    dates = dates or []
+    date_ranges = date_ranges or []
+
+    return [
+        DateFilter(
+            dates=dates[i : i + MAX_DATE_FILTER_ENTRIES],
+            date_ranges=date_ranges[i : i + MAX_DATE_FILTER_ENTRIES],
+        )
+        for i in range(0, max(len(dates), len(date_ranges), 1), MAX_DATE_FILTER_ENTRIES)
+    ]
+
+
+class IncludeArchivedMediaFilter(Filter):
+    """
+    Unlike listing MediaItems, searching leaves archived MediaItems out by default
+
+    Ref: https://developers.google.com/photos/library/reference/rest/v1/mediaItems/search#Filters
+    """
+
+    def get_filter(self) -> Dict:
+        return {"includeArchivedMedia": True}
+
+
+# The earliest and latest Dates that the API accepts
+MIN_DATE = Date(year=1, month=1, day=1)
+MAX_DATE = Date(year=9999, month=12, day=31)
+
+
+def get_yearly_date_ranges(start_year: int, end_year: int) -> List[DateRange]:
+    """
+    Splits the entire timeline into non-overlapping DateRanges: one for each year from
+    `start_year` through `end_year`, plus open ended ones for before and after
+    """
+    return (
+        [DateRange(startDate=MIN_DATE, endDate=Date(start_year - 1, 12, 31))]
+        + [
+            DateRange(startDate=Date(year, 1, 1), endDate=Date(year, 12, 31))
+            for year in range(start_year, end_year + 1)
+        ]
+        + [DateRange(startDate=Date(end_year + 1, 1, 1), endDate=MAX_DATE)]
+    )
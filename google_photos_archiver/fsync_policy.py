@@ -0,0 +1,137 @@
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FSYNC_BATCH_SIZE = 100
+DEFAULT_FSYNC_BATCH_SECONDS = 5.0
+
+# Directories can't be opened, let alone fsynced, on Windows
+_CAN_FSYNC_DIRECTORIES = os.name == "posix"
+
+
+class FsyncMode:
+    NONE = "none"
+    FILE = "file"
+    BATCH = "batch"
+
+
+def fsync_path(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_directories(directories: Iterable[Path]):
+    """
+    Fsyncs the directories that files were renamed (or linked) into, so that their
+    directory entries are durable as well
+    """
+    if not _CAN_FSYNC_DIRECTORIES:
+        return
+
+    for directory in dict.fromkeys(directories):
+        fsync_path(directory)
+
+
+class FsyncPolicy:
+    """
+    Decides when archived files are made durable, trading safety against throughput:
+
+    - `none`: Left to the OS to write back whenever it sees fit
+    - `file`: Every file is fsynced before it's renamed into place, and its directory
+      right after
+    - `batch`: Every file is still fsynced before it's renamed into place, but their
+      directories are fsynced together, once `batch_size` files are pending or the
+      oldest one has been pending for `batch_interval` seconds, whichever comes first.
+      Both are only checked as files are added, so `flush` has to be called once the
+      last one has been
+
+    Fsyncing a file before renaming it means that a crash never leaves a file in place
+    whose content didn't make it to disk. Files are only reported as durable (see `sync`)
+    once their directories have been fsynced too, so that whatever is recorded about
+    them never gets ahead of their content
+    """
+
+    def __init__(
+        self,
+        mode: str = FsyncMode.NONE,
+        batch_size: int = DEFAULT_FSYNC_BATCH_SIZE,
+        batch_interval: float = DEFAULT_FSYNC_BATCH_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if mode not in (FsyncMode.NONE, FsyncMode.FILE, FsyncMode.BATCH):
+            raise ValueError(f"Unknown fsync mode: {mode}")
+
+        self.mode = mode
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Each pending file's directories, and what to call once they're durable
+        self._pending: List[Tuple[List[Path], Callable[[], None]]] = []
+        self._batch_started: Optional[float] = None
+
+    def sync_file(self, f: BinaryIO):
+        """
+        Meant to be called on a file's (e.g. a `.part` file's) handle once it's been
+        written, before it gets renamed into place
+        """
+        if self.mode == FsyncMode.NONE:
+            return
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    def sync(self, directories: List[Path], on_durable: Callable[[], None]):
+        """
+        Calls `on_durable` once `directories`, which files that were passed to
+        `sync_file` got renamed into, are durable as far as this policy goes. For
+        `batch` that may be on another thread, later on
+        """
+        if self.mode == FsyncMode.NONE:
+            on_durable()
+            return
+
+        if self.mode == FsyncMode.FILE:
+            fsync_directories(directories)
+            on_durable()
+            return
+
+        with self._lock:
+            if not self._pending:
+                self._batch_started = self._clock()
+            self._pending.append((directories, on_durable))
+            is_due = (
+                len(self._pending) >= self.batch_size
+                or self._clock() - self._batch_started >= self.batch_interval
+            )
+
+        if is_due:
+            self.flush()
+
+    def flush(self):
+        """
+        Fsyncs every pending directory, then reports their files as durable
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+
+        if not pending:
+            return
+
+        fsync_directories(
+            directory for directories, _ in pending for directory in directories
+        )
+        logger.debug("Fsynced the directories of a batch of %d file(s)", len(pending))
+
+        for _, on_durable in pending:
+            on_durable()
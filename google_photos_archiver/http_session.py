@@ -0,0 +1,70 @@
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_PHOTOS_API_URL = "https://photoslibrary.googleapis.com/v1/"
+
+# MediaItem content is served from a handful of `*.googleusercontent.com` hosts, so
+# everything that isn't the API is routed through the media adapter
+MEDIA_URL_PREFIX = "https://"
+
+DEFAULT_API_POOL_MAXSIZE = 10
+DEFAULT_MEDIA_POOL_MAXSIZE = 10
+
+# The number of distinct hosts to keep connection pools around for per adapter
+_POOL_CONNECTIONS = 10
+
+
+class PooledSession(requests.Session):
+    """
+    A `requests.Session` that keeps separate keep-alive connection pools for the Google
+    Photos API host and for the hosts that serve MediaItem content. A single instance is
+    meant to be shared by the REST client and every download worker so that connections
+    (and their TCP + TLS handshakes) get reused across requests.
+
+    Ref: https://docs.python-requests.org/en/master/user/advanced/#session-objects
+    """
+
+    def __init__(
+        self,
+        api_pool_maxsize: int = DEFAULT_API_POOL_MAXSIZE,
+        media_pool_maxsize: int = DEFAULT_MEDIA_POOL_MAXSIZE,
+        api_url: str = GOOGLE_PHOTOS_API_URL,
+    ):
+        super().__init__()
+        self.api_url = api_url
+        self.api_pool_maxsize = api_pool_maxsize
+        self.media_pool_maxsize = media_pool_maxsize
+        self.resize(api_pool_maxsize, media_pool_maxsize)
+
+    def resize(self, api_pool_maxsize: int, media_pool_maxsize: int):
+        """
+        (Re)mount the API and media adapters with the given connection pool sizes.
+        The number of concurrent download workers is a good `media_pool_maxsize`, as any
+        connections beyond the pool size are discarded instead of being kept alive
+        """
+        logger.info(
+            "Sizing connection pools: api=%d, media=%d",
+            api_pool_maxsize,
+            media_pool_maxsize,
+        )
+
+        self.api_pool_maxsize = api_pool_maxsize
+        self.media_pool_maxsize = media_pool_maxsize
+
+        for prefix, pool_maxsize in [
+            (self.api_url, api_pool_maxsize),
+            (MEDIA_URL_PREFIX, media_pool_maxsize),
+        ]:
+            previous_adapter = self.adapters.get(prefix)
+            self.mount(
+                prefix,
+                HTTPAdapter(
+                    pool_connections=_POOL_CONNECTIONS, pool_maxsize=pool_maxsize
+                ),
+            )
+            if previous_adapter is not None:
+                previous_adapter.close()
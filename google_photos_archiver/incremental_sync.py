@@ -0,0 +1,212 @@
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from google_photos_archiver.album import Album
+from google_photos_archiver.filters import MAX_DATE, Date, DateRange
+from google_photos_archiver.media_item import MediaItem
+
+logger = logging.getLogger(__name__)
+
+LIBRARY_SCOPE = "library"
+
+# How long a connection waits on a lock held by another one before giving up
+_BUSY_TIMEOUT_SECONDS = 30.0
+
+_CREATION_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def get_album_scope(album: Album) -> str:
+    return f"album:{album.id}"
+
+
+@dataclass
+class HighWaterMark:
+    creation_time: datetime
+    media_item_id: str
+    # Only recorded for Albums, whose MediaItems can't be searched by date
+    media_items_count: Optional[str] = None
+
+
+class IncrementalSync:
+    """
+    Remembers the newest MediaItem that was archived per scope (the whole library, or an
+    Album) in a sqlite db, so that later runs only list what was added since:
+
+    - The library is searched from the day before its newest MediaItem's `creationTime`
+      onwards (the day before, as search dates aren't timezone aware)
+    - Albums can't be searched by date, so an Album whose `mediaItemsCount` is unchanged
+      isn't listed at all
+
+    Marks observed while listing are only persisted by `save`, which is meant to be called
+    once every listed MediaItem has been archived. MediaItems that are still processing
+    hold the mark back, so that they get listed again by the next run
+    """
+
+    def __init__(self, sqlite_db_path: Path):
+        self.sqlite_db_path = sqlite_db_path
+
+        self._lock = threading.Lock()
+        self._observed: Dict[str, HighWaterMark] = {}
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+        with self.connection as _connection:
+            _connection.execute("""CREATE TABLE IF NOT EXISTS high_water_marks (
+                    scope varchar unique primary key,
+                    creation_time varchar not null,
+                    media_item_id varchar not null,
+                    media_items_count varchar
+                )""")
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Only ever used by the thread that opened it, but closed by `close`
+            connection = sqlite3.connect(
+                self.sqlite_db_path,
+                timeout=_BUSY_TIMEOUT_SECONDS,
+                check_same_thread=False,
+            )
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def get(self, scope: str) -> Optional[HighWaterMark]:
+        with self.connection as _connection:
+            row = _connection.execute(
+                "SELECT creation_time, media_item_id, media_items_count"
+                " FROM high_water_marks WHERE scope = ?",
+                (scope,),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        creation_time, media_item_id, media_items_count = row
+        return HighWaterMark(
+            creation_time=datetime.strptime(creation_time, _CREATION_TIME_FORMAT),
+            media_item_id=media_item_id,
+            media_items_count=media_items_count,
+        )
+
+    def get_date_range(self, scope: str) -> Optional[DateRange]:
+        """
+        Returns the DateRange that MediaItems added since the last run of `scope` fall
+        into, or `None` if `scope` never completed a run
+        """
+        high_water_mark = self.get(scope)
+        if high_water_mark is None:
+            return None
+
+        start_date = (high_water_mark.creation_time - timedelta(days=1)).date()
+        return DateRange(
+            startDate=Date(
+                year=start_date.year, month=start_date.month, day=start_date.day
+            ),
+            endDate=MAX_DATE,
+        )
+
+    def is_album_unchanged(self, album: Album) -> bool:
+        high_water_mark = self.get(get_album_scope(album))
+        return (
+            high_water_mark is not None
+            and high_water_mark.media_items_count == album.mediaItemsCount
+        )
+
+    def watch(
+        self,
+        scope: str,
+        media_items: Iterable[MediaItem],
+        media_items_count: Optional[str] = None,
+    ) -> Iterator[MediaItem]:
+        """
+        Yields `media_items` while keeping track of the newest one. The new mark of
+        `scope` is only observed once `media_items` have been listed in full
+        """
+        newest: Optional[MediaItem] = None
+        oldest_unready: Optional[MediaItem] = None
+
+        for media_item in media_items:
+            if not media_item.is_ready:
+                if (
+                    oldest_unready is None
+                    or media_item.creationTime < oldest_unready.creationTime
+                ):
+                    oldest_unready = media_item
+            elif newest is None or media_item.creationTime > newest.creationTime:
+                newest = media_item
+            yield media_item
+
+        marks = [self.get(scope)]
+        if newest is not None:
+            marks.append(
+                HighWaterMark(
+                    creation_time=newest.creationTime, media_item_id=newest.id
+                )
+            )
+        mark = max(
+            (mark for mark in marks if mark is not None),
+            key=lambda mark: mark.creation_time,
+            default=None,
+        )
+        if mark is None:
+            return
+
+        if oldest_unready is not None:
+            if mark.creation_time >= oldest_unready.creationTime:
+                # Stay short of the MediaItem that's still processing, for the next run
+                # to list it again
+                mark = HighWaterMark(
+                    creation_time=oldest_unready.creationTime - timedelta(seconds=1),
+                    media_item_id=oldest_unready.id,
+                )
+            # An Album with MediaItems that are still processing has to be listed again,
+            # whether or not its count changes
+            media_items_count = None
+
+        mark.media_items_count = media_items_count
+        with self._lock:
+            self._observed[scope] = mark
+
+    def save(self):
+        with self._lock:
+            observed = self._observed
+            self._observed = {}
+
+        with self.connection as _connection:
+            _connection.executemany(
+                "INSERT OR REPLACE INTO high_water_marks"
+                "(scope, creation_time, media_item_id, media_items_count)"
+                " VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        scope,
+                        mark.creation_time.strftime(_CREATION_TIME_FORMAT),
+                        mark.media_item_id,
+                        mark.media_items_count,
+                    )
+                    for scope, mark in observed.items()
+                ],
+            )
+
+        logger.info("Saved the high-water marks of %d scope(s)", len(observed))
+
+    def close(self):
+        """
+        Closes every connection. Observed marks that weren't saved yet are kept, and
+        connections get reopened as needed if it's used afterwards
+        """
+        with self._connections_lock:
+            connections = self._connections
+            self._connections = []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
@@ -0,0 +1,233 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from google_photos_archiver.media_item import MediaItem
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REMOVAL_FLUSH_INTERVAL_SECONDS = 1.0
+DEFAULT_REMOVAL_FLUSH_SIZE = 500
+
+# How long a connection waits on a lock held by another one before giving up
+_BUSY_TIMEOUT_SECONDS = 30.0
+
+# Page tokens are never empty, so an empty one marks a listing that has no pages left,
+# which is kept around for as long as any of its MediaItems are pending
+_LISTING_COMPLETE = ""
+
+
+class ListingCheckpoint:
+    """
+    Persists the progress of paginated MediaItem listings to a sqlite db, so that a
+    listing that got interrupted (e.g. by a crash) resumes from its last page rather than
+    from the start. Listings are told apart by a `scope`, e.g. the filters of a search.
+
+    Every listed MediaItem is also kept in a durable queue of pending MediaItems until
+    it has been recorded as archived, so that nothing that was listed before the
+    interruption gets lost either. MediaItems are taken off of the queue in batches, once
+    `flush_size` of them are waiting to be or the oldest one has been waiting for
+    `flush_interval` seconds, whichever comes first. A crash leaves at most the last batch on the queue,
+    whose MediaItems get skipped as already archived once they're resumed
+
+    Each thread reuses one connection of its own
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+        self,
+        sqlite_db_path: Path,
+        flush_interval: float = DEFAULT_REMOVAL_FLUSH_INTERVAL_SECONDS,
+        flush_size: int = DEFAULT_REMOVAL_FLUSH_SIZE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.sqlite_db_path = sqlite_db_path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        self._clock = clock
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+        self._removals_lock = threading.Lock()
+        self._removals: List[str] = []
+        self._removals_started: Optional[float] = None
+
+        with self.connection as _connection:
+            _connection.execute("""CREATE TABLE IF NOT EXISTS listing_checkpoints (
+                    scope varchar unique primary key,
+                    page_token varchar not null,
+                    pages_listed integer not null,
+                    media_items_listed integer not null
+                )""")
+            _connection.execute("""CREATE TABLE IF NOT EXISTS pending_media_items (
+                    media_item_id varchar unique primary key,
+                    scope varchar not null,
+                    media_item json not null
+                )""")
+            _connection.execute(
+                "CREATE INDEX IF NOT EXISTS pending_media_items_scope"
+                " ON pending_media_items (scope)"
+            )
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Only ever used by the thread that opened it, but closed by `close`
+            connection = sqlite3.connect(
+                self.sqlite_db_path,
+                timeout=_BUSY_TIMEOUT_SECONDS,
+                check_same_thread=False,
+            )
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def resume(self, scope: str) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """
+        Returns the page token that an interrupted listing of `scope` left off at, along
+        with the MediaItems it listed that are still pending. A listing that got through
+        its last page returns `None` along with its pending MediaItems, as there's
+        nothing left to list. Once none are pending (or there's no listing to resume),
+        returns `None` and no MediaItems, and forgets about the listing, as it'll be
+        listed again from the start
+        """
+        self.flush()
+        with self.connection as _connection:
+            checkpoint = _connection.execute(
+                "SELECT page_token FROM listing_checkpoints WHERE scope = ?", (scope,)
+            ).fetchone()
+            pending_media_items = (
+                []
+                if checkpoint is None
+                else _connection.execute(
+                    "SELECT media_item FROM pending_media_items WHERE scope = ?",
+                    (scope,),
+                ).fetchall()
+            )
+
+            if checkpoint is None or (
+                checkpoint[0] == _LISTING_COMPLETE and not pending_media_items
+            ):
+                _connection.execute(
+                    "DELETE FROM listing_checkpoints WHERE scope = ?", (scope,)
+                )
+                _connection.execute(
+                    "DELETE FROM pending_media_items WHERE scope = ?", (scope,)
+                )
+                return None, []
+
+        page_token = None if checkpoint[0] == _LISTING_COMPLETE else checkpoint[0]
+        return page_token, [
+            json.loads(pending_media_item)
+            for (pending_media_item,) in pending_media_items
+        ]
+
+    def record_page(
+        self,
+        scope: str,
+        media_item_dicts: List[Dict[str, Any]],
+        next_page_token: Optional[str],
+    ):
+        """
+        Adds a page's MediaItems to the pending queue and moves the checkpoint past the
+        page in a single transaction. A `next_page_token` of `None` completes the
+        listing, whose pending MediaItems are still resumed
+        """
+        listed_at = time.time()
+
+        with self.connection as _connection:
+            _connection.executemany(
+                "INSERT OR REPLACE INTO pending_media_items"
+                "(media_item_id, scope, media_item) VALUES (?, ?, ?)",
+                [
+                    (
+                        media_item_dict["id"],
+                        scope,
+                        # Pending MediaItems keep track of how old their `baseUrl` is
+                        json.dumps({**media_item_dict, "listedAt": listed_at}),
+                    )
+                    for media_item_dict in media_item_dicts
+                ],
+            )
+
+            _connection.execute(
+                """INSERT INTO listing_checkpoints
+                    (scope, page_token, pages_listed, media_items_listed)
+                VALUES (?, ?, 1, ?)
+                ON CONFLICT(scope) DO UPDATE SET
+                    page_token = excluded.page_token,
+                    pages_listed = pages_listed + 1,
+                    media_items_listed = media_items_listed + excluded.media_items_listed
+                """,
+                (
+                    scope,
+                    _LISTING_COMPLETE if next_page_token is None else next_page_token,
+                    len(media_item_dicts),
+                ),
+            )
+
+    def get_progress(self, scope: str) -> Optional[Tuple[int, int]]:
+        """
+        Returns how many pages and MediaItems an unfinished listing of `scope` got through.
+        Returns `None` once it has got through its last page
+        """
+        with self.connection as _connection:
+            return _connection.execute(
+                "SELECT pages_listed, media_items_listed FROM listing_checkpoints"
+                " WHERE scope = ? AND page_token != ?",
+                (scope, _LISTING_COMPLETE),
+            ).fetchone()
+
+    def remove_pending(self, media_item: MediaItem):
+        with self._removals_lock:
+            if not self._removals:
+                self._removals_started = self._clock()
+            self._removals.append(media_item.id)
+            is_due = (
+                len(self._removals) >= self.flush_size
+                or self._clock() - self._removals_started >= self.flush_interval
+            )
+
+        if is_due:
+            self.flush()
+
+    def flush(self):
+        """
+        Takes every MediaItem passed to `remove_pending` so far off of the queue
+        """
+        with self._removals_lock:
+            removals = self._removals
+            self._removals = []
+
+        if not removals:
+            return
+
+        with self.connection as _connection:
+            _connection.executemany(
+                "DELETE FROM pending_media_items WHERE media_item_id = ?",
+                [(media_item_id,) for media_item_id in removals],
+            )
+        logger.debug("Removed %d pending MediaItem(s)", len(removals))
+
+    def close(self):
+        """
+        Flushes and closes every connection. The checkpoint can still be used
+        afterwards, reopening connections as needed
+        """
+        self.flush()
+
+        with self._connections_lock:
+            connections = self._connections
+            self._connections = []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
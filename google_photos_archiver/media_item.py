@@ -1,16 +1,35 @@
 import enum
 import logging
+import sys
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
 
 # Ref: https://developers.google.com/photos/library/guides/access-media-items
 import requests
 
+from google_photos_archiver.retry import RetryPolicy
+
 logger = logging.getLogger(__name__)
 
+# Size of the chunks that MediaItem content is streamed to disk in. Keeps memory usage
+# per download worker constant regardless of the size of the MediaItem
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+PARTIAL_CONTENT = 206
+RANGE_NOT_SATISFIABLE = 416
+
+# Large videos can take arbitrarily long to download, so rather than the download as a
+# whole, only connecting and each read of its content are given up on after a while
+DOWNLOAD_CONNECT_TIMEOUT_SECONDS = 30.0
+DOWNLOAD_READ_TIMEOUT_SECONDS = 60.0
+
+# A MediaItem's `baseUrl` is only valid for about 60 minutes after it was listed
+# Ref: https://developers.google.com/photos/library/guides/access-media-items#base-urls
+BASE_URL_TTL_SECONDS = 60 * 60
+
 # pylint: disable=invalid-name
 
 
@@ -61,104 +80,317 @@ class VideoMediaMetadata(MediaMetadata):
     video: Optional[VideoMetadata]
 
 
-@dataclass
+# `mediaMetadata` as kept by a MediaItem until it's decoded: `(is_photo, creationTime,
+# width, height, photo or video metadata)`, with the latter being a tuple of the values
+# of `PhotoMetadata` or `VideoMetadata` in field order (or `None` if empty)
+_EncodedMediaMetadata = Tuple[bool, str, str, str, Optional[Tuple[Any, ...]]]
+_IS_PHOTO, _CREATION_TIME, _WIDTH, _HEIGHT, _METADATA = range(5)
+
+_PHOTO_METADATA_FIELDS = tuple(field.name for field in fields(PhotoMetadata))
+_VIDEO_METADATA_FIELDS = tuple(field.name for field in fields(VideoMetadata))
+_VIDEO_STATUS = _VIDEO_METADATA_FIELDS.index("status")
+
+
+def _intern(value: Any) -> Any:
+    # Dimensions, camera makes and models, ... are shared by many MediaItems
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _encode_media_metadata(
+    media_metadata_dict: Dict[str, Any],
+) -> _EncodedMediaMetadata:
+    photo_metadata_dict = media_metadata_dict.get("photo")
+    is_photo = photo_metadata_dict is not None
+
+    metadata_dict = (
+        photo_metadata_dict if is_photo else media_metadata_dict.get("video") or {}
+    )
+    metadata_fields = _PHOTO_METADATA_FIELDS if is_photo else _VIDEO_METADATA_FIELDS
+
+    return (
+        is_photo,
+        media_metadata_dict["creationTime"],
+        _intern(media_metadata_dict.get("width")),
+        _intern(media_metadata_dict.get("height")),
+        (
+            tuple(
+                _intern(metadata_dict.get(field_name)) for field_name in metadata_fields
+            )
+            if metadata_dict
+            else None
+        ),
+    )
+
+
+def _decode_media_metadata(
+    media_metadata: _EncodedMediaMetadata,
+) -> Union[PhotoMediaMetadata, VideoMediaMetadata]:
+    is_photo, creation_time, width, height, metadata = media_metadata
+
+    if is_photo:
+        return PhotoMediaMetadata(
+            creationTime=creation_time,
+            width=width,
+            height=height,
+            photo=None if metadata is None else PhotoMetadata(*metadata),
+        )
+    return VideoMediaMetadata(
+        creationTime=creation_time,
+        width=width,
+        height=height,
+        video=None if metadata is None else VideoMetadata(*metadata),
+    )
+
+
 class MediaItem:
-    id: str
-    productUrl: str
-    baseUrl: str
-    mimeType: str
-    filename: str
+    """
+    https://developers.google.com/photos/library/reference/rest/v1/mediaItems#MediaItem
+
+    Kept compact since a whole library's worth of MediaItems can be listed ahead of the
+    downloads. Attributes live in `__slots__` rather than a `__dict__`, and `mediaMetadata`
+    is kept as a flat tuple of its values (see `_encode_media_metadata`) that is only
+    decoded into dataclasses when first accessed. What the pipeline needs of it (creation
+    time, photo or video, processing status) is read straight from that tuple
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+
+    __slots__ = (
+        "id",
+        "productUrl",
+        "baseUrl",
+        "mimeType",
+        "filename",
+        "description",
+        "listedAt",
+        "_media_metadata",
+        "_creation_time",
+    )
+
+    _FIELDS = (
+        "id",
+        "productUrl",
+        "baseUrl",
+        "mimeType",
+        "filename",
+        "mediaMetadata",
+        "description",
+        "listedAt",
+    )
+
+    def __init__(
+        self,
+        id: str,  # pylint: disable=redefined-builtin
+        productUrl: str,
+        baseUrl: str,
+        mimeType: str,
+        filename: str,
+        mediaMetadata: Union[MediaMetadata, Dict[str, Any]],
+        description: Optional[str] = None,
+        listedAt: Optional[float] = None,
+    ):
+        self.id = id
+        self.productUrl = productUrl
+        self.baseUrl = baseUrl
+        self.mimeType = sys.intern(mimeType)
+        self.filename = filename
+        self.description = description
+        # When the `baseUrl` was obtained, as a `time.time()` timestamp
+        self.listedAt = time.time() if listedAt is None else listedAt
+
+        self._media_metadata: Union[_EncodedMediaMetadata, MediaMetadata] = (
+            _encode_media_metadata(mediaMetadata)
+            if isinstance(mediaMetadata, dict)
+            else mediaMetadata
+        )
+        self._creation_time: Optional[datetime] = None
+
+    @property
+    def mediaMetadata(self) -> MediaMetadata:
+        if isinstance(self._media_metadata, tuple):
+            self._media_metadata = _decode_media_metadata(self._media_metadata)
+        return self._media_metadata
+
+    @property
+    def _is_photo(self) -> bool:
+        if isinstance(self._media_metadata, tuple):
+            return self._media_metadata[_IS_PHOTO]
+        return isinstance(self._media_metadata, PhotoMediaMetadata)
+
+    def replace(self, **changes) -> "MediaItem":
+        """
+        Returns a copy of the MediaItem with `changes` applied, like `dataclasses.replace`
+        """
+        return MediaItem(
+            **{
+                field_name: changes.get(field_name, getattr(self, field_name))
+                for field_name in self._FIELDS
+            }
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, MediaItem):
+            return NotImplemented
+        return all(
+            getattr(self, field_name) == getattr(other, field_name)
+            for field_name in self._FIELDS
+            if field_name != "listedAt"
+        )
+
+    __hash__ = None  # type: ignore
 
-    mediaMetadata: MediaMetadata
+    def __repr__(self) -> str:
+        return (
+            f"MediaItem(id={self.id!r}, filename={self.filename!r},"
+            f" mimeType={self.mimeType!r})"
+        )
 
-    description: Optional[str] = None
+    def get_base_url_age(self, now: Optional[float] = None) -> float:
+        return (time.time() if now is None else now) - self.listedAt
 
     @property
     def downloadUrl(self) -> str:
         """
         Ref: https://developers.google.com/photos/library/guides/access-media-items
         """
-        if isinstance(self.mediaMetadata, PhotoMediaMetadata):
+        if self._is_photo:
             return self.baseUrl + "=d"
         return self.baseUrl + "=dv"
 
     @property
     def creationTime(self) -> datetime:
-        return datetime.strptime(self.mediaMetadata.creationTime, "%Y-%m-%dT%H:%M:%SZ")
+        # Parsed on first use, as not every listed MediaItem ends up being downloaded
+        if self._creation_time is None:
+            creation_time = (
+                self._media_metadata[_CREATION_TIME]
+                if isinstance(self._media_metadata, tuple)
+                else self._media_metadata.creationTime
+            )
+            self._creation_time = datetime.strptime(creation_time, "%Y-%m-%dT%H:%M:%SZ")
+        return self._creation_time
 
     @property
-    def is_ready(self) -> bool:
-        if isinstance(self.mediaMetadata, VideoMediaMetadata):
-            video_processing_status = self.mediaMetadata.video.status
-            return video_processing_status == VideoProcessingStatus.READY.value
+    def is_video(self) -> bool:
+        return not self._is_photo or self.mimeType.startswith("video/")
 
-        # PhotoMediaMetadata does not have a processing status
-        return True
-
-    def get_raw_data(self, attempt_number: int = 1) -> bytes:
-        if attempt_number > 5:
-            raise RuntimeError(
-                f"Max attempts reached while trying to `get_raw_data` for: {self.filename}"
+    @property
+    def is_ready(self) -> bool:
+        if self._is_photo:
+            # PhotoMediaMetadata does not have a processing status
+            return True
+
+        if isinstance(self._media_metadata, tuple):
+            video_metadata = self._media_metadata[_METADATA]
+            video_processing_status = (
+                None if video_metadata is None else video_metadata[_VIDEO_STATUS]
             )
-
-        _wait_time = attempt_number * 5
+        else:
+            video_processing_status = self._media_metadata.video.status
+        return video_processing_status == VideoProcessingStatus.READY.value
+
+    def _get_response(
+        self,
+        session: Optional[requests.Session] = None,
+        offset: int = 0,
+        retry_policy: Optional[RetryPolicy] = None,
+        end: Optional[int] = None,
+    ) -> requests.Response:
+        retry_policy = RetryPolicy() if retry_policy is None else retry_policy
+
+        request_kwargs: Dict[str, Any] = {
+            "stream": True,
+            "timeout": (
+                DOWNLOAD_CONNECT_TIMEOUT_SECONDS,
+                DOWNLOAD_READ_TIMEOUT_SECONDS,
+            ),
+        }
+        if offset > 0 or end is not None:
+            request_kwargs["headers"] = {
+                "Range": f"bytes={offset}-{'' if end is None else end}"
+            }
 
         try:
-            response: requests.Response = requests.get(self.downloadUrl, stream=True)
-        except requests.ConnectionError:
-            # From time to time I've observed inconsistent ConnectionErrors and I figured
-            # it would be just as easy to retry and hopefully not have to worry about them anymore
-            logger.error(
-                "Failed to fetch data for: %s. Waiting %d"
-                " second(s) and trying again (attempt: %d of 5)",
-                self.filename,
-                _wait_time,
-                attempt_number,
+            response: requests.Response = retry_policy.send(
+                "download",
+                (requests if session is None else session).get,
+                self.downloadUrl,
+                **request_kwargs,
             )
-            time.sleep(_wait_time)
-            return self.get_raw_data(attempt_number=attempt_number + 1)
+        except (requests.ConnectionError, requests.Timeout) as err:
+            raise RuntimeError(
+                f"Max attempts reached while trying to `get_raw_data` for: {self.filename}"
+            ) from err
 
-        response.raise_for_status()
-        return response.raw.data
+        if offset > 0 and response.status_code == RANGE_NOT_SATISFIABLE:
+            # Left for the caller to inspect the `Content-Range` of
+            return response
 
-    def get_download_path(self, base_path: Path) -> Path:
-        _media_item_path_prefix = Path(
-            base_path,
-            str(self.creationTime.year),
-            str(self.creationTime.month),
-            str(self.creationTime.day),
+        response.raise_for_status()
+        return response
+
+    def get_raw_data_response(
+        self,
+        session: Optional[requests.Session] = None,
+        offset: int = 0,
+        retry_policy: Optional[RetryPolicy] = None,
+        end: Optional[int] = None,
+    ) -> requests.Response:
+        """
+        Returns a streamed response for the MediaItem's content. A non-zero `offset` asks
+        for the content starting at that byte via a `Range` request, up to and including
+        the `end` byte if given. Callers must check for a `206 Partial Content` status, as
+        a server is free to ignore the `Range` and reply with the full content
+        """
+        return self._get_response(
+            session=session, offset=offset, retry_policy=retry_policy, end=end
         )
-        _media_item_path_prefix.mkdir(parents=True, exist_ok=True)
-
-        return Path(_media_item_path_prefix, self.filename)
 
+    def get_raw_data(self, session: Optional[requests.Session] = None) -> bytes:
+        """
+        Buffers the entire content of the MediaItem in memory. Prefer `iter_raw_data`
+        for anything that could be large (e.g. videos)
+        """
+        return self._get_response(session=session).raw.data
 
-def _media_metadata_factory(
-    media_item_dict,
-) -> Union[PhotoMediaMetadata, VideoMediaMetadata]:
-    media_metadata_dict = media_item_dict["mediaMetadata"]
-    photo_metadata_dict = media_metadata_dict.get("photo")
-    video_metadata_dict = media_metadata_dict.get("video")
+    def iter_raw_data(
+        self,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        session: Optional[requests.Session] = None,
+    ) -> Iterator[bytes]:
+        """
+        Streams the content of the MediaItem in chunks of up to `chunk_size` bytes.
+        Pass a shared `session` to reuse pooled connections across downloads
+        """
+        with self._get_response(session=session) as response:
+            yield from response.iter_content(chunk_size=chunk_size)
 
-    if photo_metadata_dict is not None:
-        photo_metadata: Optional[PhotoMetadata] = (
-            None if photo_metadata_dict == {} else PhotoMetadata(**photo_metadata_dict)
-        )
-        del media_metadata_dict["photo"]
-        media_metadata = PhotoMediaMetadata(**media_metadata_dict, photo=photo_metadata)
-    else:
-        video_metadata: Optional[VideoMetadata] = (
-            None if video_metadata_dict == {} else VideoMetadata(**video_metadata_dict)
+    def get_relative_download_path(self) -> Path:
+        return Path(
+            str(self.creationTime.year),
+            str(self.creationTime.month),
+            str(self.creationTime.day),
+            self.filename,
         )
-        del media_metadata_dict["video"]
-        media_metadata = VideoMediaMetadata(**media_metadata_dict, video=video_metadata)
 
-    del media_item_dict["mediaMetadata"]
+    def get_download_path(self, base_path: Path) -> Path:
+        media_item_path = Path(base_path, self.get_relative_download_path())
+        media_item_path.parent.mkdir(parents=True, exist_ok=True)
 
-    return media_metadata
+        return media_item_path
 
 
 def create_media_item(media_item_dict: Dict[str, Any]) -> MediaItem:
+    """
+    Only decodes the fields that the pipeline needs up front and ignores any it doesn't
+    know of. Raises a KeyError if a required field is missing
+    """
     return MediaItem(
-        mediaMetadata=_media_metadata_factory(media_item_dict), **media_item_dict
+        id=media_item_dict["id"],
+        productUrl=media_item_dict["productUrl"],
+        baseUrl=media_item_dict["baseUrl"],
+        mimeType=media_item_dict["mimeType"],
+        filename=media_item_dict["filename"],
+        mediaMetadata=media_item_dict["mediaMetadata"],
+        description=media_item_dict.get("description"),
+        listedAt=media_item_dict.get("listedAt"),
     )
@@ -1,42 +1,253 @@
 import concurrent
+import heapq
+import itertools
 import logging
-from concurrent.futures._base import Future
+import time
+from concurrent.futures._base import FIRST_COMPLETED, Future
 from concurrent.futures.thread import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
 from pathlib import Path
-from typing import Iterable, Iterator, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 from google_photos_archiver.archivers import Archivable
+from google_photos_archiver.base_url_refresher import BaseUrlRefresher
+from google_photos_archiver.concurrency import AdaptiveConcurrencyLimiter
+from google_photos_archiver.listing_checkpoint import ListingCheckpoint
 from google_photos_archiver.media_item import MediaItem
+from google_photos_archiver.retry import RetryPolicy
 
 logger = logging.getLogger(__name__)
 
 
+class _RequeuedMediaItems:
+    """
+    Retryable failures waiting for their backoff to elapse, soonest first
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, MediaItem, int]] = []
+        # Breaks ties between MediaItems that are due at the same time
+        self._sequence = itertools.count()
+
+    def __bool__(self) -> bool:
+        return bool(self._heap)
+
+    def push(self, media_item: MediaItem, attempt_number: int, delay: float):
+        heapq.heappush(
+            self._heap,
+            (
+                time.monotonic() + delay,
+                next(self._sequence),
+                media_item,
+                attempt_number,
+            ),
+        )
+
+    def pop_due(self) -> Iterator[Tuple[MediaItem, int]]:
+        """
+        Yields each MediaItem whose backoff has elapsed, along with its attempt number
+        """
+        now = time.monotonic()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, media_item, attempt_number = heapq.heappop(self._heap)
+            yield media_item, attempt_number
+
+    def get_timeout(self) -> Optional[float]:
+        """
+        Returns how many seconds remain until the next MediaItem is due, if any
+        """
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.monotonic())
+
+
 class MediaItemArchiver:
+    # pylint: disable=too-many-arguments
+
     def __init__(
         self,
         archiver: Archivable,
         max_threadpool_workers: int = 25,
+        concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        base_url_refresher: Optional[BaseUrlRefresher] = None,
+        max_video_workers: Optional[int] = None,
+        listing_checkpoint: Optional[ListingCheckpoint] = None,
     ):
+        """
+        :param concurrency_limiter: When provided, the amount of in-flight downloads is
+            adjusted at runtime between its bounds instead of always being
+            `max_threadpool_workers`
+        :param retry_policy: When provided, archivals that fail with a retryable error are
+            requeued after the policy's backoff rather than sleeping in a worker thread
+        :param base_url_refresher: When provided, MediaItems that waited in the queue for
+            long enough for their `baseUrl` to expire get it refreshed before downloading
+        :param max_video_workers: When provided, videos are archived by a separate pool
+            of this many workers, so that a few large videos can't hold up photos
+        :param listing_checkpoint: When provided, MediaItems are taken off of its queue of
+            pending MediaItems once they have been skipped, or archived and recorded
+        """
         self.archiver = archiver
         self.max_threadpool_workers = max_threadpool_workers
+        self.concurrency_limiter = concurrency_limiter
+        self.retry_policy = retry_policy
+        self.base_url_refresher = base_url_refresher
+        self.max_video_workers = max_video_workers
+        self.listing_checkpoint = listing_checkpoint
 
     def start(
         self, media_items: Iterable[MediaItem], album_path: Optional[Path] = None
     ) -> Iterator[Future]:
-        with ThreadPoolExecutor(max_workers=self.max_threadpool_workers) as executor:
+        if self.base_url_refresher is not None:
+            media_items = self.base_url_refresher.track(media_items)
+
+        with ExitStack() as stack:
+            executor = stack.enter_context(
+                ThreadPoolExecutor(max_workers=self.max_threadpool_workers)
+            )
+            video_executor = (
+                executor
+                if self.max_video_workers is None
+                else stack.enter_context(
+                    ThreadPoolExecutor(
+                        max_workers=self.max_video_workers, thread_name_prefix="video"
+                    )
+                )
+            )
+
+            def submit(media_item: MediaItem) -> Future:
+                return (video_executor if media_item.is_video else executor).submit(
+                    self._archive, media_item, album_path
+                )
+
+            if self.retry_policy is None:
+                return concurrent.futures.as_completed(
+                    [submit(media_item) for media_item in media_items]
+                )
+
             return concurrent.futures.as_completed(
-                [
-                    executor.submit(self._archive, media_item, album_path)
-                    for media_item in media_items
-                ]
+                self._archive_with_requeues(submit, media_items)
             )
 
+    def _archive_with_requeues(
+        self,
+        submit: Callable[[MediaItem], Future],
+        media_items: Iterable[MediaItem],
+    ) -> List[Future]:
+        """
+        Submits archivals and waits on them from the calling thread, which also holds on
+        to retryable failures until their backoff elapses. Worker threads are never
+        blocked sleeping between attempts
+        """
+        attempts: Dict[Future, Tuple[MediaItem, int]] = {
+            submit(media_item): (media_item, 1) for media_item in media_items
+        }
+        pending: Set[Future] = set(attempts)
+        requeued = _RequeuedMediaItems()
+        completed: List[Future] = []
+
+        while pending or requeued:
+            for media_item, attempt_number in requeued.pop_due():
+                future = submit(media_item)
+                attempts[future] = (media_item, attempt_number)
+                pending.add(future)
+
+            timeout = requeued.get_timeout()
+            if not pending:
+                time.sleep(timeout)
+                continue
+
+            done, pending = concurrent.futures.wait(
+                pending, timeout=timeout, return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                media_item, attempt_number = attempts.pop(future)
+                delay = self._get_requeue_delay(future, media_item, attempt_number)
+                if delay is None:
+                    completed.append(future)
+                else:
+                    requeued.push(media_item, attempt_number + 1, delay)
+
+        return completed
+
+    def _get_requeue_delay(
+        self, future: Future, media_item: MediaItem, attempt_number: int
+    ) -> Optional[float]:
+        """
+        Returns how many seconds to wait for before requeueing a failed archival, or
+        `None` if it succeeded or isn't to be retried
+        """
+        err = future.exception()
+        if err is None:
+            return None
+
+        delay = self.retry_policy.get_retry_delay_for_error(
+            "archive", err, attempt_number
+        )
+        if delay is not None:
+            logger.warning(
+                "Failed to archive: %s (%s). Requeueing in %.1f second(s)"
+                " (attempt: %d of %d)",
+                media_item.filename,
+                err,
+                delay,
+                attempt_number,
+                self.retry_policy.max_attempts,
+            )
+        return delay
+
     def _archive(
         self, media_item: MediaItem, album_path: Optional[Path] = None
     ) -> bool:
-        if media_item.is_ready:
-            return self.archiver.archive(media_item, album_path)
-        return False
+        if not media_item.is_ready:
+            if self.base_url_refresher is not None:
+                self.base_url_refresher.discard(media_item)
+            # Gets listed again once it's ready, rather than resumed
+            if self.listing_checkpoint is not None:
+                self.listing_checkpoint.remove_pending(media_item)
+            return False
+
+        if self.base_url_refresher is not None:
+            # Recorded MediaItems get skipped, so their `baseUrl` is never used
+            if self.archiver.recorder.lookup(media_item):
+                self.base_url_refresher.discard(media_item)
+            else:
+                self.base_url_refresher.refresh_if_stale(media_item)
+
+        on_recorded = (
+            None
+            if self.listing_checkpoint is None
+            else partial(self.listing_checkpoint.remove_pending, media_item)
+        )
+        if self.concurrency_limiter is None:
+            archived = self.archiver.archive(media_item, album_path, on_recorded)
+        else:
+            archived = self._archive_adaptively(media_item, album_path, on_recorded)
+
+        # Archived MediaItems are only taken off of the queue once they're recorded
+        if not archived and self.listing_checkpoint is not None:
+            self.listing_checkpoint.remove_pending(media_item)
+        return archived
+
+    def _archive_adaptively(
+        self,
+        media_item: MediaItem,
+        album_path: Optional[Path] = None,
+        on_recorded: Optional[Callable[[], None]] = None,
+    ) -> bool:
+        # Throttling is reported to the limiter through `RetryPolicy.on_throttled`
+        with self.concurrency_limiter.slot():
+            try:
+                archived = self.archiver.archive(media_item, album_path, on_recorded)
+            except Exception:
+                self.concurrency_limiter.record_error()
+                raise
+
+        # Skipped MediaItems say nothing about how well downloads are doing
+        if archived:
+            self.concurrency_limiter.record_success()
+        return archived
 
 
 def get_new_media_item_archivals(
@@ -1,36 +1,383 @@
+import atexit
+import logging
 import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import Any, Callable, List, Optional, Set, Tuple
 
 from google_photos_archiver.media_item import MediaItem
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL_SECONDS = 1.0
+DEFAULT_FLUSH_SIZE = 500
+
+# How long a connection waits on a lock held by another one before giving up
+_BUSY_TIMEOUT_SECONDS = 30.0
+
+_ARCHIVED_AT_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# Every column besides `media_item_id`. A db created before these were added only has
+# `media_item_id`, and gets the rest added (empty for the MediaItems it already recorded)
+_CATALOG_COLUMNS = (
+    ("filename", "varchar"),
+    ("relative_path", "varchar"),
+    ("mime_type", "varchar"),
+    ("creation_time", "varchar"),
+    ("width", "integer"),
+    ("height", "integer"),
+    ("camera_make", "varchar"),
+    ("camera_model", "varchar"),
+    ("size", "integer"),
+    ("sha256", "varchar"),
+    ("archived_at", "varchar"),
+)
+_INDEXED_COLUMNS = ("relative_path", "mime_type", "creation_time", "sha256")
+_COLUMN_NAMES = ", ".join(
+    ["media_item_id"] + [column_name for column_name, _ in _CATALOG_COLUMNS]
+)
+_PLACEHOLDERS = ", ".join("?" * (len(_CATALOG_COLUMNS) + 1))
+
+# A row waiting to be committed, along with what to call once it has been
+_QueuedRow = Tuple[Tuple[Any, ...], Optional[Callable[[], None]]]
+
+
+@dataclass
+class RecordedMediaItem:
+    # pylint: disable=too-many-instance-attributes
+
+    id: str
+    filename: Optional[str]
+    # Relative to the download path
+    relative_path: Optional[Path]
+    mime_type: Optional[str]
+    creation_time: Optional[str]
+    width: Optional[int]
+    height: Optional[int]
+    camera_make: Optional[str]
+    camera_model: Optional[str]
+    size: Optional[int]
+    sha256: Optional[str]
+    archived_at: Optional[str]
+
+
+@dataclass
+class RecordedStats:
+    media_items: int
+    size: int
+
+
+def _to_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _get_row(
+    media_item: MediaItem, size: Optional[int], sha256: Optional[str]
+) -> Tuple[Any, ...]:
+    media_metadata = media_item.mediaMetadata
+    metadata = getattr(media_metadata, "photo", None) or getattr(
+        media_metadata, "video", None
+    )
+
+    return (
+        media_item.id,
+        media_item.filename,
+        str(media_item.get_relative_download_path()),
+        media_item.mimeType,
+        media_metadata.creationTime,
+        _to_int(media_metadata.width),
+        _to_int(media_metadata.height),
+        getattr(metadata, "cameraMake", None),
+        getattr(metadata, "cameraModel", None),
+        size,
+        sha256,
+        datetime.now(timezone.utc).strftime(_ARCHIVED_AT_FORMAT),
+    )
+
 
 class MediaItemRecorder:
     """
-    Persists MediaItem ids to a sqlite db
+    Persists a catalog of archived MediaItems to a sqlite db: one row per MediaItem with
+    where it was archived to, its metadata, size and checksum, so that questions about the
+    archive can be answered without walking the filesystem or calling the API
+
+    Every recorded id is loaded into memory up front, so that `lookup` never has to hit
+    the db. The db is put into WAL mode, and each thread reuses one connection of its
+    own. Added ids are handed off to a background writer that commits them in batches,
+    every `flush_interval` seconds or once `flush_size` of them are queued up, whichever
+    comes first. MediaItems that are queued up are already visible to `lookup`, while
+    `flush` blocks until they're committed. A crash loses at most the last batch, whose
+    MediaItems get downloaded again. Exiting without calling `close` loses nothing, as
+    the writer is closed on exit too
     """
 
-    def __init__(self, sqlite_db_path: Path):
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+        self,
+        sqlite_db_path: Path,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL_SECONDS,
+        flush_size: int = DEFAULT_FLUSH_SIZE,
+    ):
         self.sqlite_db_path = sqlite_db_path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+        self._condition = threading.Condition()
+        self._queued: List[_QueuedRow] = []
+        self._enqueued = 0
+        self._committed = 0
+        self._flush_waiters = 0
+        self._stopping = False
+        self._writer: Optional[threading.Thread] = None
+        self._error: Optional[Exception] = None
 
         with self.connection as _connection:
+            _connection.execute("PRAGMA journal_mode=WAL")
             _connection.execute(
                 """CREATE TABLE IF NOT EXISTS media_items (media_item_id varchar unique primary key)"""
             )
+            self._migrate(_connection)
+            self._known_ids: Set[str] = {
+                media_item_id
+                for (media_item_id,) in _connection.execute(
+                    "SELECT media_item_id FROM media_items"
+                )
+            }
+        logger.debug("Loaded %d recorded MediaItem id(s)", len(self._known_ids))
 
     @property
     def connection(self) -> sqlite3.Connection:
-        return sqlite3.connect(self.sqlite_db_path)
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Only ever used by the thread that opened it, but closed by `close`
+            connection = sqlite3.connect(
+                self.sqlite_db_path,
+                timeout=_BUSY_TIMEOUT_SECONDS,
+                check_same_thread=False,
+            )
+            # Durable enough in WAL mode, as commits are only fsynced at checkpoints
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
 
-    def add(self, media_item: MediaItem):
-        with self.connection as _connection:
-            _connection.execute(
-                "INSERT INTO media_items(media_item_id) values (?)", (media_item.id,)
+    def _migrate(self, connection: sqlite3.Connection):
+        columns = {
+            column_name
+            for _, column_name, *_ in connection.execute(
+                "PRAGMA table_info(media_items)"
+            )
+        }
+        missing_columns = [
+            (column_name, column_type)
+            for column_name, column_type in _CATALOG_COLUMNS
+            if column_name not in columns
+        ]
+        for column_name, column_type in missing_columns:
+            connection.execute(
+                f"ALTER TABLE media_items ADD COLUMN {column_name} {column_type}"
+            )
+        if missing_columns:
+            logger.info(
+                "Added %d column(s) to the media_items table of: %s",
+                len(missing_columns),
+                self.sqlite_db_path,
             )
 
+        for column_name in _INDEXED_COLUMNS:
+            connection.execute(
+                f"CREATE INDEX IF NOT EXISTS media_items_{column_name}"
+                f" ON media_items({column_name})"
+            )
+
+    def add(
+        self,
+        media_item: MediaItem,
+        size: Optional[int] = None,
+        sha256: Optional[str] = None,
+        on_recorded: Optional[Callable[[], None]] = None,
+    ):
+        """
+        :param size: The size of the archived file in bytes
+        :param sha256: The hex digest of the archived file's SHA-256 checksum
+        :param on_recorded: Called by the background writer once the MediaItem has been
+            committed. Never called if committing it fails
+        """
+        row = _get_row(media_item, size, sha256)
+        with self._condition:
+            self._raise_error()
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write, name="media-item-recorder", daemon=True
+                )
+                self._writer.start()
+                # The writer is a daemon, so that it can't keep the interpreter alive
+                atexit.register(self.close)
+
+            self._queued.append((row, on_recorded))
+            self._known_ids.add(media_item.id)
+            self._enqueued += 1
+            if len(self._queued) >= self.flush_size:
+                self._condition.notify_all()
+
     def lookup(self, media_item: MediaItem) -> bool:
+        # Set membership tests are atomic, so this doesn't have to wait on `add`
+        return media_item.id in self._known_ids
+
+    def get(self, media_item_id: str) -> Optional[RecordedMediaItem]:
+        """
+        Flushes first, so that MediaItems that are queued up are included
+        """
+        self.flush()
+        with self.connection as _connection:
+            row = _connection.execute(
+                f"SELECT {_COLUMN_NAMES} FROM media_items WHERE media_item_id = ?",
+                (media_item_id,),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        recorded_media_item = RecordedMediaItem(*row)
+        if recorded_media_item.relative_path is not None:
+            recorded_media_item.relative_path = Path(recorded_media_item.relative_path)
+        return recorded_media_item
+
+    def get_media_item_ids(self, sha256: str) -> List[str]:
+        """
+        Returns the ids of every MediaItem whose content has the checksum `sha256`, e.g.
+        the MediaItems that share a blob of a content addressed archive. Flushes first,
+        so that MediaItems that are queued up are included
+        """
+        self.flush()
+        with self.connection as _connection:
+            return [
+                media_item_id
+                for (media_item_id,) in _connection.execute(
+                    "SELECT media_item_id FROM media_items WHERE sha256 = ?"
+                    " ORDER BY media_item_id",
+                    (sha256,),
+                )
+            ]
+
+    def get_stats(self) -> RecordedStats:
+        """
+        Flushes first, so that MediaItems that are queued up are included. MediaItems
+        recorded before sizes were are counted, but don't add to `size`
+        """
+        self.flush()
         with self.connection as _connection:
-            media_item = _connection.execute(
-                "SELECT * FROM media_items WHERE media_item_id = '%s'" % media_item.id
+            media_items, size = _connection.execute(
+                "SELECT COUNT(*), TOTAL(size) FROM media_items"
             ).fetchone()
+        return RecordedStats(media_items=media_items, size=int(size))
+
+    def flush(self):
+        """
+        Blocks until every MediaItem added so far has been committed
+        """
+        with self._condition:
+            target = self._enqueued
+            self._flush_waiters += 1
+            self._condition.notify_all()
+            try:
+                self._condition.wait_for(lambda: self._committed >= target)
+            finally:
+                self._flush_waiters -= 1
+            self._raise_error()
+
+    def close(self):
+        """
+        Flushes, stops the background writer and closes every connection. The recorder
+        can still be used afterwards, reopening connections as needed
+        """
+        with self._condition:
+            writer = self._writer
+            self._stopping = True
+            self._condition.notify_all()
+            if writer is not None:
+                atexit.unregister(self.close)
+
+        if writer is not None:
+            writer.join()
+
+        with self._condition:
+            self._writer = None
+            self._stopping = False
+
+        with self._connections_lock:
+            connections = self._connections
+            self._connections = []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+        with self._condition:
+            self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _should_write(self) -> bool:
+        return (
+            self._stopping
+            or len(self._queued) >= self.flush_size
+            or (self._flush_waiters > 0 and bool(self._queued))
+        )
+
+    @staticmethod
+    def _call_on_recorded(batch: List[_QueuedRow]):
+        for _, on_recorded in batch:
+            if on_recorded is None:
+                continue
+            try:
+                on_recorded()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to report a recorded MediaItem")
+
+    def _write(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    self._should_write, timeout=self.flush_interval
+                )
+                batch = self._queued
+                self._queued = []
+                stopping = self._stopping
+
+            if batch:
+                try:
+                    with self.connection as _connection:
+                        _connection.executemany(
+                            f"INSERT OR REPLACE INTO media_items({_COLUMN_NAMES})"
+                            f" VALUES ({_PLACEHOLDERS})",
+                            [row for row, _ in batch],
+                        )
+                    logger.debug("Recorded %d MediaItem(s)", len(batch))
+                except sqlite3.Error as err:
+                    logger.exception("Failed to record %d MediaItem(s)", len(batch))
+                    with self._condition:
+                        self._error = err
+                else:
+                    self._call_on_recorded(batch)
+
+            with self._condition:
+                self._committed += len(batch)
+                self._condition.notify_all()
 
-        return media_item is not None
+            if stopping:
+                return
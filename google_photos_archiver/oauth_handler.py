@@ -1,32 +1,130 @@
+import logging
+import threading
+import time
+from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional
 
 import requests
 from google.oauth2.credentials import Credentials as GoogleOauthCredentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 
+from google_photos_archiver.retry import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+# Refresh access tokens this long before they expire, so that requests that are
+# already underway don't get rejected
+DEFAULT_TOKEN_REFRESH_MARGIN_SECONDS = 5 * 60
+
 
 class GoogleOauthHandler:
     """
-    Gets a fresh token or refreshes an already existing token using Google's oauthlib's InstalledAppFlow
+    Gets a fresh token or refreshes an already existing token using Google's oauthlib's InstalledAppFlow.
+    Access tokens only last for about an hour, so `token` is refreshed shortly before it
+    expires. It's safe to use from many threads at once: a single thread refreshes the
+    token while the others keep using the current one for as long as it's valid
 
     Ref: https://googleapis.github.io/google-api-python-client/docs/oauth-installed.html
     """
 
-    def __init__(self, client_secret_file_path: Path, refresh_token_path: Path):
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+
+    def __init__(
+        self,
+        client_secret_file_path: Path,
+        refresh_token_path: Path,
+        *,
+        refresh_margin_seconds: float = DEFAULT_TOKEN_REFRESH_MARGIN_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+        session: Optional[requests.Session] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+    ):
+        """
+        :param session: Pass the session shared with the REST client to refresh tokens
+            over its pooled connections
+        :param retry_policy: Pass the policy shared with the REST client, so that token
+            refreshes are counted (and throttled) along with every other request
+        """
         self._authorization_url = "https://www.googleapis.com/oauth2/v4/token"
         self._client_secret_file_path = client_secret_file_path
         self._refresh_token_path = refresh_token_path
         self._flow: InstalledAppFlow = self._get_flow()
         self._client_config: Dict[str, Any] = self._flow.client_config
 
-        refresh_token = self.read_refresh_token()
-        if refresh_token:
-            self.token = self.refresh_existing_token(refresh_token).json()[
-                "access_token"
-            ]
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.session = session
+        self.retry_policy: RetryPolicy = (
+            RetryPolicy() if retry_policy is None else retry_policy
+        )
+        self._clock = clock
+        self._refresh_lock = threading.Lock()
+        self._token: Optional[str] = None
+        # When `_token` expires according to `_clock`, `None` if unknown
+        self._expires_at: Optional[float] = None
+
+        self._refresh_token = self.read_refresh_token()
+        if self._refresh_token:
+            self._refresh_access_token()
         else:
-            self.token = self._get_token()
+            self._get_token()
+
+    @property
+    def token(self) -> str:
+        if not self._needs_refresh():
+            return self._token
+
+        # Only one thread refreshes. As long as the token is still valid, the others
+        # carry on using it instead of waiting for the refresh
+        # pylint: disable=consider-using-with
+        if not self._refresh_lock.acquire(blocking=self._is_expired()):
+            return self._token
+
+        try:
+            if self._needs_refresh():
+                self._refresh_access_token()
+        finally:
+            self._refresh_lock.release()
+
+        return self._token
+
+    def refresh_access_token(self, rejected_token: Optional[str] = None) -> str:
+        """
+        Refreshes the access token, e.g. after the API responded with a 401. Callers that
+        pass along the `rejected_token` they used only trigger a refresh if nobody else
+        already replaced that token, so many concurrent 401s lead to a single refresh
+        """
+        with self._refresh_lock:
+            if rejected_token is None or rejected_token == self._token:
+                self._refresh_access_token()
+            return self._token
+
+    def _needs_refresh(self) -> bool:
+        return (
+            self._expires_at is not None
+            and self._clock() >= self._expires_at - self.refresh_margin_seconds
+        )
+
+    def _is_expired(self) -> bool:
+        return self._expires_at is not None and self._clock() >= self._expires_at
+
+    def _set_token(self, token: str, expires_in: Optional[float]):
+        self._token = token
+        self._expires_at = None if expires_in is None else self._clock() + expires_in
+
+    def _refresh_access_token(self):
+        if not self._refresh_token:
+            logger.warning("No refresh token available. Unable to refresh access token")
+            return
+
+        logger.info("Refreshing access token")
+        refresh_token_response_json = self.refresh_existing_token(
+            self._refresh_token
+        ).json()
+        self._set_token(
+            refresh_token_response_json["access_token"],
+            refresh_token_response_json.get("expires_in"),
+        )
 
     def _get_token(self):
         credentials: GoogleOauthCredentials = self._flow.run_local_server(
@@ -37,6 +135,14 @@ class GoogleOauthHandler:
             open_browser=True,
         )
         self._write_refresh_token(credentials)
+        self._refresh_token = credentials.refresh_token
+
+        # `Credentials.expiry` is a naive UTC datetime
+        expiry: Optional[datetime] = getattr(credentials, "expiry", None)
+        self._set_token(
+            credentials.token,
+            None if expiry is None else (expiry - datetime.utcnow()).total_seconds(),
+        )
         return credentials.token
 
     def _get_flow(self) -> InstalledAppFlow:
@@ -64,7 +170,12 @@ class GoogleOauthHandler:
             "refresh_token": refresh_token,
         }
 
-        refresh_token_response = requests.post(self._authorization_url, data=params)
+        refresh_token_response = self.retry_policy.send(
+            "refresh_existing_token",
+            (requests if self.session is None else self.session).post,
+            self._authorization_url,
+            data=params,
+        )
         refresh_token_response.raise_for_status()
 
         return refresh_token_response
@@ -0,0 +1,286 @@
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from datetime import time as time_of_day
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that refills at `rate` tokens per second, up to `capacity`.
+    Callers reserve tokens up front and may drive the bucket into debt, which makes
+    concurrent callers queue up behind each other rather than race for refills
+
+    Ref: https://en.wikipedia.org/wiki/Token_bucket
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if rate <= 0:
+            raise ValueError(f"TokenBucket rate must be positive. Got: {rate}")
+
+        self.rate = rate
+        # Allow bursting up to one second's worth of tokens by default
+        self._fixed_capacity = capacity
+        self.capacity = max(1.0, rate) if capacity is None else capacity
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._last_refill = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._last_refill) * self.rate
+        )
+        self._last_refill = now
+
+    def set_rate(self, rate: float):
+        """
+        Tokens accrued so far are kept (up to the new capacity), while any debt is paid off
+        at the new rate from now on
+        """
+        if rate <= 0:
+            raise ValueError(f"TokenBucket rate must be positive. Got: {rate}")
+
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            if self._fixed_capacity is None:
+                self.capacity = max(1.0, rate)
+            self._tokens = min(self.capacity, self._tokens)
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """
+        Takes `tokens` from the bucket and returns how many seconds the caller has to
+        wait for before the reservation is covered
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """
+        Blocks until `tokens` are available. Returns the amount of seconds waited
+        """
+        wait_time = self.reserve(tokens)
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return wait_time
+
+
+_BYTE_RATE_REGEX = re.compile(
+    r"^(?P<amount>\d+(?:\.\d+)?)\s*(?P<unit>[kmg]i?)?b?$", re.IGNORECASE
+)
+_BYTE_RATE_UNITS = {
+    "k": 1000,
+    "m": 1000**2,
+    "g": 1000**3,
+    "ki": 1024,
+    "mi": 1024**2,
+    "gi": 1024**3,
+}
+UNLIMITED = "unlimited"
+
+
+def parse_byte_rate(byte_rate: str) -> Optional[float]:
+    """
+    Parses a bytes per second rate like `500K`, `5MB` or `1.5GiB`. Returns `None` for
+    `unlimited`
+    """
+    byte_rate = byte_rate.strip()
+    if byte_rate.lower() == UNLIMITED:
+        return None
+
+    match = _BYTE_RATE_REGEX.match(byte_rate)
+    if match is None or float(match.group("amount")) <= 0:
+        raise ValueError(f"Invalid byte rate: {byte_rate}")
+
+    unit = match.group("unit")
+    return float(match.group("amount")) * (
+        1 if unit is None else _BYTE_RATE_UNITS[unit.lower()]
+    )
+
+
+@dataclass
+class BandwidthWindow:
+    start: time_of_day
+    end: time_of_day
+    # Bytes per second, `None` meaning unlimited
+    rate: Optional[float]
+
+    def __contains__(self, now: time_of_day) -> bool:
+        if self.start <= self.end:
+            return self.start <= now < self.end
+        # The window wraps around midnight, e.g. 22:00-02:00
+        return now >= self.start or now < self.end
+
+
+class BandwidthSchedule:
+    """
+    Time-of-day windows with their own download rate limit, e.g. to only download at full
+    speed at night. Outside of any window the `default_rate` applies
+    """
+
+    def __init__(
+        self, windows: List[BandwidthWindow], default_rate: Optional[float] = None
+    ):
+        self.windows = windows
+        self.default_rate = default_rate
+
+    @classmethod
+    def from_string(
+        cls, schedule: str, default_rate: Optional[float] = None
+    ) -> "BandwidthSchedule":
+        """
+        Parses comma delimited `HH:MM-HH:MM=<rate>` windows, e.g.
+        `01:00-06:00=unlimited,18:00-23:00=1MB`
+        """
+        windows = []
+        for window in schedule.split(","):
+            try:
+                time_range, rate = window.split("=")
+                start, end = time_range.split("-")
+                windows.append(
+                    BandwidthWindow(
+                        start=time_of_day.fromisoformat(start.strip()),
+                        end=time_of_day.fromisoformat(end.strip()),
+                        rate=parse_byte_rate(rate),
+                    )
+                )
+            except ValueError as err:
+                raise ValueError(
+                    f"Invalid bandwidth schedule window: `{window}`."
+                    " Expected: HH:MM-HH:MM=<rate>"
+                ) from err
+
+        return cls(windows, default_rate=default_rate)
+
+    def get_rate(self, now: time_of_day) -> Optional[float]:
+        for window in self.windows:
+            if now in window:
+                return window.rate
+        return self.default_rate
+
+
+class ApiRequestBudgetExhausted(RuntimeError):
+    pass
+
+
+class RateLimiter:
+    """
+    Rate limits shared by every Google Photos API call and MediaItem download so that
+    large archivals can run at the highest rate that stays within the API's quotas.
+    API requests (listing, searching, ...) and downloaded media bytes are limited by
+    separate buckets. A limit of `None` leaves the respective bucket unlimited. A
+    `media_bytes_schedule` varies the media bytes limit with the time of day
+
+    Unlike the per-minute limit, which only slows API requests down, the daily budget
+    `api_requests_per_day` can't be waited out within a run: once it's used up, API
+    requests raise `ApiRequestBudgetExhausted` until the (local) day is over
+
+    Ref: https://developers.google.com/photos/library/guides/api-limits-quotas
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+        self,
+        api_requests_per_minute: Optional[float] = None,
+        api_requests_per_day: Optional[int] = None,
+        media_bytes_per_second: Optional[float] = None,
+        media_bytes_schedule: Optional[BandwidthSchedule] = None,
+        now: Callable[[], datetime] = datetime.now,
+    ):
+        self.api_requests_per_minute = api_requests_per_minute
+        self.api_requests_per_day = api_requests_per_day
+        self.media_bytes_per_second = media_bytes_per_second
+        self.media_bytes_schedule = media_bytes_schedule
+
+        self._now = now
+        self._media_bytes_lock = threading.Lock()
+        self._api_requests_today_lock = threading.Lock()
+        self._api_requests_today = 0
+        self._today = now().date()
+
+        self._api_requests: Optional[TokenBucket] = (
+            None
+            if api_requests_per_minute is None
+            else TokenBucket(rate=api_requests_per_minute / 60)
+        )
+        self._media_bytes: Optional[TokenBucket] = (
+            None
+            if media_bytes_per_second is None
+            else TokenBucket(rate=media_bytes_per_second)
+        )
+
+    def _spend_api_request_budget(self):
+        today = self._now().date()
+        with self._api_requests_today_lock:
+            if today != self._today:
+                self._today = today
+                self._api_requests_today = 0
+
+            if self._api_requests_today >= self.api_requests_per_day:
+                raise ApiRequestBudgetExhausted(
+                    f"Used up the daily budget of {self.api_requests_per_day} API"
+                    " request(s). Run again tomorrow to pick up where this run left off"
+                )
+            self._api_requests_today += 1
+
+    def acquire_api_request(self) -> float:
+        if self.api_requests_per_day is not None:
+            self._spend_api_request_budget()
+
+        if self._api_requests is None:
+            return 0.0
+
+        wait_time = self._api_requests.acquire()
+        if wait_time > 0:
+            logger.debug("Rate limited API request for %.2fs", wait_time)
+        return wait_time
+
+    def _get_media_bytes_bucket(self) -> Optional[TokenBucket]:
+        if self.media_bytes_schedule is None:
+            return self._media_bytes
+
+        rate = self.media_bytes_schedule.get_rate(self._now().time())
+        with self._media_bytes_lock:
+            if rate is None:
+                self._media_bytes = None
+            elif self._media_bytes is None:
+                logger.info("Limiting downloads to %.0f bytes/s", rate)
+                self._media_bytes = TokenBucket(rate=rate)
+            elif self._media_bytes.rate != rate:
+                logger.info("Limiting downloads to %.0f bytes/s", rate)
+                self._media_bytes.set_rate(rate)
+            return self._media_bytes
+
+    def reserve_media_bytes(self, num_bytes: int) -> float:
+        """
+        Non-blocking variant of `acquire_media_bytes` for callers that can't sleep
+        (e.g. coroutines), returns the amount of seconds to wait for
+        """
+        media_bytes = self._get_media_bytes_bucket()
+        if media_bytes is None:
+            return 0.0
+        return media_bytes.reserve(num_bytes)
+
+    def acquire_media_bytes(self, num_bytes: int) -> float:
+        media_bytes = self._get_media_bytes_bucket()
+        if media_bytes is None:
+            return 0.0
+        return media_bytes.acquire(num_bytes)
@@ -1,35 +1,65 @@
+import functools
+import json
 import logging
 from enum import Enum
-from typing import Any, Callable, Dict, Generator, List, Optional, Union
+from typing import Any, Callable, Dict, Generator, Iterator, List, Optional, Set, Union
 from urllib.parse import urljoin
 
 import requests
 from requests import Response
 
 from google_photos_archiver.album import Album, create_album
-from google_photos_archiver.filters import Filter
+from google_photos_archiver.concurrency import merge_concurrently, prefetch
+from google_photos_archiver.filters import (
+    Date,
+    DateFilter,
+    DateRange,
+    Filter,
+    IncludeArchivedMediaFilter,
+    chunk_date_filter,
+)
+from google_photos_archiver.http_session import GOOGLE_PHOTOS_API_URL, PooledSession
+from google_photos_archiver.listing_checkpoint import ListingCheckpoint
 from google_photos_archiver.media_item import MediaItem, create_media_item
 from google_photos_archiver.oauth_handler import GoogleOauthHandler
+from google_photos_archiver.rate_limiter import RateLimiter
+from google_photos_archiver.retry import RetryPolicy
 
 logger = logging.getLogger(__name__)
 
+# Ref: https://developers.google.com/photos/library/reference/rest/v1/mediaItems/batchGet
+BATCH_GET_MAX_MEDIA_ITEMS = 50
+
+UNAUTHORIZED = 401
+
+# The largest page sizes that the API allows for
+# Ref: https://developers.google.com/photos/library/reference/rest/v1/mediaItems/list
+MEDIA_ITEMS_MAX_PAGE_SIZE = 100
+ALBUMS_MAX_PAGE_SIZE = 50
+
+DEFAULT_PREFETCH_PAGES = 2
+DEFAULT_DATE_SEARCH_WORKERS = 4
+
 
 def handle_request_errors(decorated_function: Callable):
     """
     Decorator that handles for potential requests library errors that may occur when calling the wrapped function
     """
 
+    @functools.wraps(decorated_function)
     def wrapper(self, *args, **kwargs):
         try:
             return decorated_function(self, *args, **kwargs)
         except requests.RequestException as err:
             error_message = None
 
-            error_response_json = err.response.json()
-            error_content = error_response_json.get("error")
+            # Connection errors and the like don't come with a response
+            if err.response is not None:
+                error_response_json = err.response.json()
+                error_content = error_response_json.get("error")
 
-            if error_content is not None:
-                error_message = error_content.get("message")
+                if error_content is not None:
+                    error_message = error_content.get("message")
 
             raise GooglePhotosApiRestClientError(
                 f"Failed to execute: `{decorated_function.__name__}` {err}" + ""
@@ -42,34 +72,38 @@ def handle_request_errors(decorated_function: Callable):
 
 def for_all_methods(decorator):
     """
+    Decorates all public methods, so that errors are reported by the method that was
+    called rather than whichever private helper raised them
+
     Ref: https://stackoverflow.com/a/6307868
     """
 
     def decorate(cls):
         for attr in cls.__dict__:
-            if callable(getattr(cls, attr)):
+            if not attr.startswith("_") and callable(getattr(cls, attr)):
                 setattr(cls, attr, decorator(getattr(cls, attr)))
         return cls
 
     return decorate
 
 
-class GooglePhotosApiRestClientError(RuntimeError):
-    pass
+def get_listing_scope(operation: Callable, **kwargs) -> str:
+    """
+    Identifies a paginated listing by the operation and arguments that it's made with
+    """
+    return json.dumps(
+        {"operation": operation.__name__, **kwargs},
+        sort_keys=True,
+        default=lambda f: f.get_filter(),
+    )
 
 
-def create_album_or_media_item(
-    album_or_media_item: Dict[str, Any]
-) -> Union[Album, MediaItem]:
-    try:
-        return create_media_item(album_or_media_item)
-    except (KeyError, TypeError):
-        try:
-            return create_album(album_or_media_item)
-        except Exception as err:
-            raise GooglePhotosApiRestClientError(
-                f"Unable to `create_album_or_media_item` from {album_or_media_item}"
-            ) from err
+def get_auth_header(token: str) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {token}"}
+
+
+class GooglePhotosApiRestClientError(RuntimeError):
+    pass
 
 
 class PaginationResponseKey(Enum):
@@ -77,6 +111,29 @@ class PaginationResponseKey(Enum):
     MediaItems = "mediaItems"
 
 
+_PAGINATED_DECODERS: Dict[
+    PaginationResponseKey, Callable[[Dict[str, Any]], Union[Album, MediaItem]]
+] = {
+    PaginationResponseKey.Albums: create_album,
+    PaginationResponseKey.MediaItems: create_media_item,
+}
+
+
+def create_album_or_media_item(
+    album_or_media_item: Dict[str, Any], response_key: PaginationResponseKey
+) -> Union[Album, MediaItem]:
+    """
+    A page only ever holds what its `response_key` says, so it alone decides whether
+    an Album or a MediaItem gets created
+    """
+    try:
+        return _PAGINATED_DECODERS[response_key](album_or_media_item)
+    except (KeyError, TypeError) as err:
+        raise GooglePhotosApiRestClientError(
+            f"Unable to `create_album_or_media_item` from {album_or_media_item}"
+        ) from err
+
+
 @for_all_methods(handle_request_errors)
 class GooglePhotosApiRestClient:
     """
@@ -84,27 +141,121 @@ class GooglePhotosApiRestClient:
     Refer to: https://developers.google.com/photos/library/guides/get-started
     """
 
+    # pylint: disable=too-many-arguments
+
     def __init__(
         self,
         oauth_handler: GoogleOauthHandler,
-        api_url: str = "https://photoslibrary.googleapis.com/v1/",
+        api_url: str = GOOGLE_PHOTOS_API_URL,
+        session: Optional[PooledSession] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        prefetch_pages: int = DEFAULT_PREFETCH_PAGES,
+        listing_checkpoint: Optional[ListingCheckpoint] = None,
     ):
+        """
+        :param prefetch_pages: How many pages ahead of its consumer a paginated listing
+            is fetched in the background. `0` fetches each page only once it's needed
+        :param listing_checkpoint: When provided, paginated MediaItem listings persist
+            their progress and resume from it if they were interrupted
+        """
         self.oauth_handler = oauth_handler
+        self.prefetch_pages = prefetch_pages
+        self.listing_checkpoint = listing_checkpoint
+        self.rate_limiter: RateLimiter = (
+            RateLimiter() if rate_limiter is None else rate_limiter
+        )
+        self.retry_policy: RetryPolicy = (
+            RetryPolicy() if retry_policy is None else retry_policy
+        )
 
         self.api_url = api_url
-        self._auth_header: Dict[str, str] = {
-            "Authorization": f"Bearer {self.oauth_handler.token}"
-        }
+        self.session: PooledSession = (
+            PooledSession(api_url=api_url) if session is None else session
+        )
+
+    def _send(
+        self, call_name: str, send: Callable[..., Response], url: str, **kwargs
+    ) -> Response:
+        """
+        Sends an authorized, rate limited and retried request. A request that is rejected
+        with a 401 (e.g. because its access token got revoked or expired underway) is
+        sent once more with a refreshed access token
+        """
+        token = self.oauth_handler.token
+        response = self._send_with_token(call_name, send, url, token, **kwargs)
+
+        if response.status_code == UNAUTHORIZED:
+            logger.warning("`%s` was unauthorized. Refreshing access token", call_name)
+            response.close()
+            token = self.oauth_handler.refresh_access_token(rejected_token=token)
+            response = self._send_with_token(call_name, send, url, token, **kwargs)
+
+        return response
+
+    def _send_with_token(
+        self,
+        call_name: str,
+        send: Callable[..., Response],
+        url: str,
+        token: str,
+        **kwargs,
+    ) -> Response:
+        def send_rate_limited(*args, **send_kwargs) -> Response:
+            # Retries count against the quota just as much as first attempts
+            self.rate_limiter.acquire_api_request()
+            return send(*args, **send_kwargs)
+
+        return self.retry_policy.send(
+            call_name, send_rate_limited, url, headers=get_auth_header(token), **kwargs
+        )
 
     def _paginate(
         self,
         operation: Callable,
         response_key: PaginationResponseKey,
-        page_size: int = 100,
+        page_size: int = MEDIA_ITEMS_MAX_PAGE_SIZE,
         **kwargs,
     ) -> Generator[Union[Album, MediaItem], None, None]:
+        pages = self._get_pages(operation, response_key, page_size, **kwargs)
+        if self.prefetch_pages > 0:
+            # Keeps fetching pages while the caller is busy with the current one
+            pages = prefetch(
+                pages, self.prefetch_pages, name=f"prefetch-{response_key.value}"
+            )
+
+        for page in pages:
+            for album_or_media_item in page:
+                yield create_album_or_media_item(album_or_media_item, response_key)
+
+    def _get_pages(
+        self,
+        operation: Callable,
+        response_key: PaginationResponseKey,
+        page_size: int,
+        **kwargs,
+    ) -> Iterator[List[Dict[str, Any]]]:
+        # Albums are few and aren't downloaded, so only MediaItem listings are resumable
+        listing_checkpoint = (
+            self.listing_checkpoint
+            if response_key == PaginationResponseKey.MediaItems
+            else None
+        )
+        scope = get_listing_scope(operation, **kwargs)
         next_page_token = ""
 
+        if listing_checkpoint is not None:
+            resumed_page_token, pending_media_items = listing_checkpoint.resume(scope)
+            # A completed listing that left MediaItems pending only has those to resume
+            if resumed_page_token is not None or pending_media_items:
+                logger.info(
+                    "Resuming listing of %s with %d pending MediaItem(s)",
+                    scope,
+                    len(pending_media_items),
+                )
+                next_page_token = resumed_page_token
+                yield pending_media_items
+
         while next_page_token is not None:
             response: Response = operation(
                 page_size=page_size,
@@ -113,12 +264,15 @@ class GooglePhotosApiRestClient:
             )
             response_data = response.json()
             next_page_token = response_data.get("nextPageToken")
+            page = response_data.get(response_key.value, [])
 
-            for album_or_media_item in response_data.get(response_key.value, []):
-                yield create_album_or_media_item(album_or_media_item)
+            if listing_checkpoint is not None:
+                listing_checkpoint.record_page(scope, page, next_page_token)
+
+            yield page
 
     def get_albums(
-        self, page_size: int = 50, page_token: Optional[str] = None
+        self, page_size: int = ALBUMS_MAX_PAGE_SIZE, page_token: Optional[str] = None
     ) -> Response:
         """
         https://developers.google.com/photos/library/reference/rest/v1/albums/list
@@ -134,8 +288,11 @@ class GooglePhotosApiRestClient:
         if page_token is not None:
             get_albums_params["pageToken"] = page_token
 
-        get_albums_response: Response = requests.get(
-            albums_url, headers=self._auth_header, params=get_albums_params
+        get_albums_response: Response = self._send(
+            "get_albums",
+            self.session.get,
+            albums_url,
+            params=get_albums_params,
         )
         get_albums_response.raise_for_status()
         return get_albums_response
@@ -143,11 +300,15 @@ class GooglePhotosApiRestClient:
     def get_albums_paginated(self) -> Generator[Album, None, None]:
         logger.info("Fetching all Albums")
         return self._paginate(
-            self.get_albums, PaginationResponseKey.Albums, page_size=50
+            self.get_albums,
+            PaginationResponseKey.Albums,
+            page_size=ALBUMS_MAX_PAGE_SIZE,
         )
 
     def get_media_items(
-        self, page_size: int = 25, page_token: Optional[str] = None
+        self,
+        page_size: int = MEDIA_ITEMS_MAX_PAGE_SIZE,
+        page_token: Optional[str] = None,
     ) -> Response:
         """
         https://developers.google.com/photos/library/reference/rest/v1/mediaItems/list
@@ -163,8 +324,11 @@ class GooglePhotosApiRestClient:
         if page_token is not None:
             get_media_items_params["pageToken"] = page_token
 
-        get_media_items_response: Response = requests.get(
-            media_items_url, headers=self._auth_header, params=get_media_items_params
+        get_media_items_response: Response = self._send(
+            "get_media_items",
+            self.session.get,
+            media_items_url,
+            params=get_media_items_params,
         )
         get_media_items_response.raise_for_status()
         return get_media_items_response
@@ -173,9 +337,53 @@ class GooglePhotosApiRestClient:
         logger.info("Fetching MediaItems")
         return self._paginate(self.get_media_items, PaginationResponseKey.MediaItems)
 
+    def batch_get_media_items(self, media_item_ids: List[str]) -> Response:
+        """
+        https://developers.google.com/photos/library/reference/rest/v1/mediaItems/batchGet
+        """
+        if len(media_item_ids) > BATCH_GET_MAX_MEDIA_ITEMS:
+            raise ValueError(
+                f"Can only batchGet up to {BATCH_GET_MAX_MEDIA_ITEMS} MediaItems at once."
+                f" Got: {len(media_item_ids)}"
+            )
+
+        logger.info("Fetching %d MediaItems by id", len(media_item_ids))
+
+        batch_get_url: str = urljoin(self.api_url, "mediaItems") + ":batchGet"
+
+        batch_get_response: Response = self._send(
+            "batch_get_media_items",
+            self.session.get,
+            batch_get_url,
+            params={"mediaItemIds": media_item_ids},
+        )
+        batch_get_response.raise_for_status()
+        return batch_get_response
+
+    def get_media_items_by_ids(
+        self, media_item_ids: List[str]
+    ) -> Generator[MediaItem, None, None]:
+        """
+        Fetches MediaItems in batches of up to `BATCH_GET_MAX_MEDIA_ITEMS`. MediaItems that
+        can't be fetched (e.g. because they were deleted) are logged and left out
+        """
+        for i in range(0, len(media_item_ids), BATCH_GET_MAX_MEDIA_ITEMS):
+            response = self.batch_get_media_items(
+                media_item_ids[i : i + BATCH_GET_MAX_MEDIA_ITEMS]
+            )
+
+            for media_item_result in response.json().get("mediaItemResults", []):
+                media_item = media_item_result.get("mediaItem")
+                if media_item is None:
+                    logger.warning(
+                        "Unable to fetch MediaItem: %s", media_item_result.get("status")
+                    )
+                    continue
+                yield create_media_item(media_item)
+
     def search_media_items(
         self,
-        page_size: int = 100,
+        page_size: int = MEDIA_ITEMS_MAX_PAGE_SIZE,
         page_token: Optional[str] = None,
         filters: Optional[List[Filter]] = None,
         album_id: Optional[int] = None,
@@ -202,9 +410,10 @@ class GooglePhotosApiRestClient:
                 k: v for f in filters for k, v in f.get_filter().items()
             }
 
-        search_media_items_response: Response = requests.post(
+        search_media_items_response: Response = self._send(
+            "search_media_items",
+            self.session.post,
             search_media_items_url,
-            headers=self._auth_header,
             params={"alt": "json"},
             json=search_media_items_body,
         )
@@ -228,3 +437,75 @@ class GooglePhotosApiRestClient:
             PaginationResponseKey.MediaItems,
             filters=filters,
         )
+
+    def search_media_items_concurrently(
+        self, filter_sets: List[List[Filter]], max_workers: int, name: str = "search"
+    ) -> Generator[MediaItem, None, None]:
+        """
+        Searches for the MediaItems matching each of `filter_sets` concurrently, and
+        yields them as one stream as they come in. MediaItems are deduplicated by id, in
+        case they match more than one of `filter_sets`
+        """
+        searches = [
+            self.search_media_items_paginated(filters=filters)
+            for filters in filter_sets
+        ]
+
+        media_item_ids: Set[str] = set()
+        for media_item in merge_concurrently(
+            searches,
+            max_workers=max_workers,
+            max_buffered=MEDIA_ITEMS_MAX_PAGE_SIZE * max_workers,
+            name=name,
+        ):
+            if media_item.id not in media_item_ids:
+                media_item_ids.add(media_item.id)
+                yield media_item
+
+    def search_media_items_sharded(
+        self, date_ranges: List[DateRange], max_workers: int
+    ) -> Generator[MediaItem, None, None]:
+        """
+        Lists the MediaItems of each of `date_ranges` concurrently rather than following
+        one long chain of page tokens
+        """
+        logger.info(
+            "Fetching MediaItems from %d DateRanges, %d at a time",
+            len(date_ranges),
+            max_workers,
+        )
+
+        return self.search_media_items_concurrently(
+            [
+                [DateFilter(date_ranges=[date_range]), IncludeArchivedMediaFilter()]
+                for date_range in date_ranges
+            ],
+            max_workers=max_workers,
+            name="shard",
+        )
+
+    def search_media_items_by_dates(
+        self,
+        dates: Optional[List[Date]] = None,
+        date_ranges: Optional[List[DateRange]] = None,
+        max_workers: int = DEFAULT_DATE_SEARCH_WORKERS,
+    ) -> Generator[MediaItem, None, None]:
+        """
+        Searches for the MediaItems matching any of `dates` or `date_ranges`, however many
+        of them there are. They're split into as few DateFilters as the API accepts, which
+        are searched concurrently
+        """
+        date_filters = chunk_date_filter(dates=dates, date_ranges=date_ranges)
+        if len(date_filters) == 1:
+            return self.search_media_items_paginated(filters=date_filters)
+
+        logger.info(
+            "Searching for MediaItems with %d DateFilters, %d at a time",
+            len(date_filters),
+            max_workers,
+        )
+        return self.search_media_items_concurrently(
+            [[date_filter] for date_filter in date_filters],
+            max_workers=max_workers,
+            name="date-search",
+        )
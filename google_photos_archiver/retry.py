@@ -0,0 +1,249 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+TOO_MANY_REQUESTS = 429
+RETRYABLE_STATUS_CODES = frozenset({TOO_MANY_REQUESTS, 500, 502, 503, 504})
+
+DEFAULT_MAX_ATTEMPTS = 5
+
+
+def parse_retry_after(retry_after: Optional[str]) -> Optional[float]:
+    """
+    Returns the amount of seconds that a `Retry-After` header asks us to wait for
+
+    Ref: https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Retry-After
+    """
+    if retry_after is None:
+        return None
+
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def _get_response(err: BaseException) -> Optional[requests.Response]:
+    return getattr(err, "response", None)
+
+
+class RetryStats:
+    """
+    Thread-safe per-call counters of retries, and of calls that still failed after
+    exhausting their retries
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.retries: Dict[str, int] = Counter()
+        self.failures: Dict[str, int] = Counter()
+
+    def record_retry(self, call_name: str):
+        with self._lock:
+            self.retries[call_name] += 1
+
+    def record_failure(self, call_name: str):
+        with self._lock:
+            self.failures[call_name] += 1
+
+    def __bool__(self) -> bool:
+        return bool(self.retries or self.failures)
+
+    def __str__(self) -> str:
+        with self._lock:
+            return ", ".join(
+                f"{call_name}: {self.retries[call_name]} retried"
+                f" / {self.failures[call_name]} failed"
+                for call_name in sorted(set(self.retries) | set(self.failures))
+            )
+
+
+class RetryPolicy:
+    """
+    Retries connection errors, timeouts, 429s and 5xxs with exponential backoff and
+    "full jitter", honoring any `Retry-After` that the server sends back. One policy
+    (and its `RetryStats`) is meant to be shared by every HTTP call that we make
+
+    Ref: https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+    """
+
+    # pylint: disable=too-many-arguments
+
+    def __init__(
+        self,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        stats: Optional[RetryStats] = None,
+        on_throttled: Optional[Callable[[Optional[float]], None]] = None,
+    ):
+        """
+        :param on_throttled: Called with the `Retry-After` (in seconds) of every 429
+            response, e.g. to let an `AdaptiveConcurrencyLimiter` back off
+        """
+        if max_attempts < 1:
+            raise ValueError(f"max_attempts must be at least 1. Got: {max_attempts}")
+
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = RetryStats() if stats is None else stats
+        self.on_throttled = on_throttled
+
+    def without_retries(self) -> "RetryPolicy":
+        """
+        A policy that shares this one's stats and hooks but makes a single attempt.
+        Useful when failures get retried at a higher level (e.g. by requeueing them)
+        """
+        return RetryPolicy(
+            max_attempts=1,
+            base_delay=self.base_delay,
+            max_delay=self.max_delay,
+            stats=self.stats,
+            on_throttled=self.on_throttled,
+        )
+
+    def with_on_throttled(
+        self, on_throttled: Optional[Callable[[Optional[float]], None]]
+    ) -> "RetryPolicy":
+        """
+        A policy that shares this one's stats and attempts but reports 429s to
+        `on_throttled` instead, so that a hook only sees the calls it's meant for
+        """
+        return RetryPolicy(
+            max_attempts=self.max_attempts,
+            base_delay=self.base_delay,
+            max_delay=self.max_delay,
+            stats=self.stats,
+            on_throttled=on_throttled,
+        )
+
+    @staticmethod
+    def is_retryable_status(status_code: int) -> bool:
+        return status_code in RETRYABLE_STATUS_CODES
+
+    def is_retryable(self, err: Optional[BaseException]) -> bool:
+        """
+        Errors raised `from` a retryable error (e.g. when giving up on a download) are
+        considered retryable as well
+        """
+        while err is not None:
+            if isinstance(err, (requests.ConnectionError, requests.Timeout)):
+                return True
+
+            response = _get_response(err)
+            if response is not None:
+                return self.is_retryable_status(response.status_code)
+
+            err = err.__cause__
+        return False
+
+    def get_delay(
+        self, attempt_number: int, retry_after: Optional[float] = None
+    ) -> float:
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (attempt_number - 1))
+        )
+
+    def get_retry_delay(
+        self,
+        call_name: str,
+        attempt_number: int,
+        status_code: Optional[int] = None,
+        retry_after: Optional[float] = None,
+    ) -> Optional[float]:
+        """
+        Records a failed attempt. Returns the amount of seconds to wait for before the
+        next attempt, or `None` if no attempts remain
+        """
+        if status_code == TOO_MANY_REQUESTS and self.on_throttled is not None:
+            self.on_throttled(retry_after)
+
+        if attempt_number >= self.max_attempts:
+            # Single attempt policies leave failures to be accounted for by whichever
+            # higher level retries them
+            if self.max_attempts > 1:
+                self.stats.record_failure(call_name)
+            return None
+
+        self.stats.record_retry(call_name)
+        return self.get_delay(attempt_number, retry_after)
+
+    def get_retry_delay_for_error(
+        self, call_name: str, err: BaseException, attempt_number: int
+    ) -> Optional[float]:
+        if not self.is_retryable(err):
+            return None
+
+        response = _get_response(err)
+        if response is None:
+            return self.get_retry_delay(call_name, attempt_number)
+
+        return self.get_retry_delay(
+            call_name,
+            attempt_number,
+            status_code=response.status_code,
+            retry_after=parse_retry_after(response.headers.get("Retry-After")),
+        )
+
+    def send(
+        self, call_name: str, send: Callable[..., requests.Response], *args, **kwargs
+    ) -> requests.Response:
+        """
+        Calls `send(*args, **kwargs)` until it returns a non-retryable response or
+        attempts run out. The last response is returned even if its status is retryable,
+        leaving it to the caller to `raise_for_status`
+        """
+        attempt_number = 1
+
+        while True:
+            try:
+                response = send(*args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                delay = self.get_retry_delay_for_error(call_name, err, attempt_number)
+                if delay is None:
+                    raise
+                reason = err.__class__.__name__
+            else:
+                if not self.is_retryable_status(response.status_code):
+                    return response
+
+                delay = self.get_retry_delay(
+                    call_name,
+                    attempt_number,
+                    status_code=response.status_code,
+                    retry_after=parse_retry_after(response.headers.get("Retry-After")),
+                )
+                if delay is None:
+                    return response
+                response.close()
+                reason = f"status: {response.status_code}"
+
+            logger.warning(
+                "`%s` failed (%s). Waiting %.1f second(s) and trying again"
+                " (attempt: %d of %d)",
+                call_name,
+                reason,
+                delay,
+                attempt_number,
+                self.max_attempts,
+            )
+            time.sleep(delay)
+            attempt_number += 1
@@ -1,12 +1,16 @@
 import json
 from pathlib import Path
+from typing import Iterator
 from unittest.mock import MagicMock
 
 import pytest
 from pytest_socket import disable_socket
 from requests import Response
 
+from google_photos_archiver.album_recorder import AlbumRecorder
 from google_photos_archiver.filters import Date, DateFilter, DateRange
+from google_photos_archiver.incremental_sync import IncrementalSync
+from google_photos_archiver.listing_checkpoint import ListingCheckpoint
 from google_photos_archiver.media_item import (
     MediaItem,
     VideoProcessingStatus,
@@ -122,8 +126,36 @@ def test_video_media_item(test_video_media_item_dict) -> MediaItem:
 
 
 @pytest.fixture()
-def test_media_item_recorder(tmp_path) -> MediaItemRecorder:
-    return MediaItemRecorder(sqlite_db_path=Path(tmp_path, "test.db"))
+def test_media_item_recorder(tmp_path) -> Iterator[MediaItemRecorder]:
+    recorder = MediaItemRecorder(sqlite_db_path=Path(tmp_path, "test.db"))
+    yield recorder
+    recorder.close()
+
+
+@pytest.fixture()
+def test_listing_checkpoint(tmp_path) -> Iterator[ListingCheckpoint]:
+    listing_checkpoint = ListingCheckpoint(sqlite_db_path=Path(tmp_path, "test.db"))
+    yield listing_checkpoint
+    listing_checkpoint.close()
+
+
+@pytest.fixture()
+def test_album_recorder(tmp_path) -> Iterator[AlbumRecorder]:
+    album_recorder = AlbumRecorder(sqlite_db_path=Path(tmp_path, "test.db"))
+    yield album_recorder
+    album_recorder.close()
+
+
+@pytest.fixture()
+def test_incremental_sync(tmp_path) -> Iterator[IncrementalSync]:
+    incremental_sync = IncrementalSync(sqlite_db_path=Path(tmp_path, "test.db"))
+    yield incremental_sync
+    incremental_sync.close()
+
+
+@pytest.fixture()
+def clock() -> "MockClock":
+    return MockClock()
 
 
 @pytest.fixture()
@@ -156,6 +188,7 @@ class MockResponse(Response):
         super().__init__()
         self.encoding = "utf-8"
         self._content = content
+        self._content_consumed = True
         self.status_code = status_code
 
         self.raw = MagicMock()
@@ -178,3 +211,11 @@ class MockFailureResponse(MockResponse):
         status_code=400,
     ):
         super().__init__(content, status_code)
+
+
+class MockClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
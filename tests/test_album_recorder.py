@@ -0,0 +1,50 @@
+from pathlib import Path
+
+from google_photos_archiver.album import create_album
+from google_photos_archiver.album_recorder import RecordedAlbum
+
+
+class TestAlbumRecorder:
+    def test_add_and_get_albums(
+        self,
+        test_album_recorder,
+        test_album_dict,
+        test_photo_media_item,
+        test_video_media_item,
+    ):
+        album = create_album(test_album_dict)
+        test_album_recorder.add(album, [test_photo_media_item, test_video_media_item])
+
+        assert test_album_recorder.get_albums() == [
+            RecordedAlbum(
+                id=album.id,
+                title=album.title,
+                media_item_paths=[
+                    Path("2020", "12", "22", test_photo_media_item.filename),
+                    Path("2020", "12", "22", test_video_media_item.filename),
+                ],
+            )
+        ]
+
+    def test_add_replaces_album(
+        self,
+        test_album_recorder,
+        test_album_dict,
+        test_photo_media_item,
+        test_video_media_item,
+    ):
+        album = create_album(test_album_dict)
+        test_album_recorder.add(album, [test_photo_media_item, test_video_media_item])
+
+        album.title = "Renamed"
+        test_album_recorder.add(album, [test_video_media_item])
+
+        assert test_album_recorder.get_albums() == [
+            RecordedAlbum(
+                id=album.id,
+                title="Renamed",
+                media_item_paths=[
+                    Path("2020", "12", "22", test_video_media_item.filename)
+                ],
+            )
+        ]
@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+from pathlib import Path
+
+import pytest
+from pytest_socket import disable_socket, enable_socket
+
+# The async engine is an optional extra (pip install google-photos-archiver[async])
+pytest.importorskip("aiohttp")
+
+# pylint: disable=wrong-import-position
+import aiohttp
+
+from google_photos_archiver.archivers import get_part_path
+from google_photos_archiver.async_media_item_archiver import (
+    AsyncDiskArchiver,
+    AsyncMediaItemArchiver,
+)
+from google_photos_archiver.media_item import (
+    DOWNLOAD_CONNECT_TIMEOUT_SECONDS,
+    DOWNLOAD_READ_TIMEOUT_SECONDS,
+)
+from google_photos_archiver.media_item_archiver import get_new_media_item_archivals
+from google_photos_archiver.retry import RetryPolicy
+
+TEST_MEDIA_CONTENT = bytes("I'm a test photo or a video!", "utf-8")
+
+
+@pytest.fixture(autouse=True)
+def _event_loop_sockets():
+    # asyncio event loops need a socketpair for their self-pipe. All HTTP is mocked below
+    enable_socket()
+    yield
+    disable_socket()
+
+
+class MockStreamReader:
+    def __init__(self, content: bytes):
+        self._content = content
+
+    async def iter_chunked(self, n: int):
+        for i in range(0, len(self._content), n):
+            yield self._content[i : i + n]
+
+
+class MockTimingOutStreamReader(MockStreamReader):
+    async def iter_chunked(self, n: int):
+        async for chunk in super().iter_chunked(n):
+            yield chunk
+        raise asyncio.TimeoutError()
+
+
+class MockAsyncResponse:
+    def __init__(self, content: bytes = TEST_MEDIA_CONTENT, status: int = 200):
+        self.content = MockStreamReader(content)
+        self.status = status
+        self.headers = {}
+
+    def raise_for_status(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+@pytest.fixture()
+def _async_disk_archiver(tmp_path, test_media_item_recorder) -> AsyncDiskArchiver:
+    return AsyncDiskArchiver(
+        base_download_path=tmp_path, recorder=test_media_item_recorder, chunk_size=4
+    )
+
+
+class TestAsyncMediaItemArchiver:
+    @pytest.mark.parametrize("has_album_path", [True, False])
+    def test_start(
+        self,
+        mocker,
+        _async_disk_archiver,
+        test_photo_media_item,
+        test_video_media_item,
+        has_album_path,
+    ):
+        mock_get = mocker.patch(
+            "aiohttp.ClientSession.get",
+            side_effect=lambda url, **kwargs: MockAsyncResponse(),
+        )
+        media_items = [test_photo_media_item, test_video_media_item]
+        base_download_path = _async_disk_archiver.base_download_path
+        test_album_path = (
+            Path(base_download_path, "test_album") if has_album_path else None
+        )
+
+        completed_media_item_archivals = AsyncMediaItemArchiver(
+            archiver=_async_disk_archiver
+        ).start(iter(media_items), test_album_path)
+
+        assert get_new_media_item_archivals(completed_media_item_archivals) == 2
+        assert mock_get.call_count == 2
+        assert _async_disk_archiver.bytes_written == len(TEST_MEDIA_CONTENT) * 2
+
+        for media_item in media_items:
+            assert _async_disk_archiver.recorder.lookup(media_item) is True
+            media_item_path = media_item.get_download_path(base_download_path)
+            with media_item_path.open("rb") as f:
+                assert f.read() == TEST_MEDIA_CONTENT
+
+            if has_album_path:
+                media_item_path_in_album = Path(test_album_path, media_item.filename)
+                assert media_item_path_in_album.resolve() == media_item_path.resolve()
+
+    def test_start_only_times_out_connecting_and_reads(
+        self, mocker, _async_disk_archiver, test_photo_media_item
+    ):
+        mocker.patch(
+            "aiohttp.ClientSession.get",
+            side_effect=lambda url, **kwargs: MockAsyncResponse(),
+        )
+        client_session_spy = mocker.spy(aiohttp, "ClientSession")
+
+        AsyncMediaItemArchiver(archiver=_async_disk_archiver).start(
+            [test_photo_media_item]
+        )
+
+        timeout = client_session_spy.call_args.kwargs["timeout"]
+        assert timeout.total is None
+        assert timeout.sock_connect == DOWNLOAD_CONNECT_TIMEOUT_SECONDS
+        assert timeout.sock_read == DOWNLOAD_READ_TIMEOUT_SECONDS
+
+    def test_start_skips_archived_media_items(
+        self, mocker, _async_disk_archiver, test_photo_media_item
+    ):
+        mock_get = mocker.patch(
+            "aiohttp.ClientSession.get",
+            side_effect=lambda url, **kwargs: MockAsyncResponse(),
+        )
+        media_item_archiver = AsyncMediaItemArchiver(archiver=_async_disk_archiver)
+
+        media_item_archiver.start([test_photo_media_item])
+        completed_media_item_archivals = media_item_archiver.start(
+            [test_photo_media_item]
+        )
+
+        assert get_new_media_item_archivals(completed_media_item_archivals) == 0
+        assert mock_get.call_count == 1
+
+    def test_start_skips_media_items_that_are_not_ready(
+        self, mocker, _async_disk_archiver, test_video_media_item
+    ):
+        mock_get = mocker.patch("aiohttp.ClientSession.get")
+        test_video_media_item.mediaMetadata.video.status = "PROCESSING"
+
+        completed_media_item_archivals = AsyncMediaItemArchiver(
+            archiver=_async_disk_archiver
+        ).start([test_video_media_item])
+
+        assert get_new_media_item_archivals(completed_media_item_archivals) == 0
+        mock_get.assert_not_called()
+
+
+def test_archive_async_resumes_partial_downloads(
+    mocker, _async_disk_archiver, test_photo_media_item, tmp_path
+):
+    media_item_path = test_photo_media_item.get_download_path(tmp_path)
+    part_path = get_part_path(media_item_path)
+    with part_path.open("wb") as f:
+        f.write(TEST_MEDIA_CONTENT[:10])
+
+    mock_get = mocker.patch(
+        "aiohttp.ClientSession.get",
+        side_effect=lambda url, **kwargs: MockAsyncResponse(
+            TEST_MEDIA_CONTENT[10:], status=206
+        ),
+    )
+
+    AsyncMediaItemArchiver(archiver=_async_disk_archiver).start([test_photo_media_item])
+
+    assert mock_get.call_args.kwargs["headers"] == {"Range": "bytes=10-"}
+    assert not part_path.exists()
+    with media_item_path.open("rb") as f:
+        assert f.read() == TEST_MEDIA_CONTENT
+
+    recorded_media_item = _async_disk_archiver.recorder.get(test_photo_media_item.id)
+    assert recorded_media_item.size == len(TEST_MEDIA_CONTENT)
+    assert recorded_media_item.sha256 == hashlib.sha256(TEST_MEDIA_CONTENT).hexdigest()
+
+
+def test_archive_async_retries_timed_out_reads(
+    mocker, tmp_path, test_media_item_recorder, test_photo_media_item
+):
+    timed_out_response = MockAsyncResponse()
+    timed_out_response.content = MockTimingOutStreamReader(TEST_MEDIA_CONTENT[:10])
+    mock_get = mocker.patch(
+        "aiohttp.ClientSession.get",
+        side_effect=[
+            timed_out_response,
+            MockAsyncResponse(TEST_MEDIA_CONTENT[10:], status=206),
+        ],
+    )
+    async_disk_archiver = AsyncDiskArchiver(
+        base_download_path=tmp_path,
+        recorder=test_media_item_recorder,
+        chunk_size=4,
+        retry_policy=RetryPolicy(base_delay=0),
+    )
+
+    AsyncMediaItemArchiver(archiver=async_disk_archiver).start([test_photo_media_item])
+
+    # Resumed from wherever the timed out read left off
+    assert mock_get.call_args.kwargs["headers"] == {"Range": "bytes=10-"}
+    with test_photo_media_item.get_download_path(tmp_path).open("rb") as f:
+        assert f.read() == TEST_MEDIA_CONTENT
@@ -0,0 +1,178 @@
+import threading
+
+import pytest
+
+from google_photos_archiver.base_url_refresher import (
+    BaseUrlRefresher,
+    BaseUrlRefreshError,
+)
+
+
+def make_media_items(test_photo_media_item, count, listed_at=0.0):
+    return [
+        test_photo_media_item.replace(id=str(i), listedAt=listed_at)
+        for i in range(count)
+    ]
+
+
+class TestBaseUrlRefresher:
+    @pytest.fixture()
+    def rest_client(self, mocker, test_photo_media_item, clock):
+        rest_client = mocker.Mock()
+        rest_client.get_media_items_by_ids.side_effect = lambda media_item_ids: [
+            test_photo_media_item.replace(
+                id=media_item_id,
+                baseUrl=f"https://fresh/{media_item_id}",
+                listedAt=clock.now,
+            )
+            for media_item_id in media_item_ids
+        ]
+        return rest_client
+
+    def test_fresh_media_items_are_left_alone(
+        self, rest_client, test_photo_media_item, clock
+    ):
+        refresher = BaseUrlRefresher(rest_client, max_base_url_age=100, clock=clock)
+        media_items = list(refresher.track(make_media_items(test_photo_media_item, 3)))
+
+        clock.now = 99
+        assert not refresher.refresh_if_stale(media_items[0])
+        rest_client.get_media_items_by_ids.assert_not_called()
+
+    def test_stale_media_items_are_refreshed_with_pending_ones(
+        self, rest_client, test_photo_media_item, clock
+    ):
+        refresher = BaseUrlRefresher(rest_client, max_base_url_age=100, clock=clock)
+        media_items = list(refresher.track(make_media_items(test_photo_media_item, 60)))
+
+        assert not refresher.refresh_if_stale(media_items[0])
+
+        clock.now = 100
+        assert refresher.refresh_if_stale(media_items[1])
+
+        # The already started MediaItem 0 isn't part of the batch
+        rest_client.get_media_items_by_ids.assert_called_once_with(
+            [str(i) for i in range(1, 51)]
+        )
+        assert media_items[1].baseUrl == "https://fresh/1"
+        assert media_items[50].listedAt == 100
+        assert media_items[51].listedAt == 0
+
+        # MediaItems that were refreshed along with MediaItem 1 are fresh now
+        rest_client.get_media_items_by_ids.reset_mock()
+        assert not refresher.refresh_if_stale(media_items[2])
+
+        # The rest get refreshed next
+        assert refresher.refresh_if_stale(media_items[51])
+        rest_client.get_media_items_by_ids.assert_called_once_with(
+            [str(i) for i in range(51, 60)] + [str(i) for i in range(3, 44)]
+        )
+
+    def test_unrefreshable_media_items_keep_their_base_url(
+        self, rest_client, test_photo_media_item, clock
+    ):
+        rest_client.get_media_items_by_ids.side_effect = None
+        rest_client.get_media_items_by_ids.return_value = []
+        refresher = BaseUrlRefresher(rest_client, max_base_url_age=100, clock=clock)
+        (media_item,) = make_media_items(test_photo_media_item, 1)
+
+        clock.now = 100
+        assert refresher.refresh_if_stale(media_item)
+        assert media_item.baseUrl == test_photo_media_item.baseUrl
+
+    def test_lock_is_not_held_while_refreshing(
+        self, rest_client, test_photo_media_item, clock
+    ):
+        refresher = BaseUrlRefresher(rest_client, max_base_url_age=100, clock=clock)
+        media_items = list(refresher.track(make_media_items(test_photo_media_item, 2)))
+        get_media_items_by_ids = rest_client.get_media_items_by_ids.side_effect
+
+        def get_media_items_by_ids_unlocked(media_item_ids):
+            # Other MediaItems can still start downloading meanwhile
+            refresher.discard(media_items[1])
+            return get_media_items_by_ids(media_item_ids)
+
+        rest_client.get_media_items_by_ids.side_effect = get_media_items_by_ids_unlocked
+
+        clock.now = 100
+        assert refresher.refresh_if_stale(media_items[0])
+        assert media_items[0].baseUrl == "https://fresh/0"
+
+    def test_concurrent_callers_wait_for_their_batch(
+        self, rest_client, test_photo_media_item, clock
+    ):
+        refresher = BaseUrlRefresher(rest_client, max_base_url_age=100, clock=clock)
+        media_items = list(refresher.track(make_media_items(test_photo_media_item, 2)))
+        get_media_items_by_ids = rest_client.get_media_items_by_ids.side_effect
+        refreshing, waiting_started = threading.Event(), threading.Event()
+        waiting = threading.Thread(
+            target=refresher.refresh_if_stale, args=(media_items[1],)
+        )
+
+        def get_media_items_by_ids_concurrently(media_item_ids):
+            refreshing.set()
+            waiting_started.wait()
+            waiting.join(timeout=0.1)
+            # MediaItem 1 is part of this batch, so it waits rather than refreshing
+            assert waiting.is_alive()
+            return get_media_items_by_ids(media_item_ids)
+
+        rest_client.get_media_items_by_ids.side_effect = (
+            get_media_items_by_ids_concurrently
+        )
+
+        clock.now = 100
+        refreshing_thread = threading.Thread(
+            target=refresher.refresh_if_stale, args=(media_items[0],)
+        )
+        refreshing_thread.start()
+        refreshing.wait()
+        waiting.start()
+        waiting_started.set()
+        refreshing_thread.join()
+        waiting.join()
+
+        rest_client.get_media_items_by_ids.assert_called_once_with(["0", "1"])
+        assert media_items[1].baseUrl == "https://fresh/1"
+
+    def test_concurrent_callers_fail_along_with_their_batch(
+        self, rest_client, test_photo_media_item, clock
+    ):
+        refresher = BaseUrlRefresher(rest_client, max_base_url_age=100, clock=clock)
+        media_items = list(refresher.track(make_media_items(test_photo_media_item, 2)))
+        refreshing, waiting_started = threading.Event(), threading.Event()
+        errors = {}
+
+        def refresh_if_stale(media_item):
+            if media_item is media_items[1]:
+                waiting_started.set()
+            try:
+                refresher.refresh_if_stale(media_item)
+            except Exception as err:  # pylint: disable=broad-except
+                errors[media_item.id] = err
+
+        waiting = threading.Thread(target=refresh_if_stale, args=(media_items[1],))
+
+        def get_media_items_by_ids_failing(_media_item_ids):
+            refreshing.set()
+            waiting_started.wait()
+            waiting.join(timeout=0.1)
+            raise ConnectionError("Unreachable")
+
+        rest_client.get_media_items_by_ids.side_effect = get_media_items_by_ids_failing
+
+        clock.now = 100
+        refreshing_thread = threading.Thread(
+            target=refresh_if_stale, args=(media_items[0],)
+        )
+        refreshing_thread.start()
+        refreshing.wait()
+        waiting.start()
+        refreshing_thread.join()
+        waiting.join()
+
+        rest_client.get_media_items_by_ids.assert_called_once_with(["0", "1"])
+        assert isinstance(errors["0"], ConnectionError)
+        # Rather than carrying on as if its baseUrl had been refreshed
+        assert isinstance(errors["1"], BaseUrlRefreshError)
+        assert errors["1"].__cause__ is errors["0"]
@@ -1,8 +1,11 @@
+from pathlib import Path
+
 import pytest
 from click.testing import CliRunner
 
 from google_photos_archiver.album import create_album
 from google_photos_archiver.cli import cli
+from google_photos_archiver.rate_limiter import ApiRequestBudgetExhausted
 
 
 @pytest.mark.parametrize(
@@ -30,6 +33,8 @@ def test_archive_media_items(
     get_new_media_item_archivals_mock = mocker.patch(
         "google_photos_archiver.cli.get_new_media_item_archivals"
     )
+    mocker.patch("google_photos_archiver.cli.ListingCheckpoint")
+    album_recorder_mock = mocker.patch("google_photos_archiver.cli.AlbumRecorder")
     get_albums_mock = mocker.patch.object(
         google_photos_api_rest_client,
         "get_albums_paginated",
@@ -57,8 +62,89 @@ def test_archive_media_items(
 
     get_media_item_archiver_mock.assert_called()
     get_new_media_item_archivals_mock.assert_called()
+    get_media_item_archiver_mock.return_value.archiver.close.assert_called()
 
     if option_name == "albums_only":
         get_albums_mock.assert_called_with()
+        album_recorder_mock.return_value.close.assert_called_once()
     else:
         get_albums_mock.assert_not_called()
+        album_recorder_mock.assert_not_called()
+
+
+def test_archive_media_items_api_request_budget_exhausted(
+    mocker, google_photos_api_rest_client
+):
+    get_media_item_archiver_mock = mocker.patch(
+        "google_photos_archiver.cli.get_media_item_archiver"
+    )
+    mocker.patch(
+        "google_photos_archiver.cli.get_new_media_item_archivals",
+        side_effect=ApiRequestBudgetExhausted("Used up the daily budget"),
+    )
+    mocker.patch("google_photos_archiver.cli.ListingCheckpoint")
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        ["archive-media-items", "--max-api-requests-per-day", "10"],
+        obj={"google_photos_api_rest_client": google_photos_api_rest_client},
+    )
+
+    assert result.exit_code == 1
+    assert "Used up the daily budget" in result.output
+    get_media_item_archiver_mock.return_value.archiver.close.assert_called()
+
+
+def test_archive_media_items_closes_archiver_on_failure(
+    mocker, google_photos_api_rest_client
+):
+    get_media_item_archiver_mock = mocker.patch(
+        "google_photos_archiver.cli.get_media_item_archiver"
+    )
+    mocker.patch(
+        "google_photos_archiver.cli.get_new_media_item_archivals",
+        side_effect=RuntimeError("Download failed"),
+    )
+    listing_checkpoint_mock = mocker.patch(
+        "google_photos_archiver.cli.ListingCheckpoint"
+    )
+    incremental_sync_mock = mocker.patch("google_photos_archiver.cli.IncrementalSync")
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        ["archive-media-items", "--incremental"],
+        obj={"google_photos_api_rest_client": google_photos_api_rest_client},
+    )
+
+    assert isinstance(result.exception, RuntimeError)
+    get_media_item_archiver_mock.return_value.archiver.close.assert_called_once()
+    listing_checkpoint_mock.return_value.close.assert_called_once()
+    incremental_sync_mock.return_value.save.assert_not_called()
+    incremental_sync_mock.return_value.close.assert_called_once()
+
+
+def test_rebuild_albums(
+    test_album_recorder, test_album_dict, test_photo_media_item, tmp_path
+):
+    test_album_recorder.add(create_album(test_album_dict), [test_photo_media_item])
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        [
+            "rebuild-albums",
+            "--download-path",
+            str(tmp_path),
+            "--sqlite-db-path",
+            str(test_album_recorder.sqlite_db_path),
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "Created 1 Album symlink(s)" in result.output
+    assert (
+        Path(tmp_path, "albums", "Test Album", test_photo_media_item.filename).resolve()
+        == test_photo_media_item.get_download_path(tmp_path).resolve()
+    )
@@ -3,15 +3,33 @@ from pathlib import Path
 import click
 import pytest
 
+from google_photos_archiver.album import create_album
 from google_photos_archiver.archivers import DiskArchiver
+from google_photos_archiver.async_media_item_archiver import (
+    AsyncDiskArchiver,
+    AsyncMediaItemArchiver,
+    aiohttp,
+)
 from google_photos_archiver.cli_utils import (
+    SHARDED_LISTING_START_YEAR,
+    AlbumListing,
+    Engine,
     Timer,
     get_date_objects_from_filters,
     get_media_item_archiver,
     get_media_items,
     validate_dates,
+    validate_engine_options,
+)
+from google_photos_archiver.filters import (
+    MAX_DATE,
+    Date,
+    DateFilter,
+    DateRange,
+    IncludeArchivedMediaFilter,
 )
-from google_photos_archiver.filters import Date, DateFilter, DateRange
+from google_photos_archiver.rest_client import DEFAULT_DATE_SEARCH_WORKERS
+from google_photos_archiver.retry import RetryPolicy
 from tests.conftest import test_date, test_date_range
 
 
@@ -44,7 +62,7 @@ class MockParam:
             MockParam(
                 "date_filter", "2021/1/1,2021/1/2,2021/1/3,2021/1/4,2021/1/5,2021/1/6"
             ),
-            True,
+            False,
         ),
         (MockParam("date_range_filter", "2021/1/1-2021/2/1"), False),
         (MockParam("date_range_filter", "blah"), True),
@@ -55,7 +73,7 @@ class MockParam:
                 "2021/1/1-2021/2/1,2021/2/1-2021/3/1,2021/3/1-2021/4/1,"
                 "2021/4/1-2021/5/1,2021/5/1-2021/6/1,2021/6/1-2021/7/1",
             ),
-            True,
+            False,
         ),
     ],
 )
@@ -102,25 +120,31 @@ def test_get_date_objects_from_filters(date_filter, date_range_filter, expected_
         (
             [test_date()],
             [],
-            "search_media_items_paginated",
-            dict(filters=[DateFilter(dates=[test_date()], date_ranges=[])]),
+            "search_media_items_by_dates",
+            dict(
+                dates=[test_date()],
+                date_ranges=[],
+                max_workers=DEFAULT_DATE_SEARCH_WORKERS,
+            ),
         ),
         (
             [],
             [test_date_range()],
-            "search_media_items_paginated",
+            "search_media_items_by_dates",
             dict(
-                filters=[DateFilter(dates=[], date_ranges=[test_date_range()])],
+                dates=[],
+                date_ranges=[test_date_range()],
+                max_workers=DEFAULT_DATE_SEARCH_WORKERS,
             ),
         ),
         (
             [test_date()],
             [test_date_range()],
-            "search_media_items_paginated",
+            "search_media_items_by_dates",
             dict(
-                filters=[
-                    DateFilter(dates=[test_date()], date_ranges=[test_date_range()])
-                ],
+                dates=[test_date()],
+                date_ranges=[test_date_range()],
+                max_workers=DEFAULT_DATE_SEARCH_WORKERS,
             ),
         ),
     ],
@@ -143,6 +167,128 @@ def test_get_media_items(
     mocked_call.assert_called_with(**expected_call_args)
 
 
+def test_get_media_items_sharded(mocker, google_photos_api_rest_client):
+    mocked_call = mocker.patch.object(
+        google_photos_api_rest_client, "search_media_items_sharded"
+    )
+    get_media_items(google_photos_api_rest_client, listing_workers=4)
+
+    date_ranges = mocked_call.call_args.args[0]
+    assert date_ranges[1].startDate == Date(SHARDED_LISTING_START_YEAR, 1, 1)
+    assert mocked_call.call_args.kwargs == dict(max_workers=4)
+
+
+def test_get_media_items_by_dates_with_listing_workers(
+    mocker, google_photos_api_rest_client
+):
+    mocked_call = mocker.patch.object(
+        google_photos_api_rest_client, "search_media_items_by_dates"
+    )
+    get_media_items(
+        google_photos_api_rest_client, [test_date()] * 6, [], listing_workers=2
+    )
+
+    mocked_call.assert_called_with(
+        dates=[test_date()] * 6, date_ranges=[], max_workers=2
+    )
+
+
+def test_get_media_items_incremental(
+    mocker, google_photos_api_rest_client, test_incremental_sync, test_photo_media_item
+):
+    mocked_call = mocker.patch.object(
+        google_photos_api_rest_client,
+        "get_media_items_paginated",
+        return_value=[test_photo_media_item],
+    )
+    list(
+        get_media_items(
+            google_photos_api_rest_client, incremental_sync=test_incremental_sync
+        )
+    )
+    mocked_call.assert_called_with()
+    test_incremental_sync.save()
+
+    mocked_call = mocker.patch.object(
+        google_photos_api_rest_client, "search_media_items_paginated", return_value=[]
+    )
+    list(
+        get_media_items(
+            google_photos_api_rest_client, incremental_sync=test_incremental_sync
+        )
+    )
+    assert [
+        search_filter.get_filter()
+        for search_filter in mocked_call.call_args.kwargs["filters"]
+    ] == [
+        DateFilter(
+            date_ranges=[DateRange(startDate=Date(2020, 12, 21), endDate=MAX_DATE)]
+        ).get_filter(),
+        IncludeArchivedMediaFilter().get_filter(),
+    ]
+
+
+# pylint: disable=too-many-arguments
+def test_album_listing(
+    mocker,
+    google_photos_api_rest_client,
+    test_album_dict,
+    test_photo_media_item,
+    test_video_media_item,
+    test_album_recorder,
+    tmp_path,
+):
+    first_album = create_album(dict(test_album_dict, id="1", title="First"))
+    second_album = create_album(dict(test_album_dict, id="2", title=None))
+    album_media_items = {
+        first_album.id: [test_photo_media_item, test_video_media_item],
+        second_album.id: [test_photo_media_item],
+    }
+    mocker.patch.object(
+        google_photos_api_rest_client,
+        "search_media_items_paginated",
+        side_effect=lambda album_id: iter(album_media_items[album_id]),
+    )
+
+    album_listing = AlbumListing(
+        google_photos_api_rest_client,
+        [first_album, second_album],
+        str(tmp_path),
+        listing_workers=2,
+        album_recorder=test_album_recorder,
+    )
+
+    assert sorted(media_item.id for media_item in album_listing) == sorted(
+        [test_photo_media_item.id, test_video_media_item.id]
+    )
+    assert album_listing.album_media_items == {
+        Path(tmp_path, "albums", "First"): album_media_items[first_album.id],
+        Path(tmp_path, "albums", "Album ID: 2"): album_media_items[second_album.id],
+    }
+    assert sorted(
+        (album.id, len(album.media_item_paths))
+        for album in test_album_recorder.get_albums()
+    ) == [("1", 2), ("2", 1)]
+
+
+@pytest.mark.parametrize(
+    "engine,options,expected_failure",
+    [
+        (Engine.THREAD, dict(adaptive_concurrency=True), False),
+        (Engine.ASYNC, dict(), False),
+        (Engine.ASYNC, dict(segment_threshold=1024), True),
+        (Engine.ASYNC, dict(adaptive_concurrency=True), True),
+        (Engine.ASYNC, dict(requeue_failed_downloads=True), True),
+    ],
+)
+def test_validate_engine_options(engine, options, expected_failure):
+    if expected_failure:
+        with pytest.raises(click.UsageError, match="can't be used with --engine async"):
+            validate_engine_options(engine, **options)
+    else:
+        validate_engine_options(engine, **options)
+
+
 def test_get_media_item_archiver(tmp_path):
 
     download_path = Path(tmp_path, "download")
@@ -157,3 +303,55 @@ def test_get_media_item_archiver(tmp_path):
     assert isinstance(media_item_archiver.archiver, DiskArchiver)
     assert media_item_archiver.archiver.base_download_path == download_path
     assert media_item_archiver.archiver.recorder.sqlite_db_path == sqlite_db_path
+
+
+@pytest.mark.skipif(aiohttp is None, reason="requires the `async` extra")
+def test_get_media_item_archiver_async_engine(tmp_path):
+    media_item_archiver = get_media_item_archiver(
+        download_path=Path(tmp_path, "download"),
+        max_threadpool_workers=1,
+        sqlite_db_path=Path(tmp_path, "db.sqlite"),
+        engine=Engine.ASYNC,
+        max_concurrent_downloads=123,
+        content_addressed=True,
+    )
+
+    assert isinstance(media_item_archiver, AsyncMediaItemArchiver)
+    assert isinstance(media_item_archiver.archiver, AsyncDiskArchiver)
+    assert media_item_archiver.max_concurrent_downloads == 123
+    assert media_item_archiver.archiver.content_addressed is True
+
+
+def test_get_media_item_archiver_adaptive_concurrency(tmp_path):
+    retry_policy = RetryPolicy()
+    media_item_archiver = get_media_item_archiver(
+        download_path=Path(tmp_path, "download"),
+        max_threadpool_workers=50,
+        sqlite_db_path=Path(tmp_path, "db.sqlite"),
+        adaptive_concurrency=True,
+        min_concurrent_downloads=5,
+        retry_policy=retry_policy,
+    )
+
+    concurrency_limiter = media_item_archiver.concurrency_limiter
+    assert (concurrency_limiter.min_limit, concurrency_limiter.max_limit) == (5, 50)
+    # API calls share `retry_policy`, and their 429s shouldn't back downloads off
+    assert retry_policy.on_throttled is None
+    download_retry_policy = media_item_archiver.archiver.retry_policy
+    assert download_retry_policy.on_throttled == concurrency_limiter.record_throttled
+    assert download_retry_policy.stats is retry_policy.stats
+
+
+def test_get_media_item_archiver_requeue_failed_downloads(tmp_path):
+    retry_policy = RetryPolicy(max_attempts=3)
+    media_item_archiver = get_media_item_archiver(
+        download_path=Path(tmp_path, "download"),
+        max_threadpool_workers=1,
+        sqlite_db_path=Path(tmp_path, "db.sqlite"),
+        retry_policy=retry_policy,
+        requeue_failed_downloads=True,
+    )
+
+    assert media_item_archiver.retry_policy is retry_policy
+    assert media_item_archiver.archiver.retry_policy.max_attempts == 1
+    assert media_item_archiver.archiver.retry_policy.stats is retry_policy.stats
@@ -0,0 +1,192 @@
+import threading
+
+import pytest
+
+from google_photos_archiver.concurrency import (
+    AdaptiveConcurrencyLimiter,
+    merge_concurrently,
+    prefetch,
+)
+
+
+class TestAdaptiveConcurrencyLimiter:
+    def test_invalid_bounds(self):
+        with pytest.raises(ValueError):
+            AdaptiveConcurrencyLimiter(min_limit=10, max_limit=5)
+
+    def test_additive_increase(self, clock):
+        limiter = AdaptiveConcurrencyLimiter(min_limit=2, max_limit=4, clock=clock)
+
+        for _ in range(2):
+            limiter.record_success()
+        assert limiter.limit == 3
+
+        for _ in range(3 + 4):
+            limiter.record_success()
+        assert limiter.limit == 4
+
+    def test_multiplicative_decrease_once_per_window(self, clock):
+        limiter = AdaptiveConcurrencyLimiter(
+            min_limit=2, max_limit=100, initial_limit=40, clock=clock
+        )
+
+        limiter.record_throttled()
+        limiter.record_throttled()
+        assert limiter.limit == 20
+
+        clock.now += limiter.window_seconds
+        limiter.record_throttled()
+        assert limiter.limit == 10
+
+    def test_decrease_on_error_rate(self, clock):
+        limiter = AdaptiveConcurrencyLimiter(
+            min_limit=1, max_limit=100, initial_limit=50, clock=clock
+        )
+        limiter.record_success()
+        limiter.record_error()
+
+        clock.now += limiter.window_seconds
+        limiter.record_error()
+
+        assert limiter.limit == 25
+
+    def test_backs_off_when_throughput_drops(self, clock):
+        bytes_written = [0]
+        limiter = AdaptiveConcurrencyLimiter(
+            min_limit=1,
+            max_limit=100,
+            initial_limit=50,
+            bytes_written=lambda: bytes_written[0],
+            clock=clock,
+        )
+
+        bytes_written[0] += 1000
+        clock.now += limiter.window_seconds
+        limiter.record_success()
+        assert limiter.limit == 50
+
+        bytes_written[0] += 100
+        clock.now += limiter.window_seconds
+        limiter.record_success()
+        assert limiter.limit == 49
+
+        # Increases are held off until throughput recovers
+        for _ in range(100):
+            limiter.record_success()
+        assert limiter.limit == 49
+
+    def test_retry_after_pauses_acquisitions(self, mocker, clock):
+        limiter = AdaptiveConcurrencyLimiter(min_limit=1, max_limit=1, clock=clock)
+
+        def _wait(timeout=None):
+            clock.now += timeout
+
+        wait_mock = mocker.patch.object(
+            limiter._condition,  # pylint: disable=protected-access
+            "wait",
+            side_effect=_wait,
+        )
+
+        limiter.record_throttled(retry_after=30)
+        limiter.acquire()
+
+        wait_mock.assert_called_once_with(30.0)
+        assert clock.now == 30.0
+        assert limiter.in_flight == 1
+
+    def test_limits_in_flight(self):
+        limiter = AdaptiveConcurrencyLimiter(min_limit=2, max_limit=2)
+        limiter.acquire()
+        limiter.acquire()
+
+        acquired = threading.Event()
+
+        def _acquire():
+            limiter.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=_acquire)
+        thread.start()
+        assert not acquired.wait(0.1)
+
+        limiter.release()
+        assert acquired.wait(1)
+        thread.join()
+        assert limiter.in_flight == 2
+
+
+class TestPrefetch:
+    def test_yields_everything_in_order(self):
+        assert list(prefetch(range(100), max_prefetched=3)) == list(range(100))
+
+    def test_runs_ahead_of_the_consumer(self):
+        produced = []
+        all_produced = threading.Event()
+
+        def produce():
+            for i in range(4):
+                produced.append(i)
+                yield i
+            all_produced.set()
+
+        prefetched = prefetch(produce(), max_prefetched=2)
+        assert next(prefetched) == 0
+        # With 0 consumed, 1 and 2 are buffered and 3 is waiting on a free slot
+        assert not all_produced.wait(0.2)
+        assert produced == [0, 1, 2, 3]
+
+        assert list(prefetched) == [1, 2, 3]
+        assert all_produced.is_set()
+
+    def test_errors_are_reraised_to_the_consumer(self):
+        def produce():
+            yield 1
+            raise ValueError("Failed to fetch page")
+
+        prefetched = prefetch(produce(), max_prefetched=2)
+        assert next(prefetched) == 1
+        with pytest.raises(ValueError, match="Failed to fetch page"):
+            next(prefetched)
+
+    def test_stops_when_the_consumer_does(self):
+        produced = []
+
+        def produce():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        prefetched = prefetch(produce(), max_prefetched=1, name="test-prefetch")
+        assert next(prefetched) == 0
+        prefetched.close()
+
+        for thread in threading.enumerate():
+            if thread.name.startswith("test-prefetch"):
+                thread.join(timeout=1)
+                assert not thread.is_alive()
+        assert len(produced) < 100
+
+
+class TestMergeConcurrently:
+    def test_yields_everything(self):
+        iterables = [range(i * 100, (i + 1) * 100) for i in range(5)]
+        assert sorted(
+            merge_concurrently(iterables, max_workers=3, max_buffered=10)
+        ) == list(range(500))
+
+    def test_runs_iterables_concurrently(self):
+        barrier = threading.Barrier(3, timeout=1)
+
+        def produce(i):
+            # Only gets past the barrier if all 3 iterables are being iterated at once
+            barrier.wait()
+            yield i
+
+        assert sorted(
+            merge_concurrently(
+                [produce(i) for i in range(3)], max_workers=3, max_buffered=1
+            )
+        ) == [0, 1, 2]
+
+    def test_empty(self):
+        assert list(merge_concurrently([], max_workers=3, max_buffered=1)) == []
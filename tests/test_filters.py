@@ -2,7 +2,15 @@ from dataclasses import asdict
 
 import pytest
 
-from google_photos_archiver.filters import Date, DateFilter, DateRange
+from google_photos_archiver.filters import (
+    MAX_DATE,
+    MIN_DATE,
+    Date,
+    DateFilter,
+    DateRange,
+    chunk_date_filter,
+    get_yearly_date_ranges,
+)
 from tests.conftest import test_date, test_date_filter, test_date_range
 
 
@@ -101,3 +109,38 @@ class TestDateFilter:
             DateFilter(dates=dates, date_ranges=date_ranges).get_filter()
             == expected_filter
         )
+
+
+def test_get_yearly_date_ranges():
+    assert get_yearly_date_ranges(2020, 2021) == [
+        DateRange(startDate=MIN_DATE, endDate=Date(2019, 12, 31)),
+        DateRange(startDate=Date(2020, 1, 1), endDate=Date(2020, 12, 31)),
+        DateRange(startDate=Date(2021, 1, 1), endDate=Date(2021, 12, 31)),
+        DateRange(startDate=Date(2022, 1, 1), endDate=MAX_DATE),
+    ]
+
+
+@pytest.mark.parametrize(
+    "dates,date_ranges,expected_date_filters",
+    [
+        (None, None, [DateFilter()]),
+        ([test_date()], [test_date_range()], [test_date_filter()]),
+        (
+            [Date(2021, 1, day) for day in range(1, 13)],
+            [test_date_range()] * 6,
+            [
+                DateFilter(
+                    dates=[Date(2021, 1, day) for day in range(1, 6)],
+                    date_ranges=[test_date_range()] * 5,
+                ),
+                DateFilter(
+                    dates=[Date(2021, 1, day) for day in range(6, 11)],
+                    date_ranges=[test_date_range()],
+                ),
+                DateFilter(dates=[Date(2021, 1, 11), Date(2021, 1, 12)]),
+            ],
+        ),
+    ],
+)
+def test_chunk_date_filter(dates, date_ranges, expected_date_filters):
+    assert chunk_date_filter(dates, date_ranges) == expected_date_filters
@@ -0,0 +1,109 @@
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+
+from google_photos_archiver.fsync_policy import (
+    FsyncMode,
+    FsyncPolicy,
+    fsync_directories,
+)
+
+
+@pytest.fixture()
+def _fsync_mock(mocker):
+    return mocker.patch("google_photos_archiver.fsync_policy.os.fsync")
+
+
+@pytest.fixture()
+def _test_directories(tmp_path):
+    directories = [Path(tmp_path, "a"), Path(tmp_path, "b")]
+    for directory in directories:
+        directory.mkdir()
+    return directories
+
+
+def test_fsync_directories(_fsync_mock, _test_directories):
+    fsync_directories(_test_directories + [_test_directories[0]])
+
+    # Each directory, once
+    assert _fsync_mock.call_count == 2
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError, match="Unknown fsync mode"):
+        FsyncPolicy(mode="sometimes")
+
+
+@pytest.mark.parametrize(
+    "mode,expected_fsyncs",
+    [(FsyncMode.NONE, 0), (FsyncMode.FILE, 1), (FsyncMode.BATCH, 1)],
+)
+def test_sync_file(_fsync_mock, tmp_path, mode, expected_fsyncs):
+    with Path(tmp_path, "1.jpg.part").open("wb") as f:
+        f.write(b"test")
+        FsyncPolicy(mode=mode).sync_file(f)
+
+    assert _fsync_mock.call_count == expected_fsyncs
+
+
+def test_none(_fsync_mock, _test_directories):
+    on_durable = MagicMock()
+    FsyncPolicy(mode=FsyncMode.NONE).sync(_test_directories, on_durable)
+
+    on_durable.assert_called_once()
+    _fsync_mock.assert_not_called()
+
+
+def test_file(_fsync_mock, _test_directories):
+    def on_durable():
+        assert _fsync_mock.call_count == 2
+
+    fsync_policy = FsyncPolicy(mode=FsyncMode.FILE)
+    fsync_policy.sync(_test_directories, MagicMock(side_effect=on_durable))
+    fsync_policy.sync(_test_directories[:1], MagicMock())
+
+    assert _fsync_mock.call_count == 3
+
+
+def test_batch_size(_fsync_mock, _test_directories):
+    fsync_policy = FsyncPolicy(mode=FsyncMode.BATCH, batch_size=2, batch_interval=60)
+    on_durable = MagicMock()
+
+    fsync_policy.sync(_test_directories[:1], on_durable)
+    on_durable.assert_not_called()
+    _fsync_mock.assert_not_called()
+
+    fsync_policy.sync(_test_directories[1:], on_durable)
+    assert on_durable.call_count == 2
+    assert _fsync_mock.call_count == 2
+
+
+def test_batch_interval(_fsync_mock, _test_directories):
+    clock = MagicMock(side_effect=[0.0, 0.0, 5.0])
+    fsync_policy = FsyncPolicy(
+        mode=FsyncMode.BATCH, batch_size=100, batch_interval=5, clock=clock
+    )
+    on_durable = MagicMock()
+
+    fsync_policy.sync(_test_directories[:1], on_durable)
+    on_durable.assert_not_called()
+
+    fsync_policy.sync(_test_directories[1:], on_durable)
+    assert on_durable.call_count == 2
+
+
+def test_batch_flush(_fsync_mock, _test_directories):
+    fsync_policy = FsyncPolicy(mode=FsyncMode.BATCH, batch_size=100)
+    on_durable = MagicMock()
+    # Files that were renamed into the same directory share its fsync
+    fsync_policy.sync(_test_directories[:1], on_durable)
+    fsync_policy.sync(_test_directories, on_durable)
+
+    fsync_policy.flush()
+    assert on_durable.call_count == 2
+    assert _fsync_mock.call_count == 2
+
+    # Nothing left to fsync
+    fsync_policy.flush()
+    assert _fsync_mock.call_count == 2
@@ -0,0 +1,50 @@
+from requests.adapters import HTTPAdapter
+
+from google_photos_archiver.http_session import (
+    GOOGLE_PHOTOS_API_URL,
+    MEDIA_URL_PREFIX,
+    PooledSession,
+)
+
+TEST_MEDIA_URL = "https://lh3.googleusercontent.com/abc123=d"
+
+
+def _get_pool_maxsize(adapter: HTTPAdapter) -> int:
+    return adapter.poolmanager.connection_pool_kw["maxsize"]
+
+
+class TestPooledSession:
+    def test_separate_pools_for_api_and_media(self):
+        session = PooledSession(api_pool_maxsize=3, media_pool_maxsize=7)
+
+        api_adapter = session.get_adapter(GOOGLE_PHOTOS_API_URL + "mediaItems")
+        media_adapter = session.get_adapter(TEST_MEDIA_URL)
+
+        assert api_adapter is session.adapters[GOOGLE_PHOTOS_API_URL]
+        assert media_adapter is session.adapters[MEDIA_URL_PREFIX]
+        assert _get_pool_maxsize(api_adapter) == 3
+        assert _get_pool_maxsize(media_adapter) == 7
+
+    def test_resize(self, mocker):
+        session = PooledSession()
+        previous_api_adapter = session.get_adapter(GOOGLE_PHOTOS_API_URL)
+        close_mock = mocker.patch.object(previous_api_adapter, "close")
+
+        session.resize(api_pool_maxsize=5, media_pool_maxsize=100)
+
+        close_mock.assert_called_once()
+        assert _get_pool_maxsize(session.get_adapter(GOOGLE_PHOTOS_API_URL)) == 5
+        assert _get_pool_maxsize(session.get_adapter(TEST_MEDIA_URL)) == 100
+        assert (session.api_pool_maxsize, session.media_pool_maxsize) == (5, 100)
+
+    def test_media_items_are_downloaded_with_shared_session(
+        self, mocker, test_photo_media_item
+    ):
+        session = PooledSession()
+        mock_get = mocker.patch.object(session, "get")
+
+        test_photo_media_item.get_raw_data(session=session)
+
+        mock_get.assert_called_with(
+            test_photo_media_item.downloadUrl, stream=True, timeout=mocker.ANY
+        )
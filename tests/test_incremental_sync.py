@@ -0,0 +1,109 @@
+from datetime import datetime
+
+from google_photos_archiver.album import create_album
+from google_photos_archiver.filters import MAX_DATE, Date, DateRange
+from google_photos_archiver.incremental_sync import LIBRARY_SCOPE, get_album_scope
+from google_photos_archiver.media_item import VideoProcessingStatus, create_media_item
+
+
+class TestIncrementalSync:
+    def test_no_date_range_without_saved_mark(
+        self, test_incremental_sync, test_photo_media_item
+    ):
+        list(test_incremental_sync.watch(LIBRARY_SCOPE, [test_photo_media_item]))
+
+        assert test_incremental_sync.get_date_range(LIBRARY_SCOPE) is None
+
+    def test_save_and_get_date_range(
+        self, test_incremental_sync, test_photo_media_item_dict
+    ):
+        test_photo_media_item_dict["mediaMetadata"][
+            "creationTime"
+        ] = "2021-03-01T12:00:00Z"
+        newest_media_item = create_media_item(test_photo_media_item_dict)
+
+        media_items = list(
+            test_incremental_sync.watch(LIBRARY_SCOPE, [newest_media_item])
+        )
+        test_incremental_sync.save()
+
+        assert media_items == [newest_media_item]
+        assert test_incremental_sync.get(LIBRARY_SCOPE).media_item_id == (
+            newest_media_item.id
+        )
+        assert test_incremental_sync.get_date_range(LIBRARY_SCOPE) == DateRange(
+            startDate=Date(year=2021, month=2, day=28), endDate=MAX_DATE
+        )
+
+    def test_observed_marks_outlive_close(
+        self, test_incremental_sync, test_photo_media_item
+    ):
+        list(test_incremental_sync.watch(LIBRARY_SCOPE, [test_photo_media_item]))
+        test_incremental_sync.close()
+        # Reopens a connection to save what was observed before closing
+        test_incremental_sync.save()
+
+        assert test_incremental_sync.get(LIBRARY_SCOPE).media_item_id == (
+            test_photo_media_item.id
+        )
+
+    def test_mark_never_moves_back(
+        self, test_incremental_sync, test_photo_media_item_dict, test_video_media_item
+    ):
+        test_photo_media_item_dict["mediaMetadata"][
+            "creationTime"
+        ] = "2021-03-01T12:00:00Z"
+        list(
+            test_incremental_sync.watch(
+                LIBRARY_SCOPE, [create_media_item(test_photo_media_item_dict)]
+            )
+        )
+        test_incremental_sync.save()
+
+        list(test_incremental_sync.watch(LIBRARY_SCOPE, [test_video_media_item]))
+        test_incremental_sync.save()
+
+        assert test_incremental_sync.get(LIBRARY_SCOPE).creation_time == datetime(
+            2021, 3, 1, 12
+        )
+
+    def test_media_items_still_processing_hold_back_mark(
+        self, test_incremental_sync, test_photo_media_item, test_video_media_item_dict
+    ):
+        test_video_media_item_dict["mediaMetadata"]["video"][
+            "status"
+        ] = VideoProcessingStatus.PROCESSING.value
+        test_video_media_item_dict["mediaMetadata"][
+            "creationTime"
+        ] = "2020-12-01T00:00:00Z"
+        processing_media_item = create_media_item(test_video_media_item_dict)
+
+        list(
+            test_incremental_sync.watch(
+                LIBRARY_SCOPE, [test_photo_media_item, processing_media_item]
+            )
+        )
+        test_incremental_sync.save()
+
+        assert test_incremental_sync.get(LIBRARY_SCOPE).creation_time == datetime(
+            2020, 11, 30, 23, 59, 59
+        )
+
+    def test_is_album_unchanged(
+        self, test_incremental_sync, test_album_dict, test_photo_media_item
+    ):
+        album = create_album(test_album_dict)
+        assert not test_incremental_sync.is_album_unchanged(album)
+
+        list(
+            test_incremental_sync.watch(
+                get_album_scope(album),
+                [test_photo_media_item],
+                media_items_count=album.mediaItemsCount,
+            )
+        )
+        test_incremental_sync.save()
+        assert test_incremental_sync.is_album_unchanged(album)
+
+        album.mediaItemsCount = "13"
+        assert not test_incremental_sync.is_album_unchanged(album)
@@ -0,0 +1,121 @@
+from pathlib import Path
+
+from google_photos_archiver.listing_checkpoint import ListingCheckpoint
+
+
+class TestListingCheckpoint:
+    def test_resume_without_checkpoint(self, test_listing_checkpoint):
+        assert test_listing_checkpoint.resume("scope") == (None, [])
+
+    def test_record_page_and_resume(
+        self,
+        test_listing_checkpoint,
+        test_photo_media_item_dict,
+        test_video_media_item_dict,
+    ):
+        test_listing_checkpoint.record_page(
+            "scope", [test_photo_media_item_dict], "abc123"
+        )
+        test_listing_checkpoint.record_page(
+            "scope", [test_video_media_item_dict], "def456"
+        )
+
+        page_token, pending_media_items = test_listing_checkpoint.resume("scope")
+
+        assert page_token == "def456"
+        assert [media_item["id"] for media_item in pending_media_items] == [
+            test_photo_media_item_dict["id"],
+            test_video_media_item_dict["id"],
+        ]
+        assert all("listedAt" in media_item for media_item in pending_media_items)
+        assert test_listing_checkpoint.get_progress("scope") == (2, 2)
+        assert test_listing_checkpoint.resume("other scope") == (None, [])
+
+    def test_completed_listing_resumes_pending_media_items(
+        self,
+        test_listing_checkpoint,
+        test_photo_media_item,
+        test_photo_media_item_dict,
+    ):
+        test_listing_checkpoint.record_page(
+            "scope", [test_photo_media_item_dict], "abc123"
+        )
+        test_listing_checkpoint.record_page("scope", [], None)
+
+        assert test_listing_checkpoint.get_progress("scope") is None
+        page_token, pending_media_items = test_listing_checkpoint.resume("scope")
+        assert page_token is None
+        assert [media_item["id"] for media_item in pending_media_items] == [
+            test_photo_media_item_dict["id"]
+        ]
+
+        # Forgotten about once nothing is pending anymore
+        test_listing_checkpoint.remove_pending(test_photo_media_item)
+        assert test_listing_checkpoint.resume("scope") == (None, [])
+        test_listing_checkpoint.record_page(
+            "scope", [test_photo_media_item_dict], "def456"
+        )
+        assert test_listing_checkpoint.get_progress("scope") == (1, 1)
+
+    def test_remove_pending(
+        self,
+        test_listing_checkpoint,
+        test_photo_media_item,
+        test_photo_media_item_dict,
+        test_video_media_item_dict,
+    ):
+        test_listing_checkpoint.record_page(
+            "scope", [test_photo_media_item_dict, test_video_media_item_dict], "abc123"
+        )
+        test_listing_checkpoint.remove_pending(test_photo_media_item)
+
+        _, pending_media_items = test_listing_checkpoint.resume("scope")
+
+        assert [media_item["id"] for media_item in pending_media_items] == [
+            test_video_media_item_dict["id"]
+        ]
+
+    def test_remove_pending_in_batches(
+        self,
+        tmp_path,
+        clock,
+        test_photo_media_item,
+        test_photo_media_item_dict,
+    ):
+        other_media_item = test_photo_media_item.replace(id="other")
+        media_item_dicts = [
+            test_photo_media_item_dict,
+            {**test_photo_media_item_dict, "id": other_media_item.id},
+        ]
+        listing_checkpoint = ListingCheckpoint(
+            sqlite_db_path=Path(tmp_path, "test.db"),
+            flush_interval=10,
+            flush_size=2,
+            clock=clock,
+        )
+        listing_checkpoint.record_page("scope", media_item_dicts, "abc123")
+
+        def get_pending_media_item_ids():
+            with listing_checkpoint.connection as _connection:
+                return {
+                    media_item_id
+                    for (media_item_id,) in _connection.execute(
+                        "SELECT media_item_id FROM pending_media_items"
+                    )
+                }
+
+        listing_checkpoint.remove_pending(test_photo_media_item)
+        assert len(get_pending_media_item_ids()) == 2
+
+        # Flushed once the batch is full
+        listing_checkpoint.remove_pending(other_media_item)
+        assert not get_pending_media_item_ids()
+
+        # Or once its oldest removal is due
+        listing_checkpoint.record_page("scope", media_item_dicts, "def456")
+        listing_checkpoint.remove_pending(test_photo_media_item)
+        clock.now += 10
+        listing_checkpoint.remove_pending(other_media_item)
+        assert not get_pending_media_item_ids()
+
+        listing_checkpoint.close()
@@ -83,12 +83,49 @@ class TestMediaItem:
             filename=test_video_media_item_dict_copy["filename"],
         )
 
+    def test_media_metadata_is_decoded_lazily(self, test_video_media_item_dict):
+        test_video_media_item_dict_copy = copy.deepcopy(test_video_media_item_dict)
+        video_media_item = create_media_item(
+            dict(test_video_media_item_dict, contributorInfo={"displayName": "Test"})
+        )
+
+        # Creating a MediaItem neither mutates its dict nor decodes `mediaMetadata`
+        assert test_video_media_item_dict == test_video_media_item_dict_copy
+        assert video_media_item.is_video and video_media_item.is_ready
+        assert video_media_item.creationTime.year == 2020
+        assert isinstance(
+            video_media_item._media_metadata, tuple  # pylint: disable=protected-access
+        )
+
+        assert isinstance(video_media_item.mediaMetadata, VideoMediaMetadata)
+        assert video_media_item.mediaMetadata.video.status == (
+            VideoProcessingStatus.READY.value
+        )
+
+    def test_create_media_item_missing_field(self, test_photo_media_item_dict):
+        del test_photo_media_item_dict["baseUrl"]
+
+        with pytest.raises(KeyError):
+            create_media_item(test_photo_media_item_dict)
+
+    def test_replace(self, test_photo_media_item):
+        replaced_media_item = test_photo_media_item.replace(id="other", listedAt=1.0)
+
+        assert replaced_media_item.id == "other"
+        assert replaced_media_item.listedAt == 1.0
+        assert replaced_media_item.filename == test_photo_media_item.filename
+        assert replaced_media_item != test_photo_media_item
+
     def test_download_url(self, test_photo_media_item, test_video_media_item):
         assert test_photo_media_item.downloadUrl == test_photo_media_item.baseUrl + "=d"
         assert (
             test_video_media_item.downloadUrl == test_video_media_item.baseUrl + "=dv"
         )
 
+    def test_media_item_is_video(self, test_photo_media_item, test_video_media_item):
+        assert not test_photo_media_item.is_video
+        assert test_video_media_item.is_video
+
     def test_media_item_is_ready(self, test_photo_media_item, test_video_media_item):
         assert test_photo_media_item.is_ready is True
         assert test_video_media_item.is_ready is True
@@ -109,6 +146,19 @@ class TestMediaItem:
 
         assert test_photo_media_item.get_raw_data() == mock_response_content
 
+    def test_iter_raw_data(self, mocker, test_photo_media_item):
+        mock_response_content = bytes("abc123", "utf-8")
+
+        mocker.patch(
+            "google_photos_archiver.rest_client.requests.get",
+            return_value=MockSuccessResponse(mock_response_content),
+        )
+
+        assert list(test_photo_media_item.iter_raw_data(chunk_size=4)) == [
+            bytes("abc1", "utf-8"),
+            bytes("23", "utf-8"),
+        ]
+
     def test_get_raw_data_retries_on_connection_errors(
         self, mocker, test_photo_media_item
     ):
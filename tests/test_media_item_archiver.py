@@ -1,17 +1,40 @@
+import hashlib
+import os
+import threading
 from pathlib import Path
 from typing import List
 
 import pytest
+import requests
 
-from google_photos_archiver.archivers import DiskArchiver
-from google_photos_archiver.media_item import MediaItem
+from google_photos_archiver import archivers
+from google_photos_archiver.archivers import (
+    BLOBS_DIRECTORY,
+    DiskArchiver,
+    get_blob_path,
+    get_part_path,
+    get_segment_ranges,
+    get_segmented_part_path,
+    link_into_album,
+)
+from google_photos_archiver.base_url_refresher import BaseUrlRefresher
+from google_photos_archiver.concurrency import AdaptiveConcurrencyLimiter
+from google_photos_archiver.fsync_policy import FsyncMode, FsyncPolicy
+from google_photos_archiver.media_item import (
+    DOWNLOAD_CONNECT_TIMEOUT_SECONDS,
+    DOWNLOAD_READ_TIMEOUT_SECONDS,
+    MediaItem,
+)
 from google_photos_archiver.media_item_archiver import (
     MediaItemArchiver,
     get_new_media_item_archivals,
 )
-from tests.conftest import MockSuccessResponse
+from google_photos_archiver.rate_limiter import RateLimiter
+from google_photos_archiver.retry import RetryPolicy
+from tests.conftest import MockFailureResponse, MockSuccessResponse
 
 TEST_MEDIA_CONTENT = bytes("I'm a test photo or a video!", "utf-8")
+DOWNLOAD_TIMEOUT = (DOWNLOAD_CONNECT_TIMEOUT_SECONDS, DOWNLOAD_READ_TIMEOUT_SECONDS)
 
 
 @pytest.fixture()
@@ -51,6 +74,12 @@ class TestMediaItemArchiver:
 
         for media_item in _test_media_items:
             assert test_media_item_recorder.lookup(media_item) is True
+            recorded_media_item = test_media_item_recorder.get(media_item.id)
+            assert recorded_media_item.size == len(TEST_MEDIA_CONTENT)
+            assert (
+                recorded_media_item.sha256
+                == hashlib.sha256(TEST_MEDIA_CONTENT).hexdigest()
+            )
             media_item_path = media_item.get_download_path(tmp_path)
             with media_item_path.open("rb") as f:
                 assert f.read() == TEST_MEDIA_CONTENT
@@ -61,6 +90,685 @@ class TestMediaItemArchiver:
                 assert media_item_path_in_album.resolve() == media_item_path.resolve()
 
 
+def test_disk_archiver_skips_recorded_media_items_without_touching_disk(
+    mocker, test_photo_media_item, test_media_item_recorder, tmp_path
+):
+    disk_archiver = DiskArchiver(
+        base_download_path=tmp_path, recorder=test_media_item_recorder
+    )
+    test_media_item_recorder.add(test_photo_media_item)
+    get_download_path_spy = mocker.spy(MediaItem, "get_download_path")
+    exists_spy = mocker.spy(Path, "exists")
+
+    assert disk_archiver.archive(test_photo_media_item) is False
+    get_download_path_spy.assert_not_called()
+    exists_spy.assert_not_called()
+
+
+def test_disk_archiver_hashes_while_writing(
+    mocker, _test_media_items, test_media_item_recorder, tmp_path
+):
+    update_sha256_spy = mocker.spy(archivers, "update_sha256")
+    disk_archiver = DiskArchiver(
+        base_download_path=tmp_path, recorder=test_media_item_recorder, chunk_size=4
+    )
+
+    for media_item in _test_media_items:
+        assert disk_archiver.archive(media_item) is True
+        assert test_media_item_recorder.get(media_item.id).sha256 == (
+            hashlib.sha256(TEST_MEDIA_CONTENT).hexdigest()
+        )
+
+    # Nothing had to be read back
+    update_sha256_spy.assert_not_called()
+
+
+def test_disk_archiver_links_into_albums(
+    test_photo_media_item, test_video_media_item, test_media_item_recorder, tmp_path
+):
+    disk_archiver = DiskArchiver(
+        base_download_path=tmp_path, recorder=test_media_item_recorder
+    )
+    first_album_path = Path(tmp_path, "albums", "first")
+    second_album_path = Path(tmp_path, "albums", "second")
+    album_media_items = {
+        first_album_path: [test_photo_media_item, test_video_media_item],
+        second_album_path: [test_photo_media_item],
+    }
+
+    assert disk_archiver.link_into_albums(album_media_items) == 3
+    # Existing symlinks are left alone
+    assert disk_archiver.link_into_albums(album_media_items) == 0
+
+    for album_path, media_items in album_media_items.items():
+        for media_item in media_items:
+            media_item_path_in_album = Path(album_path, media_item.filename)
+            assert media_item_path_in_album.is_symlink()
+            assert media_item_path_in_album.resolve() == (
+                media_item.get_download_path(tmp_path).resolve()
+            )
+
+
+def test_link_into_album_repair(tmp_path):
+    album_path = Path(tmp_path, "albums", "album")
+    kept, moved, removed = (
+        Path(tmp_path, name) for name in ("a.jpg", "b.jpg", "c.jpg")
+    )
+    link_into_album(album_path, [kept, Path(tmp_path, "old", "b.jpg"), removed])
+    Path(album_path, "notes.txt").write_text("Not a symlink")
+
+    assert link_into_album(album_path, [kept, moved], repair=True) == 1
+
+    assert sorted(path.name for path in album_path.iterdir()) == [
+        "a.jpg",
+        "b.jpg",
+        "notes.txt",
+    ]
+    assert Path(album_path, "b.jpg").resolve() == moved.resolve()
+
+
+def test_album_symlinks_are_relative(
+    mocker, test_photo_media_item, test_media_item_recorder, tmp_path
+):
+    mocker.patch(
+        "google_photos_archiver.rest_client.requests.get",
+        return_value=MockSuccessResponse(TEST_MEDIA_CONTENT),
+    )
+    disk_archiver = DiskArchiver(
+        base_download_path=tmp_path, recorder=test_media_item_recorder
+    )
+    media_item_path = test_photo_media_item.get_download_path(tmp_path)
+    archived_album_path = Path(tmp_path, "albums", "archived")
+    linked_album_path = Path(tmp_path, "albums", "linked")
+    expected_target = os.path.join(
+        "..", "..", str(test_photo_media_item.get_relative_download_path())
+    )
+
+    disk_archiver.archive(test_photo_media_item, archived_album_path)
+    link_into_album(linked_album_path, [media_item_path])
+    # Absolute symlinks get replaced when repairing
+    Path(linked_album_path, "other.jpg").symlink_to(media_item_path.absolute())
+    link_into_album(
+        linked_album_path,
+        [media_item_path, media_item_path.with_name("other.jpg")],
+        repair=True,
+    )
+
+    for symlink in (
+        Path(archived_album_path, media_item_path.name),
+        Path(linked_album_path, media_item_path.name),
+    ):
+        assert os.readlink(symlink) == expected_target
+        assert symlink.resolve() == media_item_path.resolve()
+    assert not os.path.isabs(os.readlink(Path(linked_album_path, "other.jpg")))
+
+
+def test_disk_archiver_streams_in_chunks(
+    _test_media_items, test_media_item_recorder, tmp_path
+):
+    disk_archiver = DiskArchiver(
+        base_download_path=tmp_path, recorder=test_media_item_recorder, chunk_size=4
+    )
+
+    for media_item in _test_media_items:
+        assert disk_archiver.archive(media_item) is True
+        with media_item.get_download_path(tmp_path).open("rb") as f:
+            assert f.read() == TEST_MEDIA_CONTENT
+
+    assert disk_archiver.bytes_written == len(TEST_MEDIA_CONTENT) * 2
+
+
+def test_disk_archiver_content_addressed(
+    mocker, test_photo_media_item, test_media_item_recorder, tmp_path
+):
+    other_content = bytes("I'm a different photo!", "utf-8")
+    mocker.patch(
+        "google_photos_archiver.rest_client.requests.get",
+        side_effect=[
+            MockSuccessResponse(TEST_MEDIA_CONTENT),
+            MockSuccessResponse(TEST_MEDIA_CONTENT),
+            MockSuccessResponse(other_content),
+        ],
+    )
+    media_items = [
+        test_photo_media_item.replace(id=str(i), filename=f"{i}.jpg") for i in range(3)
+    ]
+    disk_archiver = DiskArchiver(
+        base_download_path=tmp_path,
+        recorder=test_media_item_recorder,
+        content_addressed=True,
+    )
+
+    for media_item in media_items:
+        assert disk_archiver.archive(media_item) is True
+
+    sha256 = hashlib.sha256(TEST_MEDIA_CONTENT).hexdigest()
+    blob_path = get_blob_path(tmp_path, sha256)
+    first_path, second_path, third_path = (
+        media_item.get_download_path(tmp_path) for media_item in media_items
+    )
+    assert first_path.samefile(blob_path)
+    assert second_path.samefile(blob_path)
+    assert third_path.samefile(
+        get_blob_path(tmp_path, hashlib.sha256(other_content).hexdigest())
+    )
+    assert second_path.read_bytes() == TEST_MEDIA_CONTENT
+    assert len(list(Path(tmp_path, BLOBS_DIRECTORY).glob("*/*"))) == 2
+    assert test_media_item_recorder.get_media_item_ids(sha256) == ["0", "1"]
+
+
+def test_disk_archiver_keeps_copies_without_hardlinks(
+    mocker, test_photo_media_item, test_media_item_recorder, tmp_path
+):
+    mocker.patch(
+        "google_photos_archiver.rest_client.requests.get",
+        side_effect=[
+            MockSuccessResponse(TEST_MEDIA_CONTENT),
+            MockSuccessResponse(TEST_MEDIA_CONTENT),
+        ],
+    )
+    mocker.patch("os.link", side_effect=PermissionError("Operation not permitted"))
+    disk_archiver = DiskArchiver(
+        base_download_path=tmp_path,
+        recorder=test_media_item_recorder,
+        content_addressed=True,
+    )
+
+    for i in range(2):
+        media_item = test_photo_media_item.replace(id=str(i), filename=f"{i}.jpg")
+        assert disk_archiver.archive(media_item) is True
+        assert media_item.get_download_path(tmp_path).read_bytes() == (
+            TEST_MEDIA_CONTENT
+        )
+
+
+def test_disk_archiver_records_once_fsynced(
+    mocker, _test_media_items, test_media_item_recorder, tmp_path
+):
+    events = []
+    fsync_mock = mocker.patch(
+        "google_photos_archiver.fsync_policy.os.fsync",
+        side_effect=lambda fd: events.append("fsync"),
+    )
+    replace = Path.replace
+    mocker.patch.object(
+        Path,
+        "replace",
+        lambda path, target: events.append("replace") or replace(path, target),
+    )
+    disk_archiver = DiskArchiver(
+        base_download_path=tmp_path,
+        recorder=test_media_item_recorder,
+        fsync_policy=FsyncPolicy(mode=FsyncMode.BATCH, batch_size=100),
+    )
+
+    for media_item in _test_media_items:
+        assert disk_archiver.archive(media_item) is True
+        assert test_media_item_recorder.lookup(media_item) is False
+    # Each `.part` file is fsynced before it's renamed into place
+    assert events == ["fsync", "replace"] * 2
+
+    disk_archiver.close()
+    # Only the directory that both files share is left to the batch
+    assert fsync_mock.call_count == 3
+    for media_item in _test_media_items:
+        assert test_media_item_recorder.lookup(media_item) is True
+
+
+def test_disk_archiver_rate_limits_media_bytes(
+    mocker, _test_media_items, test_media_item_recorder, tmp_path
+):
+    rate_limiter = RateLimiter(media_bytes_per_second=1024)
+    acquire_mock = mocker.patch.object(rate_limiter, "acquire_media_bytes")
+    disk_archiver = DiskArchiver(
+        base_download_path=tmp_path,
+        recorder=test_media_item_recorder,
+        chunk_size=4,
+        rate_limiter=rate_limiter,
+    )
+
+    disk_archiver.archive(_test_media_items[0])
+
+    assert sum(call.args[0] for call in acquire_mock.call_args_list) == len(
+        TEST_MEDIA_CONTENT
+    )
+
+
+def test_videos_are_archived_by_their_own_workers(
+    mocker, test_photo_media_item, test_video_media_item
+):
+    archiving_threads = {}
+    archiver = mocker.Mock()
+    archiver.archive.side_effect = lambda media_item, *_: archiving_threads.setdefault(
+        media_item.id, threading.current_thread().name
+    )
+    media_item_archiver = MediaItemArchiver(
+        archiver=archiver, max_threadpool_workers=1, max_video_workers=1
+    )
+
+    list(media_item_archiver.start([test_photo_media_item, test_video_media_item]))
+
+    assert not archiving_threads[test_photo_media_item.id].startswith("video")
+    assert archiving_threads[test_video_media_item.id].startswith("video")
+
+
+def test_stale_base_urls_are_refreshed_before_archiving(
+    mocker, _test_media_items, test_media_item_recorder, tmp_path
+):
+    base_url_refresher = BaseUrlRefresher(mocker.Mock(), max_base_url_age=0)
+    refresh_mock = mocker.patch.object(base_url_refresher, "_refresh")
+    media_item_archiver = MediaItemArchiver(
+        archiver=DiskArchiver(
+            base_download_path=tmp_path, recorder=test_media_item_recorder
+        ),
+        max_threadpool_workers=1,
+        base_url_refresher=base_url_refresher,
+    )
+
+    assert (
+        get_new_media_item_archivals(media_item_archiver.start(_test_media_items)) == 2
+    )
+
+    # Every MediaItem is refreshed right before it gets archived
+    assert [call.args[0][0] for call in refresh_mock.call_args_list] == (
+        _test_media_items
+    )
+
+
+def test_skipped_base_urls_are_not_refreshed(
+    mocker, test_photo_media_item, test_video_media_item, test_media_item_recorder
+):
+    base_url_refresher = BaseUrlRefresher(mocker.Mock(), max_base_url_age=0)
+    refresh_mock = mocker.patch.object(base_url_refresher, "_refresh")
+    archiver = mocker.Mock(recorder=test_media_item_recorder)
+    archiver.archive.return_value = False
+    test_media_item_recorder.add(test_photo_media_item)
+    # The video is still being processed
+    mocker.patch.object(
+        MediaItem, "is_ready", property(lambda media_item: not media_item.is_video)
+    )
+    media_item_archiver = MediaItemArchiver(
+        archiver=archiver,
+        max_threadpool_workers=1,
+        base_url_refresher=base_url_refresher,
+    )
+
+    list(media_item_archiver.start([test_photo_media_item, test_video_media_item]))
+
+    # Neither the unready nor the recorded MediaItem is left pending either
+    refresh_mock.assert_not_called()
+    assert not base_url_refresher._pending  # pylint: disable=protected-access
+
+
+def test_unready_media_items_are_removed_from_listing_checkpoint(
+    mocker, test_video_media_item
+):
+    listing_checkpoint = mocker.Mock()
+    mocker.patch.object(MediaItem, "is_ready", False)
+    media_item_archiver = MediaItemArchiver(
+        archiver=mocker.Mock(),
+        max_threadpool_workers=1,
+        listing_checkpoint=listing_checkpoint,
+    )
+
+    assert (
+        get_new_media_item_archivals(media_item_archiver.start([test_video_media_item]))
+        == 0
+    )
+    listing_checkpoint.remove_pending.assert_called_once_with(test_video_media_item)
+
+
+def test_archived_media_items_are_removed_from_listing_checkpoint_once_recorded(
+    mocker, _test_media_items, test_media_item_recorder, tmp_path
+):
+    listing_checkpoint = mocker.Mock()
+    media_item_archiver = MediaItemArchiver(
+        archiver=DiskArchiver(
+            base_download_path=tmp_path,
+            recorder=test_media_item_recorder,
+            fsync_policy=FsyncPolicy(mode=FsyncMode.BATCH, batch_size=100),
+        ),
+        max_threadpool_workers=1,
+        listing_checkpoint=listing_checkpoint,
+    )
+
+    assert (
+        get_new_media_item_archivals(media_item_archiver.start(_test_media_items)) == 2
+    )
+    # Neither is durable yet, so both have to stay pending
+    listing_checkpoint.remove_pending.assert_not_called()
+
+    media_item_archiver.archiver.close()
+    assert listing_checkpoint.remove_pending.call_args_list == [
+        mocker.call(media_item) for media_item in _test_media_items
+    ]
+
+
+class TestAdaptiveConcurrency:
+    def test_throttling_is_reported_to_limiter(
+        self, mocker, test_photo_media_item, test_media_item_recorder, tmp_path
+    ):
+        sleep_mock = mocker.patch("google_photos_archiver.retry.time.sleep")
+        throttled_response = MockFailureResponse(status_code=429)
+        throttled_response.headers["Retry-After"] = "7"
+        mocker.patch(
+            "requests.get",
+            side_effect=[throttled_response, MockSuccessResponse(TEST_MEDIA_CONTENT)],
+        )
+        concurrency_limiter = AdaptiveConcurrencyLimiter(min_limit=1, max_limit=4)
+        record_throttled_mock = mocker.patch.object(
+            concurrency_limiter, "record_throttled"
+        )
+        record_success_mock = mocker.spy(concurrency_limiter, "record_success")
+
+        completed_media_item_archivals = MediaItemArchiver(
+            archiver=DiskArchiver(
+                base_download_path=tmp_path,
+                recorder=test_media_item_recorder,
+                retry_policy=RetryPolicy(on_throttled=record_throttled_mock),
+            ),
+            concurrency_limiter=concurrency_limiter,
+        ).start([test_photo_media_item])
+
+        assert get_new_media_item_archivals(completed_media_item_archivals) == 1
+        record_throttled_mock.assert_called_once_with(7.0)
+        sleep_mock.assert_called_once_with(7.0)
+        record_success_mock.assert_called_once()
+        assert concurrency_limiter.in_flight == 0
+
+    def test_errors_are_reported_to_limiter(
+        self, mocker, test_photo_media_item, test_media_item_recorder, tmp_path
+    ):
+        mocker.patch("requests.get", return_value=MockFailureResponse(status_code=404))
+        concurrency_limiter = AdaptiveConcurrencyLimiter(min_limit=1, max_limit=4)
+        record_error_mock = mocker.spy(concurrency_limiter, "record_error")
+
+        completed_media_item_archivals = MediaItemArchiver(
+            archiver=DiskArchiver(
+                base_download_path=tmp_path, recorder=test_media_item_recorder
+            ),
+            concurrency_limiter=concurrency_limiter,
+        ).start([test_photo_media_item])
+
+        with pytest.raises(requests.HTTPError):
+            get_new_media_item_archivals(completed_media_item_archivals)
+        record_error_mock.assert_called_once()
+
+
+class TestRequeueingRetries:
+    @pytest.fixture()
+    def retry_policy(self) -> RetryPolicy:
+        return RetryPolicy(max_attempts=3, base_delay=0)
+
+    def _start(self, retry_policy, media_items, recorder, tmp_path):
+        return MediaItemArchiver(
+            archiver=DiskArchiver(
+                base_download_path=tmp_path,
+                recorder=recorder,
+                retry_policy=retry_policy.without_retries(),
+            ),
+            retry_policy=retry_policy,
+        ).start(media_items)
+
+    def test_retryable_failures_are_requeued(
+        self,
+        mocker,
+        retry_policy,
+        test_photo_media_item,
+        test_media_item_recorder,
+        tmp_path,
+    ):
+        sleep_mock = mocker.patch("google_photos_archiver.retry.time.sleep")
+        mock_get = mocker.patch(
+            "requests.get",
+            side_effect=[
+                MockFailureResponse(status_code=503),
+                requests.ConnectionError(),
+                MockSuccessResponse(TEST_MEDIA_CONTENT),
+            ],
+        )
+
+        completed_media_item_archivals = self._start(
+            retry_policy, [test_photo_media_item], test_media_item_recorder, tmp_path
+        )
+
+        assert get_new_media_item_archivals(completed_media_item_archivals) == 1
+        assert mock_get.call_count == 3
+        sleep_mock.assert_not_called()
+        assert retry_policy.stats.retries == {"archive": 2}
+
+    def test_gives_up_after_too_many_attempts(
+        self,
+        mocker,
+        retry_policy,
+        test_photo_media_item,
+        test_media_item_recorder,
+        tmp_path,
+    ):
+        mocker.patch("requests.get", return_value=MockFailureResponse(status_code=503))
+
+        completed_media_item_archivals = self._start(
+            retry_policy, [test_photo_media_item], test_media_item_recorder, tmp_path
+        )
+
+        with pytest.raises(requests.HTTPError):
+            get_new_media_item_archivals(completed_media_item_archivals)
+        assert retry_policy.stats.failures == {"archive": 1}
+
+    def test_non_retryable_failures_are_not_requeued(
+        self,
+        mocker,
+        retry_policy,
+        test_photo_media_item,
+        test_media_item_recorder,
+        tmp_path,
+    ):
+        mock_get = mocker.patch(
+            "requests.get", return_value=MockFailureResponse(status_code=404)
+        )
+
+        completed_media_item_archivals = self._start(
+            retry_policy, [test_photo_media_item], test_media_item_recorder, tmp_path
+        )
+
+        with pytest.raises(requests.HTTPError):
+            get_new_media_item_archivals(completed_media_item_archivals)
+        mock_get.assert_called_once()
+
+
+class TestResumablePartialDownloads:
+    @pytest.fixture()
+    def disk_archiver(self, tmp_path, test_media_item_recorder) -> DiskArchiver:
+        return DiskArchiver(
+            base_download_path=tmp_path, recorder=test_media_item_recorder
+        )
+
+    @pytest.fixture()
+    def part_path(self, tmp_path, test_photo_media_item) -> Path:
+        _part_path = get_part_path(test_photo_media_item.get_download_path(tmp_path))
+        with _part_path.open("wb") as f:
+            f.write(TEST_MEDIA_CONTENT[:10])
+        return _part_path
+
+    @staticmethod
+    def _assert_archived(disk_archiver, media_item, tmp_path, part_path):
+        assert not part_path.exists()
+        with media_item.get_download_path(tmp_path).open("rb") as f:
+            assert f.read() == TEST_MEDIA_CONTENT
+
+        # The checksum covers what the `.part` file held before resuming, too
+        recorded_media_item = disk_archiver.recorder.get(media_item.id)
+        assert recorded_media_item.size == len(TEST_MEDIA_CONTENT)
+        assert (
+            recorded_media_item.sha256 == hashlib.sha256(TEST_MEDIA_CONTENT).hexdigest()
+        )
+
+    def test_resumes_with_range_request(
+        self, mocker, disk_archiver, part_path, test_photo_media_item, tmp_path
+    ):
+        mock_get = mocker.patch(
+            "requests.get",
+            return_value=MockSuccessResponse(TEST_MEDIA_CONTENT[10:], status_code=206),
+        )
+
+        assert disk_archiver.archive(test_photo_media_item) is True
+
+        mock_get.assert_called_with(
+            test_photo_media_item.downloadUrl,
+            stream=True,
+            timeout=DOWNLOAD_TIMEOUT,
+            headers={"Range": "bytes=10-"},
+        )
+        assert disk_archiver.bytes_written == len(TEST_MEDIA_CONTENT) - 10
+        self._assert_archived(disk_archiver, test_photo_media_item, tmp_path, part_path)
+
+    def test_restarts_when_range_is_ignored(
+        self, mocker, disk_archiver, part_path, test_photo_media_item, tmp_path
+    ):
+        mocker.patch(
+            "requests.get", return_value=MockSuccessResponse(TEST_MEDIA_CONTENT)
+        )
+
+        assert disk_archiver.archive(test_photo_media_item) is True
+
+        self._assert_archived(disk_archiver, test_photo_media_item, tmp_path, part_path)
+
+    def test_completes_already_downloaded_part(
+        self, mocker, disk_archiver, part_path, test_photo_media_item, tmp_path
+    ):
+        with part_path.open("ab") as f:
+            f.write(TEST_MEDIA_CONTENT[10:])
+
+        range_not_satisfiable = MockFailureResponse(status_code=416)
+        range_not_satisfiable.headers["Content-Range"] = (
+            f"bytes */{len(TEST_MEDIA_CONTENT)}"
+        )
+        mocker.patch("requests.get", return_value=range_not_satisfiable)
+
+        assert disk_archiver.archive(test_photo_media_item) is True
+
+        assert disk_archiver.bytes_written == 0
+        self._assert_archived(disk_archiver, test_photo_media_item, tmp_path, part_path)
+
+    def test_discards_unusable_part(
+        self, mocker, disk_archiver, part_path, test_photo_media_item, tmp_path
+    ):
+        range_not_satisfiable = MockFailureResponse(status_code=416)
+        range_not_satisfiable.headers["Content-Range"] = "bytes */5"
+        mock_get = mocker.patch(
+            "requests.get",
+            side_effect=[
+                range_not_satisfiable,
+                MockSuccessResponse(TEST_MEDIA_CONTENT),
+            ],
+        )
+
+        assert disk_archiver.archive(test_photo_media_item) is True
+
+        mock_get.assert_called_with(
+            test_photo_media_item.downloadUrl, stream=True, timeout=DOWNLOAD_TIMEOUT
+        )
+        self._assert_archived(disk_archiver, test_photo_media_item, tmp_path, part_path)
+
+
+def _ranged_get(content: bytes, honor_range: bool = True):
+    def get(_url, stream, timeout, headers=None):
+        assert stream
+        assert timeout == DOWNLOAD_TIMEOUT
+        range_header = (headers or {}).get("Range")
+        if range_header is None or not honor_range:
+            response = MockSuccessResponse(content)
+            response.headers["Content-Length"] = str(len(content))
+            return response
+
+        start, end = range_header[len("bytes=") :].split("-")
+        start, end = int(start), len(content) - 1 if end == "" else int(end)
+        response = MockSuccessResponse(content[start : end + 1], status_code=206)
+        response.headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+        return response
+
+    return get
+
+
+@pytest.mark.parametrize(
+    "size, segments, expected_result",
+    [
+        (10, 3, [(0, 3), (4, 7), (8, 9)]),
+        (12, 4, [(0, 2), (3, 5), (6, 8), (9, 11)]),
+        (2, 4, [(0, 0), (1, 1)]),
+    ],
+)
+def test_get_segment_ranges(size, segments, expected_result):
+    assert get_segment_ranges(size, segments) == expected_result
+
+
+class TestSegmentedDownloads:
+    @pytest.fixture()
+    def disk_archiver(self, tmp_path, test_media_item_recorder) -> DiskArchiver:
+        return DiskArchiver(
+            base_download_path=tmp_path,
+            recorder=test_media_item_recorder,
+            chunk_size=3,
+            segment_threshold=len(TEST_MEDIA_CONTENT),
+            download_segments=4,
+        )
+
+    @staticmethod
+    def _assert_archived(disk_archiver, media_item, tmp_path):
+        media_item_path = media_item.get_download_path(tmp_path)
+        assert not get_segmented_part_path(media_item_path).exists()
+        with media_item_path.open("rb") as f:
+            assert f.read() == TEST_MEDIA_CONTENT
+        assert disk_archiver.recorder.get(media_item.id).sha256 == (
+            hashlib.sha256(TEST_MEDIA_CONTENT).hexdigest()
+        )
+
+    def test_large_media_items_are_segmented(
+        self, mocker, disk_archiver, test_photo_media_item, tmp_path
+    ):
+        mock_get = mocker.patch(
+            "requests.get", side_effect=_ranged_get(TEST_MEDIA_CONTENT)
+        )
+
+        assert disk_archiver.archive(test_photo_media_item) is True
+
+        assert sorted(
+            call.kwargs["headers"]["Range"]
+            for call in mock_get.call_args_list
+            if "headers" in call.kwargs
+        ) == ["bytes=14-20", "bytes=21-27", "bytes=7-13"]
+        assert disk_archiver.bytes_written == len(TEST_MEDIA_CONTENT)
+        self._assert_archived(disk_archiver, test_photo_media_item, tmp_path)
+
+    def test_small_media_items_are_not_segmented(
+        self, mocker, disk_archiver, test_photo_media_item, tmp_path
+    ):
+        disk_archiver.segment_threshold = len(TEST_MEDIA_CONTENT) + 1
+        mock_get = mocker.patch(
+            "requests.get", side_effect=_ranged_get(TEST_MEDIA_CONTENT)
+        )
+
+        assert disk_archiver.archive(test_photo_media_item) is True
+
+        mock_get.assert_called_once_with(
+            test_photo_media_item.downloadUrl, stream=True, timeout=DOWNLOAD_TIMEOUT
+        )
+        self._assert_archived(disk_archiver, test_photo_media_item, tmp_path)
+
+    def test_falls_back_when_ranges_are_ignored(
+        self, mocker, disk_archiver, test_photo_media_item, tmp_path
+    ):
+        mocker.patch(
+            "requests.get",
+            side_effect=_ranged_get(TEST_MEDIA_CONTENT, honor_range=False),
+        )
+
+        assert disk_archiver.archive(test_photo_media_item) is True
+
+        assert disk_archiver.bytes_written == len(TEST_MEDIA_CONTENT)
+        self._assert_archived(disk_archiver, test_photo_media_item, tmp_path)
+
+
 def test_get_new_media_item_archivals(
     _test_media_items,
     test_media_item_recorder,
@@ -1,5 +1,227 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+from google_photos_archiver.media_item_recorder import (
+    MediaItemRecorder,
+    RecordedMediaItem,
+    RecordedStats,
+)
+from tests.conftest import (
+    TEST_CAMERA_MAKE,
+    TEST_CAMERA_MODEL,
+    TEST_CREATION_TIME,
+    TEST_HEIGHT,
+    TEST_ID_PHOTO,
+    TEST_PHOTO_FILENAME,
+    TEST_PHOTO_MIMETYPE,
+    TEST_WIDTH,
+)
+
+
+def _count_recorded(sqlite_db_path: Path) -> int:
+    with sqlite3.connect(sqlite_db_path) as connection:
+        return connection.execute("SELECT COUNT(*) FROM media_items").fetchone()[0]
+
+
 class TestMediaItemRecorder:
     def test_add_and_lookup(self, test_media_item_recorder, test_photo_media_item):
         assert test_media_item_recorder.lookup(test_photo_media_item) is False
         test_media_item_recorder.add(test_photo_media_item)
         assert test_media_item_recorder.lookup(test_photo_media_item) is True
+
+    def test_add_and_get(self, mocker, test_media_item_recorder, test_photo_media_item):
+        mocker.patch(
+            "google_photos_archiver.media_item_recorder.datetime"
+        ).now.return_value.strftime.return_value = "2021-01-01T00:00:00Z"
+        test_media_item_recorder.add(test_photo_media_item, size=123, sha256="abc")
+
+        assert test_media_item_recorder.get(TEST_ID_PHOTO) == RecordedMediaItem(
+            id=TEST_ID_PHOTO,
+            filename=TEST_PHOTO_FILENAME,
+            relative_path=Path("2020", "12", "22", TEST_PHOTO_FILENAME),
+            mime_type=TEST_PHOTO_MIMETYPE,
+            creation_time=TEST_CREATION_TIME,
+            width=int(TEST_WIDTH),
+            height=int(TEST_HEIGHT),
+            camera_make=TEST_CAMERA_MAKE,
+            camera_model=TEST_CAMERA_MODEL,
+            size=123,
+            sha256="abc",
+            archived_at="2021-01-01T00:00:00Z",
+        )
+        assert test_media_item_recorder.get("unknown") is None
+
+    def test_get_stats(
+        self, test_media_item_recorder, test_photo_media_item, test_video_media_item
+    ):
+        assert test_media_item_recorder.get_stats() == RecordedStats(
+            media_items=0, size=0
+        )
+
+        test_media_item_recorder.add(test_photo_media_item, size=100)
+        test_media_item_recorder.add(test_video_media_item, size=23)
+        assert test_media_item_recorder.get_stats() == RecordedStats(
+            media_items=2, size=123
+        )
+
+    def test_get_media_item_ids(
+        self, test_media_item_recorder, test_photo_media_item, test_video_media_item
+    ):
+        test_media_item_recorder.add(test_photo_media_item, sha256="abc")
+        test_media_item_recorder.add(test_video_media_item, sha256="abc")
+        test_media_item_recorder.add(test_photo_media_item.replace(id="other"))
+
+        assert test_media_item_recorder.get_media_item_ids("abc") == sorted(
+            [test_photo_media_item.id, test_video_media_item.id]
+        )
+
+    def test_migrates_single_column_schema(self, tmp_path, test_photo_media_item):
+        sqlite_db_path = Path(tmp_path, "test.db")
+        with sqlite3.connect(sqlite_db_path) as connection:
+            connection.execute(
+                "CREATE TABLE media_items (media_item_id varchar unique primary key)"
+            )
+            connection.execute(
+                "INSERT INTO media_items(media_item_id) values (?)", (TEST_ID_PHOTO,)
+            )
+
+        recorder = MediaItemRecorder(sqlite_db_path)
+        assert recorder.lookup(test_photo_media_item) is True
+        assert recorder.get(TEST_ID_PHOTO) == RecordedMediaItem(
+            TEST_ID_PHOTO, *[None] * 11
+        )
+
+        recorder.add(test_photo_media_item, size=123)
+        assert recorder.get(TEST_ID_PHOTO).size == 123
+        recorder.close()
+
+    def test_lookup_preloads_recorded_ids(
+        self, tmp_path, test_photo_media_item, test_video_media_item
+    ):
+        sqlite_db_path = Path(tmp_path, "test.db")
+        recorder = MediaItemRecorder(sqlite_db_path)
+        recorder.add(test_photo_media_item)
+        recorder.close()
+
+        recorder = MediaItemRecorder(sqlite_db_path)
+        assert recorder.lookup(test_photo_media_item) is True
+        assert recorder.lookup(test_video_media_item) is False
+        recorder.close()
+
+    def test_wal_mode(self, test_media_item_recorder):
+        assert (
+            test_media_item_recorder.connection.execute(
+                "PRAGMA journal_mode"
+            ).fetchone()[0]
+            == "wal"
+        )
+
+    def test_connection_per_thread(self, test_media_item_recorder):
+        def get_connections() -> List[sqlite3.Connection]:
+            return [test_media_item_recorder.connection for _ in range(2)]
+
+        other_thread_connections = []
+        thread = threading.Thread(
+            target=lambda: other_thread_connections.extend(get_connections())
+        )
+        thread.start()
+        thread.join()
+        connections = get_connections()
+
+        # Reused within a thread, but not shared across threads
+        assert connections[0] is connections[1]
+        assert other_thread_connections[0] is other_thread_connections[1]
+        assert connections[0] is not other_thread_connections[0]
+
+    def test_add_is_batched(
+        self, tmp_path, test_photo_media_item, test_video_media_item
+    ):
+        sqlite_db_path = Path(tmp_path, "test.db")
+        recorder = MediaItemRecorder(sqlite_db_path, flush_interval=60, flush_size=10)
+
+        recorder.add(test_photo_media_item)
+        recorder.add(test_video_media_item)
+        # Queued up, rather than committed right away
+        assert recorder.lookup(test_video_media_item) is True
+        assert _count_recorded(sqlite_db_path) == 0
+
+        recorder.flush()
+        assert _count_recorded(sqlite_db_path) == 2
+        assert recorder.lookup(test_video_media_item) is True
+
+        recorder.close()
+
+    def test_on_recorded_is_called_once_committed(
+        self, tmp_path, test_photo_media_item
+    ):
+        sqlite_db_path = Path(tmp_path, "test.db")
+        recorder = MediaItemRecorder(sqlite_db_path, flush_interval=60)
+        recorded_counts = []
+
+        recorder.add(
+            test_photo_media_item,
+            on_recorded=lambda: recorded_counts.append(_count_recorded(sqlite_db_path)),
+        )
+        assert not recorded_counts
+
+        recorder.flush()
+        assert recorded_counts == [1]
+
+        recorder.close()
+
+    def test_add_flushes_once_flush_size_is_reached(
+        self, tmp_path, test_photo_media_item
+    ):
+        sqlite_db_path = Path(tmp_path, "test.db")
+        recorder = MediaItemRecorder(sqlite_db_path, flush_interval=60, flush_size=3)
+
+        for i in range(3):
+            recorder.add(test_photo_media_item.replace(id=str(i)))
+
+        # The writer commits a full batch without waiting for the flush interval
+        deadline = time.monotonic() + 5
+        while _count_recorded(sqlite_db_path) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert _count_recorded(sqlite_db_path) == 3
+
+        recorder.close()
+
+    def test_concurrent_adds(self, test_media_item_recorder, test_photo_media_item):
+        def add(start: int):
+            for i in range(start, start + 100):
+                test_media_item_recorder.add(test_photo_media_item.replace(id=str(i)))
+
+        threads = [threading.Thread(target=add, args=(i * 100,)) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        test_media_item_recorder.flush()
+
+        assert _count_recorded(test_media_item_recorder.sqlite_db_path) == 1000
+
+    def test_close(self, tmp_path, test_photo_media_item):
+        sqlite_db_path = Path(tmp_path, "test.db")
+        recorder = MediaItemRecorder(sqlite_db_path, flush_interval=60)
+
+        recorder.add(test_photo_media_item)
+        recorder.close()
+        assert _count_recorded(sqlite_db_path) == 1
+
+        # Usable again after being closed
+        recorder.add(test_photo_media_item.replace(id="other"))
+        recorder.close()
+        assert _count_recorded(sqlite_db_path) == 2
+
+    def test_closed_on_exit(self, mocker, tmp_path, test_photo_media_item):
+        atexit_mock = mocker.patch("google_photos_archiver.media_item_recorder.atexit")
+        recorder = MediaItemRecorder(Path(tmp_path, "test.db"), flush_interval=60)
+
+        recorder.add(test_photo_media_item)
+        atexit_mock.register.assert_called_once_with(recorder.close)
+
+        recorder.close()
+        atexit_mock.unregister.assert_called_once_with(recorder.close)
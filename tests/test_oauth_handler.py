@@ -3,8 +3,10 @@ from pathlib import Path
 
 import pytest
 
+from google_photos_archiver.http_session import PooledSession
 from google_photos_archiver.oauth_handler import GoogleOauthHandler
-from tests.conftest import MockSuccessResponse
+from google_photos_archiver.retry import RetryPolicy
+from tests.conftest import MockFailureResponse, MockSuccessResponse
 
 TEST_CLIENT_ID = "TEST_CLIENT_ID"
 TEST_CLIENT_SECRET = "TEST_CLIENT_SECRET"
@@ -74,3 +76,101 @@ class TestGoogleOauthHandler:
         )
 
         assert google_oauth_handler.token == new_access_token
+
+    def test_refresh_shares_session_and_retry_policy(self, mocker, tmp_path):
+        refresh_token_path = Path(tmp_path, "refresh_token")
+        with refresh_token_path.open("w") as f:
+            f.write(TEST_REFRESH_TOKEN)
+        session = PooledSession()
+        mock_post = mocker.patch.object(
+            session,
+            "post",
+            side_effect=[
+                MockFailureResponse(status_code=503),
+                _access_token_response(TEST_TOKEN),
+            ],
+        )
+        mocker.patch("google_photos_archiver.retry.time.sleep")
+        retry_policy = RetryPolicy()
+
+        google_oauth_handler = GoogleOauthHandler(
+            Path(tmp_path, "client_secret.json"),
+            refresh_token_path,
+            session=session,
+            retry_policy=retry_policy,
+        )
+
+        assert google_oauth_handler.token == TEST_TOKEN
+        assert mock_post.call_count == 2
+        assert retry_policy.stats.retries == {"refresh_existing_token": 1}
+
+
+def _access_token_response(access_token, expires_in=3600):
+    return MockSuccessResponse(
+        bytes(
+            json.dumps({"access_token": access_token, "expires_in": expires_in}),
+            "utf-8",
+        )
+    )
+
+
+class TestAccessTokenRefresh:
+    @pytest.fixture()
+    def refresh_token_path(self, tmp_path):
+        refresh_token_path = Path(tmp_path, "refresh_token")
+        with refresh_token_path.open("w") as f:
+            f.write(TEST_REFRESH_TOKEN)
+        return refresh_token_path
+
+    @pytest.fixture()
+    def mock_post(self, mocker):
+        return mocker.patch(
+            "google_photos_archiver.oauth_handler.requests.post",
+            side_effect=[_access_token_response(f"token_{i}") for i in range(3)],
+        )
+
+    def test_token_is_refreshed_before_it_expires(
+        self, tmp_path, refresh_token_path, mock_post, clock
+    ):
+        google_oauth_handler = GoogleOauthHandler(
+            Path(tmp_path, "client_secret.json"),
+            refresh_token_path,
+            refresh_margin_seconds=300,
+            clock=clock,
+        )
+        assert google_oauth_handler.token == "token_0"
+
+        clock.now = 3299
+        assert google_oauth_handler.token == "token_0"
+
+        clock.now = 3300
+        assert google_oauth_handler.token == "token_1"
+        assert mock_post.call_count == 2
+
+    def test_valid_token_is_used_while_another_thread_refreshes(
+        self, tmp_path, refresh_token_path, mock_post, clock
+    ):
+        google_oauth_handler = GoogleOauthHandler(
+            Path(tmp_path, "client_secret.json"),
+            refresh_token_path,
+            refresh_margin_seconds=300,
+            clock=clock,
+        )
+        clock.now = 3300
+
+        # pylint: disable=protected-access
+        with google_oauth_handler._refresh_lock:
+            assert google_oauth_handler.token == "token_0"
+        assert mock_post.call_count == 1
+
+    def test_rejected_token_is_only_refreshed_once(
+        self, tmp_path, refresh_token_path, mock_post
+    ):
+        google_oauth_handler = GoogleOauthHandler(
+            Path(tmp_path, "client_secret.json"), refresh_token_path
+        )
+
+        assert google_oauth_handler.refresh_access_token("token_0") == "token_1"
+        # A concurrent request that was rejected with the same token gets the new one
+        assert google_oauth_handler.refresh_access_token("token_0") == "token_1"
+        assert mock_post.call_count == 2
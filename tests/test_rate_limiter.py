@@ -0,0 +1,176 @@
+from datetime import datetime, time
+
+import pytest
+
+from google_photos_archiver.rate_limiter import (
+    ApiRequestBudgetExhausted,
+    BandwidthSchedule,
+    RateLimiter,
+    TokenBucket,
+    parse_byte_rate,
+)
+from tests.conftest import MockFailureResponse, MockSuccessResponse
+
+
+class TestTokenBucket:
+    def test_invalid_rate(self):
+        with pytest.raises(ValueError):
+            TokenBucket(rate=0)
+
+    def test_reserve(self, clock):
+        token_bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+
+        assert token_bucket.reserve() == 0
+        assert token_bucket.reserve() == 0
+        assert token_bucket.reserve() == 0.5
+        # Reservations queue up behind each other
+        assert token_bucket.reserve() == 1.0
+
+        clock.now += 10
+        assert token_bucket.reserve(2) == 0
+        assert token_bucket.reserve() == 0.5
+
+    def test_acquire_sleeps(self, mocker, clock):
+        sleep_mock = mocker.patch("google_photos_archiver.rate_limiter.time.sleep")
+        token_bucket = TokenBucket(rate=100, clock=clock)
+
+        assert token_bucket.acquire(150) == 0.5
+        sleep_mock.assert_called_once_with(0.5)
+
+    def test_set_rate(self, clock):
+        token_bucket = TokenBucket(rate=10, clock=clock)
+
+        assert token_bucket.reserve(20) == 1.0
+        token_bucket.set_rate(20)
+        # The debt is paid off at the new rate
+        assert token_bucket.reserve(0) == 0.5
+        assert token_bucket.capacity == 20
+
+
+@pytest.mark.parametrize(
+    "byte_rate, expected_result",
+    [
+        ("100", 100),
+        ("500K", 500_000),
+        ("5MB", 5_000_000),
+        ("1.5 gib", 1.5 * 1024**3),
+        ("Unlimited", None),
+    ],
+)
+def test_parse_byte_rate(byte_rate, expected_result):
+    assert parse_byte_rate(byte_rate) == expected_result
+
+
+@pytest.mark.parametrize("byte_rate", ["", "0", "-1M", "5 TB", "fast"])
+def test_parse_byte_rate_invalid(byte_rate):
+    with pytest.raises(ValueError):
+        parse_byte_rate(byte_rate)
+
+
+class TestBandwidthSchedule:
+    @pytest.mark.parametrize(
+        "now, expected_rate",
+        [
+            (time(0, 59), 5_000_000),
+            (time(1, 0), None),
+            (time(5, 59), None),
+            (time(6, 0), 5_000_000),
+            (time(23, 0), 1_000_000),
+            (time(0, 15), 1_000_000),
+            (time(0, 30), 5_000_000),
+        ],
+    )
+    def test_get_rate(self, now, expected_rate):
+        bandwidth_schedule = BandwidthSchedule.from_string(
+            "01:00-06:00=unlimited, 22:00-00:30=1M", default_rate=5_000_000
+        )
+        assert bandwidth_schedule.get_rate(now) == expected_rate
+
+    @pytest.mark.parametrize(
+        "schedule", ["01:00-06:00", "1am-6am=1M", "01:00=1M", "01:00-06:00=fast"]
+    )
+    def test_invalid_schedule(self, schedule):
+        with pytest.raises(ValueError, match="Invalid bandwidth schedule window"):
+            BandwidthSchedule.from_string(schedule)
+
+
+class TestRateLimiter:
+    def test_unlimited(self, mocker):
+        sleep_mock = mocker.patch("google_photos_archiver.rate_limiter.time.sleep")
+        rate_limiter = RateLimiter()
+
+        for _ in range(1000):
+            assert rate_limiter.acquire_api_request() == 0
+            assert rate_limiter.acquire_media_bytes(1024**3) == 0
+
+        sleep_mock.assert_not_called()
+
+    def test_separate_buckets(self, mocker):
+        mocker.patch("google_photos_archiver.rate_limiter.time.sleep")
+        rate_limiter = RateLimiter(
+            api_requests_per_minute=60, media_bytes_per_second=1024
+        )
+
+        assert rate_limiter.acquire_media_bytes(2048) > 0
+        assert rate_limiter.acquire_api_request() == 0
+        assert rate_limiter.acquire_api_request() > 0
+
+    def test_api_requests_per_day(self):
+        now = datetime(2021, 1, 18, 23, 0)
+        rate_limiter = RateLimiter(api_requests_per_day=2, now=lambda: now)
+
+        rate_limiter.acquire_api_request()
+        rate_limiter.acquire_api_request()
+        with pytest.raises(ApiRequestBudgetExhausted, match="daily budget of 2"):
+            rate_limiter.acquire_api_request()
+
+        now = datetime(2021, 1, 19, 0, 0)
+        assert rate_limiter.acquire_api_request() == 0
+
+    def test_rest_client_acquires_api_requests(
+        self, mocker, google_photos_api_rest_client
+    ):
+        mocker.patch("google_photos_archiver.http_session.PooledSession.get")
+        mocker.patch("google_photos_archiver.http_session.PooledSession.post")
+        acquire_mock = mocker.patch.object(
+            google_photos_api_rest_client.rate_limiter, "acquire_api_request"
+        )
+
+        google_photos_api_rest_client.get_albums()
+        google_photos_api_rest_client.get_media_items()
+        google_photos_api_rest_client.search_media_items()
+
+        assert acquire_mock.call_count == 3
+
+    def test_rest_client_acquires_an_api_request_per_attempt(
+        self, mocker, google_photos_api_rest_client
+    ):
+        mocker.patch("google_photos_archiver.retry.time.sleep")
+        mocker.patch(
+            "google_photos_archiver.http_session.PooledSession.get",
+            side_effect=[MockFailureResponse(status_code=503), MockSuccessResponse()],
+        )
+        acquire_mock = mocker.patch.object(
+            google_photos_api_rest_client.rate_limiter, "acquire_api_request"
+        )
+
+        google_photos_api_rest_client.get_albums()
+
+        assert acquire_mock.call_count == 2
+
+    def test_media_bytes_schedule(self, mocker):
+        mocker.patch("google_photos_archiver.rate_limiter.time.sleep")
+        now = datetime(2021, 1, 18, 3, 0)
+        rate_limiter = RateLimiter(
+            media_bytes_per_second=1024,
+            media_bytes_schedule=BandwidthSchedule.from_string(
+                "01:00-06:00=unlimited", default_rate=1024
+            ),
+            now=lambda: now,
+        )
+
+        assert rate_limiter.acquire_media_bytes(1024**3) == 0
+
+        now = datetime(2021, 1, 18, 6, 0)
+        assert rate_limiter.acquire_media_bytes(2048) > 0
+        assert rate_limiter.reserve_media_bytes(1024) > 0
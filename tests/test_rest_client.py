@@ -1,17 +1,28 @@
+import copy
 import json
 
 import pytest
 
 from google_photos_archiver.album import create_album
+from google_photos_archiver.filters import Date, DateRange
 from google_photos_archiver.media_item import create_media_item
-from google_photos_archiver.rest_client import GooglePhotosApiRestClientError
-from tests.conftest import MockFailureResponse, MockSuccessResponse, test_date_filter
+from google_photos_archiver.rest_client import (
+    GooglePhotosApiRestClientError,
+    PaginationResponseKey,
+    create_album_or_media_item,
+)
+from tests.conftest import (
+    MockFailureResponse,
+    MockSuccessResponse,
+    test_date_filter,
+    test_date_range,
+)
 
 
 class TestGooglePhotosApiRestClient:
     def test_get_albums_success(self, google_photos_api_rest_client, mocker):
         mock_get = mocker.patch(
-            "google_photos_archiver.rest_client.requests.get",
+            "google_photos_archiver.http_session.PooledSession.get",
             return_value=MockSuccessResponse(),
         )
         get_albums_response = google_photos_api_rest_client.get_albums()
@@ -24,7 +35,7 @@ class TestGooglePhotosApiRestClient:
 
     def test_get_albums_failure(self, google_photos_api_rest_client, mocker):
         mock_get = mocker.patch(
-            "google_photos_archiver.rest_client.requests.get",
+            "google_photos_archiver.http_session.PooledSession.get",
             return_value=MockFailureResponse(),
         )
         with pytest.raises(
@@ -41,7 +52,7 @@ class TestGooglePhotosApiRestClient:
         self, google_photos_api_rest_client, mocker, test_album_dict
     ):
         mocker.patch(
-            "google_photos_archiver.rest_client.requests.get",
+            "google_photos_archiver.http_session.PooledSession.get",
             side_effect=[
                 MockSuccessResponse(
                     bytes(
@@ -73,7 +84,7 @@ class TestGooglePhotosApiRestClient:
 
     def test_get_media_items_success(self, google_photos_api_rest_client, mocker):
         mock_get = mocker.patch(
-            "google_photos_archiver.rest_client.requests.get",
+            "google_photos_archiver.http_session.PooledSession.get",
             return_value=MockSuccessResponse(),
         )
         get_media_items_response = google_photos_api_rest_client.get_media_items()
@@ -81,15 +92,15 @@ class TestGooglePhotosApiRestClient:
         mock_get.assert_called_with(
             "https://photoslibrary.googleapis.com/v1/mediaItems",
             headers={"Authorization": "Bearer TEST_TOKEN"},
-            params={"pageSize": 25},
+            params={"pageSize": 100},
         )
 
     @pytest.mark.parametrize(
         "params,expected_params",
         [
-            (None, dict(pageSize=25)),
+            (None, dict(pageSize=100)),
             (dict(page_size=123), dict(pageSize=123)),
-            (dict(page_token="abc"), dict(pageSize=25, pageToken="abc")),
+            (dict(page_token="abc"), dict(pageSize=100, pageToken="abc")),
             (
                 dict(page_size=123, page_token="abc"),
                 dict(pageSize=123, pageToken="abc"),
@@ -100,7 +111,7 @@ class TestGooglePhotosApiRestClient:
         self, mocker, google_photos_api_rest_client, params, expected_params
     ):
         mock_get = mocker.patch(
-            "google_photos_archiver.rest_client.requests.get",
+            "google_photos_archiver.http_session.PooledSession.get",
             return_value=MockSuccessResponse(),
         )
         if params is None:
@@ -118,7 +129,7 @@ class TestGooglePhotosApiRestClient:
 
     def test_get_media_items_failure(self, google_photos_api_rest_client, mocker):
         mock_get = mocker.patch(
-            "google_photos_archiver.rest_client.requests.get",
+            "google_photos_archiver.http_session.PooledSession.get",
             return_value=MockFailureResponse(),
         )
         with pytest.raises(
@@ -128,7 +139,7 @@ class TestGooglePhotosApiRestClient:
         mock_get.assert_called_with(
             "https://photoslibrary.googleapis.com/v1/mediaItems",
             headers={"Authorization": "Bearer TEST_TOKEN"},
-            params={"pageSize": 25},
+            params={"pageSize": 100},
         )
 
     def test_get_media_items_paginated(
@@ -139,7 +150,7 @@ class TestGooglePhotosApiRestClient:
         test_video_media_item_dict,
     ):
         mocker.patch(
-            "google_photos_archiver.rest_client.requests.get",
+            "google_photos_archiver.http_session.PooledSession.get",
             side_effect=[
                 MockSuccessResponse(
                     bytes(
@@ -170,9 +181,70 @@ class TestGooglePhotosApiRestClient:
 
         assert list(media_items) == [photo_media_item, video_media_item]
 
+    def test_get_media_items_paginated_resumes_from_checkpoint(
+        self,
+        google_photos_api_rest_client,
+        mocker,
+        test_listing_checkpoint,
+        test_photo_media_item_dict,
+        test_video_media_item_dict,
+    ):
+        photo_media_item = create_media_item(copy.deepcopy(test_photo_media_item_dict))
+        video_media_item = create_media_item(copy.deepcopy(test_video_media_item_dict))
+        google_photos_api_rest_client.listing_checkpoint = test_listing_checkpoint
+
+        mock_get = mocker.patch(
+            "google_photos_archiver.http_session.PooledSession.get",
+            side_effect=[
+                MockSuccessResponse(
+                    bytes(
+                        json.dumps(
+                            {
+                                "mediaItems": [test_photo_media_item_dict],
+                                "nextPageToken": "abc123",
+                            }
+                        ),
+                        "utf-8",
+                    )
+                ),
+                RuntimeError("Interrupted"),
+            ],
+        )
+        media_items = google_photos_api_rest_client.get_media_items_paginated()
+        with pytest.raises(RuntimeError, match="Interrupted"):
+            list(media_items)
+
+        mock_get.side_effect = [
+            MockSuccessResponse(
+                bytes(
+                    json.dumps({"mediaItems": [test_video_media_item_dict]}),
+                    "utf-8",
+                )
+            )
+        ]
+        media_items = google_photos_api_rest_client.get_media_items_paginated()
+
+        assert list(media_items) == [photo_media_item, video_media_item]
+        mock_get.assert_called_with(
+            "https://photoslibrary.googleapis.com/v1/mediaItems",
+            headers={"Authorization": "Bearer TEST_TOKEN"},
+            params={"pageSize": 100, "pageToken": "abc123"},
+        )
+        assert (
+            test_listing_checkpoint.get_progress('{"operation": "get_media_items"}')
+            is None
+        )
+
+        # Nothing was archived, so only the pending MediaItems get resumed
+        mock_get.reset_mock()
+        media_items = google_photos_api_rest_client.get_media_items_paginated()
+
+        assert list(media_items) == [photo_media_item, video_media_item]
+        mock_get.assert_not_called()
+
     def test_search_media_items_success(self, google_photos_api_rest_client, mocker):
         mock_post = mocker.patch(
-            "google_photos_archiver.rest_client.requests.post",
+            "google_photos_archiver.http_session.PooledSession.post",
             return_value=MockSuccessResponse(),
         )
         search_media_items_response = google_photos_api_rest_client.search_media_items()
@@ -208,7 +280,7 @@ class TestGooglePhotosApiRestClient:
         self, mocker, google_photos_api_rest_client, _json, expected_json
     ):
         mock_get = mocker.patch(
-            "google_photos_archiver.rest_client.requests.post",
+            "google_photos_archiver.http_session.PooledSession.post",
             return_value=MockSuccessResponse(),
         )
         if _json is None:
@@ -229,7 +301,7 @@ class TestGooglePhotosApiRestClient:
 
     def test_search_media_items_failure(self, google_photos_api_rest_client, mocker):
         mock_get = mocker.patch(
-            "google_photos_archiver.rest_client.requests.post",
+            "google_photos_archiver.http_session.PooledSession.post",
             return_value=MockFailureResponse(),
         )
         with pytest.raises(
@@ -252,7 +324,7 @@ class TestGooglePhotosApiRestClient:
         test_video_media_item_dict,
     ):
         mocker.patch(
-            "google_photos_archiver.rest_client.requests.post",
+            "google_photos_archiver.http_session.PooledSession.post",
             side_effect=[
                 MockSuccessResponse(
                     bytes(
@@ -282,3 +354,158 @@ class TestGooglePhotosApiRestClient:
         video_media_item = create_media_item(test_video_media_item_dict)
 
         assert list(media_items) == [photo_media_item, video_media_item]
+
+    def test_batch_get_media_items_success(self, google_photos_api_rest_client, mocker):
+        mock_get = mocker.patch(
+            "google_photos_archiver.http_session.PooledSession.get",
+            return_value=MockSuccessResponse(),
+        )
+        batch_get_response = google_photos_api_rest_client.batch_get_media_items(
+            ["a", "b"]
+        )
+        assert batch_get_response.ok
+        mock_get.assert_called_with(
+            "https://photoslibrary.googleapis.com/v1/mediaItems:batchGet",
+            headers={"Authorization": "Bearer TEST_TOKEN"},
+            params={"mediaItemIds": ["a", "b"]},
+        )
+
+    def test_batch_get_media_items_too_many_ids(self, google_photos_api_rest_client):
+        with pytest.raises(ValueError, match="up to 50 MediaItems"):
+            google_photos_api_rest_client.batch_get_media_items(
+                [str(i) for i in range(51)]
+            )
+
+    def test_get_media_items_by_ids(
+        self, google_photos_api_rest_client, mocker, test_photo_media_item_dict
+    ):
+        mock_get = mocker.patch(
+            "google_photos_archiver.http_session.PooledSession.get",
+            side_effect=[
+                MockSuccessResponse(
+                    bytes(
+                        json.dumps(
+                            {
+                                "mediaItemResults": [
+                                    {"mediaItem": test_photo_media_item_dict},
+                                    {"status": {"code": 5, "message": "Not found"}},
+                                ]
+                            }
+                        ),
+                        "utf-8",
+                    )
+                ),
+                MockSuccessResponse(
+                    bytes(json.dumps({"mediaItemResults": []}), "utf-8")
+                ),
+            ],
+        )
+
+        media_item_ids = [str(i) for i in range(60)]
+        media_items = google_photos_api_rest_client.get_media_items_by_ids(
+            media_item_ids
+        )
+
+        assert list(media_items) == [create_media_item(test_photo_media_item_dict)]
+        assert [
+            call.kwargs["params"]["mediaItemIds"] for call in mock_get.call_args_list
+        ] == [media_item_ids[:50], media_item_ids[50:]]
+
+    def test_unauthorized_request_is_retried_with_refreshed_token(
+        self, google_photos_api_rest_client, mocker
+    ):
+        oauth_handler = google_photos_api_rest_client.oauth_handler
+        oauth_handler.refresh_access_token.return_value = "NEW_TOKEN"
+        mock_get = mocker.patch(
+            "google_photos_archiver.http_session.PooledSession.get",
+            side_effect=[MockFailureResponse(status_code=401), MockSuccessResponse()],
+        )
+
+        assert google_photos_api_rest_client.get_albums().ok
+
+        oauth_handler.refresh_access_token.assert_called_once_with(
+            rejected_token="TEST_TOKEN"
+        )
+        assert [call.kwargs["headers"] for call in mock_get.call_args_list] == [
+            {"Authorization": "Bearer TEST_TOKEN"},
+            {"Authorization": "Bearer NEW_TOKEN"},
+        ]
+
+    def test_search_media_items_sharded(
+        self,
+        google_photos_api_rest_client,
+        mocker,
+        test_photo_media_item_dict,
+        test_video_media_item_dict,
+    ):
+        def post(_url, **kwargs):
+            # Both shards return the photo, the second one the video as well
+            date_range = kwargs["json"]["filters"]["dateFilter"]["ranges"][0]
+            media_item_dicts = [test_photo_media_item_dict]
+            if date_range["startDate"]["year"] == 2021:
+                media_item_dicts.append(test_video_media_item_dict)
+            return MockSuccessResponse(
+                bytes(json.dumps({"mediaItems": media_item_dicts}), "utf-8")
+            )
+
+        mock_post = mocker.patch(
+            "google_photos_archiver.http_session.PooledSession.post", side_effect=post
+        )
+        media_items = google_photos_api_rest_client.search_media_items_sharded(
+            [test_date_range(), DateRange(Date(2021, 1, 1), Date(2021, 12, 31))],
+            max_workers=2,
+        )
+
+        assert sorted(media_item.id for media_item in media_items) == sorted(
+            [test_photo_media_item_dict["id"], test_video_media_item_dict["id"]]
+        )
+        assert all(
+            call.kwargs["json"]["filters"]["includeArchivedMedia"]
+            for call in mock_post.call_args_list
+        )
+
+    def test_search_media_items_by_dates(
+        self,
+        google_photos_api_rest_client,
+        mocker,
+        test_photo_media_item_dict,
+        test_video_media_item_dict,
+    ):
+        def post(_url, **kwargs):
+            # Every search returns the photo, the one of the last Date the video as well
+            dates = kwargs["json"]["filters"]["dateFilter"]["dates"]
+            media_item_dicts = [test_photo_media_item_dict]
+            if dates == [dict(year=2021, month=1, day=6)]:
+                media_item_dicts.append(test_video_media_item_dict)
+            return MockSuccessResponse(
+                bytes(json.dumps({"mediaItems": media_item_dicts}), "utf-8")
+            )
+
+        mock_post = mocker.patch(
+            "google_photos_archiver.http_session.PooledSession.post", side_effect=post
+        )
+        media_items = google_photos_api_rest_client.search_media_items_by_dates(
+            dates=[Date(2021, 1, day) for day in range(1, 7)], max_workers=2
+        )
+
+        assert sorted(media_item.id for media_item in media_items) == sorted(
+            [test_photo_media_item_dict["id"], test_video_media_item_dict["id"]]
+        )
+        assert sorted(
+            len(call.kwargs["json"]["filters"]["dateFilter"]["dates"])
+            for call in mock_post.call_args_list
+        ) == [1, 5]
+
+
+def test_create_album_or_media_item(test_album_dict, test_photo_media_item_dict):
+    assert create_album_or_media_item(
+        copy.deepcopy(test_album_dict), PaginationResponseKey.Albums
+    ) == create_album(copy.deepcopy(test_album_dict))
+    assert create_album_or_media_item(
+        test_photo_media_item_dict, PaginationResponseKey.MediaItems
+    ) == create_media_item(test_photo_media_item_dict)
+
+    with pytest.raises(
+        GooglePhotosApiRestClientError, match="Unable to `create_album_or_media_item`"
+    ):
+        create_album_or_media_item(test_album_dict, PaginationResponseKey.MediaItems)
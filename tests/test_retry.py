@@ -0,0 +1,186 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+import requests
+
+from google_photos_archiver.rest_client import GooglePhotosApiRestClientError
+from google_photos_archiver.retry import RetryPolicy, RetryStats, parse_retry_after
+from tests.conftest import MockFailureResponse, MockSuccessResponse
+
+
+@pytest.fixture(name="sleep_mock")
+def _sleep_mock(mocker):
+    return mocker.patch("google_photos_archiver.retry.time.sleep")
+
+
+def _response(status_code: int, retry_after: str = None) -> MockFailureResponse:
+    response = MockFailureResponse(status_code=status_code)
+    if retry_after is not None:
+        response.headers["Retry-After"] = retry_after
+    return response
+
+
+@pytest.mark.parametrize(
+    "retry_after,expected_seconds",
+    [(None, None), ("120", 120.0), ("-1", 0.0), ("not a date", None)],
+)
+def test_parse_retry_after(retry_after, expected_seconds):
+    assert parse_retry_after(retry_after) == expected_seconds
+
+
+def test_parse_retry_after_http_date():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=60)
+    assert 55 < parse_retry_after(format_datetime(retry_at, usegmt=True)) <= 60
+
+
+def test_retry_stats():
+    retry_stats = RetryStats()
+    assert not retry_stats
+
+    retry_stats.record_retry("b")
+    retry_stats.record_retry("a")
+    retry_stats.record_failure("a")
+
+    assert retry_stats
+    assert str(retry_stats) == "a: 1 retried / 1 failed, b: 1 retried / 0 failed"
+
+
+class TestRetryPolicy:
+    @pytest.mark.parametrize(
+        "err,expected",
+        [
+            (requests.ConnectionError(), True),
+            (requests.Timeout(), True),
+            (requests.HTTPError(response=_response(503)), True),
+            (requests.HTTPError(response=_response(429)), True),
+            (requests.HTTPError(response=_response(404)), False),
+            (ValueError(), False),
+        ],
+    )
+    def test_is_retryable(self, err, expected):
+        assert RetryPolicy().is_retryable(err) is expected
+
+    def test_is_retryable_follows_causes(self):
+        try:
+            try:
+                raise requests.ConnectionError()
+            except requests.ConnectionError as err:
+                raise RuntimeError("Gave up") from err
+        except RuntimeError as err:
+            assert RetryPolicy().is_retryable(err) is True
+
+    def test_get_delay_is_jittered_exponential_backoff(self, mocker):
+        uniform_mock = mocker.patch(
+            "google_photos_archiver.retry.random.uniform", return_value=1.23
+        )
+        retry_policy = RetryPolicy(base_delay=1, max_delay=10)
+
+        assert retry_policy.get_delay(1) == 1.23
+        uniform_mock.assert_called_with(0, 1)
+        retry_policy.get_delay(3)
+        uniform_mock.assert_called_with(0, 4)
+        retry_policy.get_delay(10)
+        uniform_mock.assert_called_with(0, 10)
+
+    def test_get_delay_honors_retry_after(self):
+        assert RetryPolicy().get_delay(1, retry_after=42) == 42
+
+    def test_send_retries(self, mocker, sleep_mock):
+        on_throttled_mock = mocker.Mock()
+        retry_policy = RetryPolicy(on_throttled=on_throttled_mock)
+        send_mock = mocker.Mock(
+            side_effect=[
+                requests.ConnectionError(),
+                _response(503),
+                _response(429, retry_after="7"),
+                MockSuccessResponse(),
+            ]
+        )
+
+        response = retry_policy.send("test_call", send_mock, "a", b="c")
+
+        assert response.ok
+        send_mock.assert_called_with("a", b="c")
+        assert send_mock.call_count == 4
+        assert sleep_mock.call_count == 3
+        sleep_mock.assert_called_with(7.0)
+        on_throttled_mock.assert_called_once_with(7.0)
+        assert retry_policy.stats.retries == {"test_call": 3}
+        assert retry_policy.stats.failures == {}
+
+    def test_send_does_not_retry_client_errors(self, mocker, sleep_mock):
+        send_mock = mocker.Mock(return_value=_response(404))
+
+        assert RetryPolicy().send("test_call", send_mock).status_code == 404
+        sleep_mock.assert_not_called()
+
+    @pytest.mark.usefixtures("sleep_mock")
+    def test_send_returns_last_response_after_too_many_attempts(self, mocker):
+        retry_policy = RetryPolicy(max_attempts=3)
+        send_mock = mocker.Mock(return_value=_response(500))
+
+        assert retry_policy.send("test_call", send_mock).status_code == 500
+        assert send_mock.call_count == 3
+        assert retry_policy.stats.failures == {"test_call": 1}
+
+    @pytest.mark.usefixtures("sleep_mock")
+    def test_send_raises_after_too_many_attempts(self, mocker):
+        send_mock = mocker.Mock(side_effect=requests.ConnectionError())
+
+        with pytest.raises(requests.ConnectionError):
+            RetryPolicy(max_attempts=2).send("test_call", send_mock)
+        assert send_mock.call_count == 2
+
+    @pytest.mark.usefixtures("sleep_mock")
+    def test_without_retries(self, mocker):
+        retry_policy = RetryPolicy()
+        send_mock = mocker.Mock(return_value=_response(503))
+
+        single_attempt_policy = retry_policy.without_retries()
+
+        assert single_attempt_policy.send("test_call", send_mock).status_code == 503
+        assert single_attempt_policy.stats is retry_policy.stats
+        send_mock.assert_called_once()
+        assert not retry_policy.stats
+
+    @pytest.mark.usefixtures("sleep_mock")
+    def test_with_on_throttled(self, mocker):
+        api_on_throttled_mock = mocker.Mock()
+        retry_policy = RetryPolicy(max_attempts=2, on_throttled=api_on_throttled_mock)
+        on_throttled_mock = mocker.Mock()
+        send_mock = mocker.Mock(side_effect=[_response(429), MockSuccessResponse()])
+
+        download_policy = retry_policy.with_on_throttled(on_throttled_mock)
+
+        assert download_policy.send("test_call", send_mock).ok
+        assert download_policy.max_attempts == 2
+        assert download_policy.stats is retry_policy.stats
+        on_throttled_mock.assert_called_once()
+        api_on_throttled_mock.assert_not_called()
+
+
+@pytest.mark.usefixtures("sleep_mock")
+def test_rest_client_retries(mocker, google_photos_api_rest_client):
+    mocker.patch(
+        "google_photos_archiver.http_session.PooledSession.get",
+        side_effect=[_response(503), requests.ConnectionError(), MockSuccessResponse()],
+    )
+
+    assert google_photos_api_rest_client.get_media_items().ok
+    assert google_photos_api_rest_client.retry_policy.stats.retries == {
+        "get_media_items": 2
+    }
+
+
+@pytest.mark.usefixtures("sleep_mock")
+def test_rest_client_gives_up(mocker, google_photos_api_rest_client):
+    mocker.patch(
+        "google_photos_archiver.http_session.PooledSession.get",
+        side_effect=requests.ConnectionError(),
+    )
+
+    with pytest.raises(
+        GooglePhotosApiRestClientError, match="Failed to execute: `get_albums`"
+    ):
+        google_photos_api_rest_client.get_albums()